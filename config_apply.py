@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from singbox_validate import validate_config, print_errors
+
+# 被替换下来的旧配置保存在此目录 (每个目标文件一个子目录)，可通过 CONFIG_STORE_DIR 环境变量修改
+DEFAULT_STORE_DIR = os.getenv(
+    "CONFIG_STORE_DIR",
+    os.path.join(os.path.expanduser("~/.cache"), "fhs-install-v2ray", "config_versions")
+)
+DEFAULT_KEEP = 5
+
+SERVICE_NAME = "sing-box"
+HEALTH_TIMEOUT = float(os.getenv("APPLY_HEALTH_TIMEOUT", "15"))  # 重载后等待服务恢复健康的时间 (秒)
+HEALTH_POLL_INTERVAL = 0.5
+# 没有 Clash API 时，服务需连续保持 active 且未被重启的时间 (秒)，用于识别启动后立即崩溃重启的情况
+HEALTH_STABLE_SECONDS = float(os.getenv("APPLY_HEALTH_STABLE", "3"))
+
+
+def atomic_write(path, data, mode=None):
+    """原子写入文件：同目录临时文件 -> fsync -> os.replace -> fsync 目录
+
+    读取方要么看到完整的旧文件，要么看到完整的新文件；已存在的文件保留原有权限，
+    指定 mode 时总是使用该权限 (临时文件创建时即为 0600，内容不会以更宽的权限出现)。
+    data 可以是 str / bytes，也可以是逐块写入的 str / bytes-like 可迭代对象。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    chunks = [data] if isinstance(data, (str, bytes, bytearray, memoryview)) else data
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        elif os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        else:
+            # mkstemp 创建的文件权限为 0600，新文件改为按 umask 的默认权限
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # 部分平台不支持打开目录
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_json(path, data, mode=None):
+    """以 2 空格缩进原子写入 JSON (与各工具原有的输出格式一致)"""
+    atomic_write(path, json.dumps(data, indent=2, ensure_ascii=False), mode)
+
+
+class VersionStore:
+    """保存最近 keep 个被替换下来的配置版本，用于回滚"""
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR, keep=DEFAULT_KEEP):
+        self.store_dir = store_dir
+        self.keep = keep
+
+    def _dir_for(self, path):
+        name = re.sub(r'[^A-Za-z0-9_.-]+', '_', os.path.abspath(path)).strip('_')
+        return os.path.join(self.store_dir, name)
+
+    def versions(self, path):
+        """返回 path 的历史版本路径列表 (从旧到新)"""
+        directory = self._dir_for(path)
+        if not os.path.isdir(directory):
+            return []
+        return [os.path.join(directory, f) for f in sorted(os.listdir(directory)) if f.endswith(".json")]
+
+    def snapshot(self, path):
+        """保存 path 的当前内容，返回版本文件路径 (文件不存在时返回 None)"""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            data = f.read()
+        versions = self.versions(path)
+        if versions:
+            with open(versions[-1], 'rb') as f:
+                if f.read() == data:
+                    return versions[-1]  # 与最新版本相同，不重复保存
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1e6) % 10**6:06d}"
+        version = os.path.join(self._dir_for(path), f"{stamp}.json")
+        atomic_write(version, data)
+        for old in self.versions(path)[:-self.keep]:
+            os.unlink(old)
+        return version
+
+    def restore(self, version, path):
+        with open(version, 'rb') as f:
+            atomic_write(path, f.read())
+
+    def latest_different(self, path):
+        """最近一个与 path 当前内容不同的版本 (手动回滚的目标)，没有时返回 None"""
+        current = None
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                current = f.read()
+        for version in reversed(self.versions(path)):
+            with open(version, 'rb') as f:
+                if f.read() != current:
+                    return version
+        return None
+
+
+def commit_config(config, path, store=None):
+    """校验通过后保存旧版本并原子替换 path，返回 (是否成功, 旧版本路径)"""
+    errors = validate_config(config)
+    if errors:
+        print(f"Error: Config failed validation ({len(errors)} problem(s)), {path} left untouched:")
+        print_errors(errors)
+        return False, None
+    previous = (store or VersionStore()).snapshot(path)
+    write_json(path, config)
+    return True, previous
+
+
+def reload_service(service=SERVICE_NAME, action="restart"):
+    """通过 systemctl 重载/重启服务，返回是否成功；没有 systemctl 时返回 None"""
+    cmd = ["systemctl", action, service]
+    if os.geteuid() != 0:
+        cmd.insert(0, "sudo")
+    print(f"[*] Running: {' '.join(cmd)}")
+    try:
+        subprocess.run(cmd, check=True)
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"[!] Failed to {action} {service}: {e}")
+        return False
+    except FileNotFoundError:
+        print("[!] systemctl not found, skipping service reload.")
+        return None
+
+
+def service_active(service=SERVICE_NAME):
+    """systemctl is-active 检查；没有 systemctl 时返回 None"""
+    try:
+        return subprocess.run(["systemctl", "is-active", "--quiet", service]).returncode == 0
+    except FileNotFoundError:
+        return None
+
+
+def service_state(service=SERVICE_NAME):
+    """返回 systemctl show 的 NRestarts 与 ActiveEnterTimestampMonotonic，两者变化说明服务期间重启过；取不到时返回 None"""
+    try:
+        result = subprocess.run(
+            ["systemctl", "show", "-p", "NRestarts", "-p", "ActiveEnterTimestampMonotonic", service],
+            capture_output=True, text=True
+        )
+    except FileNotFoundError:
+        return None
+    if result.returncode != 0:
+        return None
+    return tuple(sorted(line.strip() for line in result.stdout.splitlines() if line.strip()))
+
+
+def clash_api(config):
+    """返回配置中 Clash API 的 (基础 URL, secret)，未开启时返回 None"""
+    api = config.get('experimental', {}).get('clash_api', {})
+    controller = api.get('external_controller')
+    if not controller:
+        return None
+    host, _, port = controller.rpartition(':')
+    if host in ("", "0.0.0.0", "::", "[::]"):
+        host = "127.0.0.1"
+    return f"http://{host}:{port}", api.get('secret', '')
+
+
+def api_healthy(base_url, secret="", timeout=2.0):
+    """Clash API /version 返回 200 即视为 sing-box 已正常加载配置"""
+    import http.client
+    import urllib.request
+    request = urllib.request.Request(f"{base_url}/version")
+    if secret:
+        request.add_header("Authorization", f"Bearer {secret}")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as resp:
+            return resp.status == 200
+    except (OSError, http.client.HTTPException):
+        return False
+
+
+def wait_healthy(config, service=SERVICE_NAME, timeout=HEALTH_TIMEOUT):
+    """在 timeout 秒内轮询服务状态与 Clash API，返回是否健康
+
+    有 Clash API 时以 /version 应答为准；没有时要求服务连续 HEALTH_STABLE_SECONDS 秒保持 active，
+    且 NRestarts / ActiveEnterTimestamp 不变 (Restart=on-failure 的崩溃循环在单次 is-active 时也可能是 active)。
+    """
+    api = clash_api(config)
+    deadline = time.monotonic() + timeout
+    stable_since = baseline = None
+    while True:
+        active = service_active(service)
+        if active is None and api is None:
+            print("[!] Neither systemctl nor Clash API available, assuming healthy.")
+            return True
+        if api is not None:
+            if active is not False and api_healthy(*api):
+                return True
+        elif active:
+            state = service_state(service)
+            if stable_since is None or state != baseline:
+                stable_since, baseline = time.monotonic(), state
+            elif time.monotonic() - stable_since >= HEALTH_STABLE_SECONDS:
+                return True
+        else:
+            stable_since = baseline = None
+        # deadline 前已开始的稳定观察期允许越过 deadline 走完，之后再重启则判定失败
+        now = time.monotonic()
+        if now >= deadline and (stable_since is None or stable_since >= deadline):
+            return False
+        time.sleep(HEALTH_POLL_INTERVAL)
+
+
+def verify_or_rollback(config, path, previous, service=SERVICE_NAME, action="restart", timeout=HEALTH_TIMEOUT, store=None):
+    """服务已使用新配置启动后检查健康状态，失败时恢复旧版本并再次重启，返回新配置是否保留"""
+    if wait_healthy(config, service, timeout):
+        print(f"[+] {service} is healthy with the new config.")
+        return True
+    print(f"[!] {service} did not become healthy within {timeout:g}s.")
+    if not previous:
+        print("[!] No previous version to roll back to.")
+        return False
+    print(f"[*] Rolling back {path} to {previous}")
+    (store or VersionStore()).restore(previous, path)
+    reload_service(service, action)
+    return False
+
+
+def apply_config(config, path, service=SERVICE_NAME, action="restart", timeout=HEALTH_TIMEOUT, store=None):
+    """事务式应用配置：校验 -> 保存旧版本 -> 原子替换 -> 重载服务 -> 健康检查，失败时自动回滚
+
+    返回新配置最终是否生效。
+    """
+    store = store or VersionStore()
+    ok, previous = commit_config(config, path, store)
+    if not ok:
+        return False
+    if reload_service(service, action) is False:
+        if previous:
+            print(f"[*] Rolling back {path} to {previous}")
+            store.restore(previous, path)
+            reload_service(service, action)
+        return False
+    return verify_or_rollback(config, path, previous, service, action, timeout, store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply a Sing-box config transactionally with automatic rollback.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    apply_p = sub.add_parser('apply', help='Validate, swap in, reload and health-check a new config')
+    apply_p.add_argument('config', help='New Sing-box config (JSON)')
+    rollback_p = sub.add_parser('rollback', help='Restore the most recent stored version that differs from the live config')
+    list_p = sub.add_parser('list', help='List stored versions')
+    for p in (apply_p, rollback_p, list_p):
+        p.add_argument('-t', '--target', default='/etc/sing-box/config.json', help='Live config path (default: /etc/sing-box/config.json)')
+    for p in (apply_p, rollback_p):
+        p.add_argument('--service', default=SERVICE_NAME, help=f'systemd service to reload (default: {SERVICE_NAME})')
+        p.add_argument('--action', choices=['restart', 'reload'], default='restart', help='systemctl action (default: restart)')
+    apply_p.add_argument('--timeout', type=float, default=HEALTH_TIMEOUT, help=f'Seconds to wait for health (default: {HEALTH_TIMEOUT:g})')
+    args = parser.parse_args()
+
+    store = VersionStore()
+    if args.command == 'list':
+        for version in store.versions(args.target):
+            print(version)
+        return
+
+    if args.command == 'rollback':
+        version = store.latest_different(args.target)
+        if not version:
+            print(f"Error: No stored version of {args.target} to roll back to")
+            sys.exit(1)
+        print(f"[*] Restoring {args.target} from {version}")
+        store.restore(version, args.target)
+        reload_service(args.service, args.action)
+        return
+
+    try:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error: Cannot read {args.config}: {e}")
+        sys.exit(1)
+    if not apply_config(config, args.target, args.service, args.action, args.timeout, store):
+        sys.exit(1)
+    print(f"[+] Applied {args.config} to {args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import re
+import secrets
+import shlex
+import subprocess
+import sys
+import time
+import uuid
+
+import config_apply
+import merge_configs
+from singbox_validate import PROXY_TYPES, validate_config, print_errors
+from metrics import Metrics
+
+# 运行指标 (通过 METRICS_EVENT_LOG / METRICS_PROM_FILE 环境变量输出)
+METRICS = Metrics("fleet_provision")
+
+DEFAULT_JOBS = 8
+DEFAULT_TIMEOUT = 900          # 单台服务器安装超时 (秒)
+DEFAULT_CONNECT_TIMEOUT = 10
+# ssh StrictHostKeyChecking：默认首次连接时记录主机密钥，之后密钥变化即拒绝连接
+DEFAULT_HOST_KEY_CHECKING = "accept-new"
+HOST_KEY_CHECKING_VALUES = {"yes", "accept-new", "no"}
+REPO_BRANCH = os.getenv("V2RAY_REPO_BRANCH", "master")
+INSTALL_URL = "https://raw.githubusercontent.com/JayYang1991/fhs-install-v2ray/{branch}/install-singbox-server.sh"
+
+# install-singbox-server.sh 支持的参数 (inventory 中 args 的键)
+INSTALL_FLAGS = {
+    "port", "domain", "uuid", "short-id", "log-level", "hy2-port", "hy2-domain",
+    "hy2-password", "hy2-up-mbps", "hy2-down-mbps", "hy2-masquerade",
+}
+
+# 安装脚本最后输出的客户端配置路径
+CLIENT_CONFIG_RE = re.compile(r"客户端配置文件:\s*(\S+)")
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+
+EXAMPLE_INVENTORY = """{
+  "defaults": {"user": "root", "args": {"port": 443, "domain": "www.cloudflare.com"}},
+  "hosts": [
+    {"name": "tokyo1", "host": "203.0.113.10"},
+    {"name": "la1", "host": "2001:db8::10", "user": "ubuntu", "args": {"hy2-port": 8443}},
+    {"name": "lab", "host": "singbox-test", "executor": "docker"}
+  ]
+}"""
+
+
+class SSHExecutor:
+    """通过 ssh 在远端执行 bash 脚本 (脚本从标准输入传入)"""
+
+    def __init__(self, host, user="root", port=22, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 host_key_checking=DEFAULT_HOST_KEY_CHECKING):
+        self.host = host
+        self.user = user
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.host_key_checking = host_key_checking
+
+    def command(self):
+        return ["ssh", "-T", "-o", f"StrictHostKeyChecking={self.host_key_checking}", "-o", "BatchMode=yes",
+                "-o", f"ConnectTimeout={self.connect_timeout}", "-p", str(self.port),
+                "-l", self.user, self.host, "bash -s"]
+
+    def run(self, script, timeout=DEFAULT_TIMEOUT):
+        """返回 (退出码, 标准输出, 标准错误)"""
+        try:
+            result = subprocess.run(self.command(), input=script, capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return 124, "", f"timed out after {timeout}s"
+        return result.returncode, result.stdout, result.stderr
+
+
+class DockerExecutor(SSHExecutor):
+    """在本地容器中执行，用于在不接触真实服务器的情况下测试安装流程"""
+
+    def command(self):
+        return ["docker", "exec", "-i", self.host, "bash", "-s"]
+
+
+class FakeExecutor:
+    """模拟安装脚本的输出与生成的客户端配置，不执行任何命令 (用于演练与测试)
+
+    客户端配置由本地模板按安装脚本的方式替换占位符生成；host 中包含 "fail" 时模拟安装失败。
+    """
+
+    def __init__(self, host, template="singbox_client_config.json", delay=0.2):
+        self.host = host
+        self.template = template
+        self.delay = delay
+        self.rendered = None
+
+    def run(self, script, timeout=DEFAULT_TIMEOUT):
+        time.sleep(self.delay)
+        if "fail" in self.host:
+            return 1, "", "error: 模拟安装失败"
+        if "install-singbox-server.sh" in script:
+            with open(self.template, 'r', encoding='utf-8') as f:
+                text = f.read()
+            placeholders = {
+                "{SINGBOX_SERVER_IP}": self.host,
+                "{SINGBOX_UUID}": str(uuid.uuid4()),
+                "{SINGBOX_DOMAIN}": "www.cloudflare.com",
+                "{SINGBOX_PUBLIC_KEY}": secrets.token_urlsafe(32)[:43],
+                "{SINGBOX_SHORT_ID}": secrets.token_hex(8),
+            }
+            for key, value in placeholders.items():
+                text = text.replace(key, value)
+            self.rendered = text
+            return 0, "info: 配置文件验证通过\n客户端配置文件: /tmp/singbox_client_config.fake.json\n", ""
+        if script.startswith("cat ") and self.rendered is not None:
+            return 0, self.rendered, ""
+        return 1, "", "No such file or directory"
+
+
+EXECUTORS = {"ssh": SSHExecutor, "docker": DockerExecutor, "fake": FakeExecutor}
+
+
+def make_executor(host):
+    kind = host.get("executor", "ssh")
+    if kind == "fake":
+        return FakeExecutor(host["host"], host.get("template", "singbox_client_config.json"))
+    return EXECUTORS[kind](host["host"], host.get("user", "root"), host.get("ssh_port", 22),
+                           host.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+                           host.get("strict_host_key_checking", DEFAULT_HOST_KEY_CHECKING))
+
+
+def load_inventory(path):
+    """读取 inventory，返回合并了 defaults 的主机列表"""
+    with open(path, 'r', encoding='utf-8') as f:
+        inventory = json.load(f)
+    defaults = inventory.get("defaults", {})
+    hosts = []
+    for h in inventory.get("hosts", []):
+        host = dict(defaults, **h)
+        host["args"] = dict(defaults.get("args", {}), **h.get("args", {}))
+        hosts.append(host)
+    return hosts
+
+
+def check_inventory(hosts):
+    """检查主机字段，返回错误列表"""
+    errors = []
+    seen = set()
+    for i, h in enumerate(hosts):
+        name = h.get("name")
+        if not name or not re.match(r"^[\w.-]+$", name):
+            errors.append(f"hosts[{i}]: invalid name {name!r}")
+        elif name in seen:
+            errors.append(f"hosts[{i}]: duplicate name {name!r}")
+        seen.add(name)
+        if not h.get("host"):
+            errors.append(f"host {name}: missing host")
+        if h.get("executor", "ssh") not in EXECUTORS:
+            errors.append(f"host {name}: unknown executor {h.get('executor')!r}")
+        checking = h.get("strict_host_key_checking", DEFAULT_HOST_KEY_CHECKING)
+        if checking not in HOST_KEY_CHECKING_VALUES:
+            errors.append(f"host {name}: strict_host_key_checking must be one of {', '.join(sorted(HOST_KEY_CHECKING_VALUES))}")
+        unknown = set(h["args"]) - INSTALL_FLAGS
+        if unknown:
+            errors.append(f"host {name}: unknown installer args {', '.join(sorted(unknown))}")
+    return errors
+
+
+def install_script(args, force=False, branch=REPO_BRANCH):
+    """远端执行的安装脚本 (与 setup_vps_server.sh 的 install_singbox 一致)"""
+    flags = " ".join(f"--{key} {shlex.quote(str(value))}" for key, value in sorted(args.items()))
+    return "\n".join([
+        "sudo dpkg --configure -a || true",
+        f"curl -4 -L -q --retry 5 --retry-delay 10 -H 'Cache-Control: no-cache' -o /tmp/install-singbox-server.sh "
+        f"{INSTALL_URL.format(branch=branch)}",
+        f"sudo bash /tmp/install-singbox-server.sh {flags}{' --force' if force else ''}",
+        "",
+    ])
+
+
+def retag(outbounds, name):
+    """按服务器名重命名节点：模板中的 <服务器名>-tcp-443 改为 <name>-tcp-443，避免多台服务器的 tag 冲突"""
+    result = []
+    for o in outbounds:
+        tag = o.get("tag", "")
+        suffix = tag.split("-", 1)[1] if "-" in tag else tag
+        result.append(dict(o, tag=f"{name}-{suffix}"))
+    return result
+
+
+def provision_host(host, force=False, timeout=DEFAULT_TIMEOUT):
+    """在单台服务器上执行安装并取回客户端配置，返回结果字典 (outbounds 为重命名后的代理节点)"""
+    name = host["name"]
+    started = time.perf_counter()
+    args = dict(host["args"])
+    # 安装脚本只把 Reality 参数写入客户端配置，Hysteria2 密码在本地生成后再写入节点
+    args.setdefault("hy2-password", secrets.token_hex(16))
+    executor = make_executor(host)
+
+    def failed(error):
+        return {"name": name, "ok": False, "error": error, "seconds": time.perf_counter() - started}
+
+    code, out, err = executor.run(install_script(args, force), timeout)
+    if code != 0:
+        lines = (err or out).strip().splitlines()
+        return failed(f"installer exited with {code}: {lines[-1] if lines else ''}")
+    matches = CLIENT_CONFIG_RE.findall(ANSI_RE.sub("", out))
+    if not matches:
+        return failed("installer did not report a client config path")
+    remote_path = matches[-1]
+
+    code, out, err = executor.run(f"cat {shlex.quote(remote_path)}\n", timeout)
+    if code != 0:
+        return failed(f"cannot read {remote_path}: {err.strip()}")
+    try:
+        client_config = json.loads(out)
+    except ValueError as e:
+        return failed(f"invalid client config {remote_path}: {e}")
+
+    outbounds = [o for o in client_config.get("outbounds", []) if o.get("type") in PROXY_TYPES]
+    for o in outbounds:
+        if o["type"] == "hysteria2":
+            o["password"] = args["hy2-password"]
+    return {
+        "name": name,
+        "ok": True,
+        "host": host["host"],
+        "client_config": client_config,
+        "outbounds": retag(outbounds, name),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def provision_fleet(hosts, jobs=DEFAULT_JOBS, force=False, timeout=DEFAULT_TIMEOUT):
+    """以有上限的线程池并行安装全部服务器，按完成顺序输出进度，返回按 inventory 顺序排列的结果"""
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(jobs, len(hosts)))) as pool:
+        futures = {pool.submit(provision_host, h, force, timeout): h["name"] for h in hosts}
+        for future in as_completed(futures):
+            r = future.result()
+            results[r["name"]] = r
+            if r["ok"]:
+                print(f"[+] {r['name']}: {len(r['outbounds'])} nodes in {r['seconds']:.1f}s")
+            else:
+                print(f"[!] {r['name']}: {r['error']}")
+    return [results[h["name"]] for h in hosts]
+
+
+def save_client_configs(results, save_dir):
+    """保存每台服务器生成的客户端配置 (包含密钥与端口，用于审计与轮换)，文件权限为 0600"""
+    os.makedirs(save_dir, mode=0o700, exist_ok=True)
+    for r in results:
+        if r["ok"]:
+            config_apply.write_json(os.path.join(save_dir, f"{r['name']}.json"), r["client_config"], mode=0o600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Provision many sing-box servers in parallel and merge their nodes into the client config.',
+                                     epilog=f"Inventory example:\n{EXAMPLE_INVENTORY}",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-i', '--inventory', required=True, help='Host inventory (JSON)')
+    parser.add_argument('-s', '--singbox', default='/etc/sing-box/config.json', help='Client config to merge the new nodes into')
+    parser.add_argument('-o', '--output', default='merged_config.json', help='Path for the merged output file')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS, help=f'Servers provisioned at once (default: {DEFAULT_JOBS})')
+    parser.add_argument('--only', help='Only provision hosts whose name matches this regex')
+    parser.add_argument('--executor', choices=sorted(EXECUTORS), help='Override the executor of every host (e.g. fake for a dry run)')
+    parser.add_argument('-f', '--force', action='store_true', help='Pass --force to the installer (re-install / rotate keys)')
+    parser.add_argument('--timeout', type=int, default=DEFAULT_TIMEOUT, help=f'Per-server installer timeout in seconds (default: {DEFAULT_TIMEOUT})')
+    parser.add_argument('--save-dir', help='Also save each server\'s generated client config into this directory')
+    parser.add_argument('--apply', action='store_true',
+                        help='Treat the output as the live config: restart sing-box after writing and roll back if it does not become healthy')
+    parser.add_argument('--profile', action='store_true', help='Record cProfile/tracemalloc data and write <output>.profile.txt')
+    args = parser.parse_args()
+
+    if args.profile:
+        from profiling import Profiler
+        METRICS.profiler = Profiler("fleet_provision")
+        METRICS.profiler.write_report_at_exit(args.output)
+
+    try:
+        hosts = load_inventory(args.inventory)
+    except (OSError, ValueError) as e:
+        print(f"Error: Cannot read inventory {args.inventory}: {e}")
+        sys.exit(1)
+    if args.only:
+        pattern = re.compile(args.only)
+        hosts = [h for h in hosts if pattern.search(h.get("name") or "")]
+    if args.executor:
+        for h in hosts:
+            h["executor"] = args.executor
+    errors = check_inventory(hosts)
+    if errors:
+        print(f"Error: Inventory has {len(errors)} problem(s):")
+        print_errors(errors)
+        sys.exit(1)
+    if not hosts:
+        print("Warning: No hosts to provision.")
+        sys.exit(1)
+    if not os.path.exists(args.singbox):
+        print(f"Error: Sing-box config not found at {args.singbox}")
+        sys.exit(1)
+
+    print(f"[*] Provisioning {len(hosts)} servers with {max(1, min(args.jobs, len(hosts)))} worker(s)...")
+    with METRICS.phase("provision"):
+        results = provision_fleet(hosts, args.jobs, args.force, args.timeout)
+    succeeded = [r for r in results if r["ok"]]
+    METRICS.set("hosts_provisioned", len(succeeded))
+    METRICS.set("hosts_failed", len(results) - len(succeeded))
+    if args.save_dir:
+        save_client_configs(results, args.save_dir)
+    if not succeeded:
+        print("Error: No server was provisioned, config not updated.")
+        METRICS.finish(False)
+        sys.exit(1)
+
+    # 与 merge_configs.py 相同的合并路径：同名节点被覆盖，其余原有节点保留
+    with METRICS.phase("merge"):
+        with open(args.singbox, 'r') as f:
+            sb_config = json.load(f)
+        new_outbounds = [o for r in succeeded for o in r["outbounds"]]
+        sb_config, members = merge_configs.merge_outbounds(sb_config, new_outbounds)
+        errors = validate_config(sb_config)
+    if errors:
+        print(f"Error: Merged config failed validation ({len(errors)} problem(s)), not saved:")
+        print_errors(errors)
+        METRICS.finish(False)
+        sys.exit(1)
+
+    if args.apply:
+        with METRICS.phase("apply"):
+            applied = config_apply.apply_config(sb_config, args.output)
+        if not applied:
+            print(f"Error: sing-box did not become healthy with the merged config, {args.output} was rolled back.")
+            METRICS.finish(False)
+            sys.exit(1)
+    else:
+        with METRICS.phase("dump"):
+            config_apply.write_json(args.output, sb_config)
+    METRICS.set("group_members", len(members))
+    METRICS.finish(len(succeeded) == len(results))
+    if METRICS.profiler:
+        METRICS.profiler.write_report(args.output)
+
+    print(f"[+] Merged {len(new_outbounds)} nodes from {len(succeeded)}/{len(results)} servers into {args.output}")
+    if len(succeeded) != len(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
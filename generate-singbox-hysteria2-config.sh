@@ -224,6 +224,16 @@ CLIENT_CONFIG_EOF
 
 check_config_if_possible() {
   if ! command -v sing-box > /dev/null 2>&1; then
+    local validator
+    validator="$(dirname "$0")/singbox_validate.py"
+    if command -v python3 > /dev/null 2>&1 && [[ -f "$validator" ]]; then
+      echo "${aoi}info: sing-box command not found, use singbox_validate.py instead${reset}"
+      if ! python3 "$validator" "$HY2_CLIENT_CONFIG_PATH" "$HY2_SERVER_CONFIG_PATH"; then
+        echo "${red}error: config validation failed${reset}"
+        exit 1
+      fi
+      return
+    fi
     echo "${aoi}info: sing-box command not found, skip syntax checks${reset}"
     return
   fi
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+import json
+import os
+import re
+import sys
+import argparse
+
+import merge_configs
+import sb_to_clash
+import sb_to_clash_qr
+from config_apply import atomic_write
+from singbox_validate import validate_config, print_errors
+from metrics import Metrics
+
+# 运行指标 (通过 METRICS_EVENT_LOG / METRICS_PROM_FILE 环境变量输出)
+METRICS = Metrics("generate_profiles")
+
+# Clash 模板：desktop 使用 sb_to_clash.py (TUN + FakeIP 过滤)，mobile 使用 sb_to_clash_qr.py (Mihomo 风格)
+CLASH_DEVICES = {"desktop", "mobile"}
+RULE_PRESETS = {"cn-direct", "global"}
+
+# 子进程中共享的已解析数据 (由 _init_worker 设置)
+_SOURCE = None
+
+EXAMPLE_MANIFEST = """{
+  "singbox": "/etc/sing-box/config.json",
+  "clash": "~/.config/clash/config.yaml",
+  "output_dir": "profiles",
+  "profiles": [
+    {"name": "alice-phone", "target": "clash", "device": "mobile", "include": "HK|JP"},
+    {"name": "bob-laptop", "target": "clash", "device": "desktop", "rules": "global"},
+    {"name": "office-router", "target": "singbox", "bind_interface": "eth0", "exclude": "udp"}
+  ]
+}"""
+
+
+def prepare_source(sb_config, clash_config=None):
+    """解析并转换一次源配置，供所有 profile 共享"""
+    clash_proxies = (clash_config or {}).get('proxies', []) or []
+    source = {
+        "sb_config": sb_config,
+        # sing-box 目标：Clash 节点先按无绑定网卡转换，渲染时再按 profile 设置 bind_interface
+        "clash_outbounds": merge_configs.convert_clash_proxies(clash_proxies, bind_interface=None),
+        "fake_ip_filter": sb_to_clash.extract_fake_ip_filter(sb_config),
+        "clash_by_device": {},
+    }
+    # Clash 目标：sing-box 节点转换结果 + 原始 Clash 节点 (同名时以 Clash 为准)
+    for device, module in (("desktop", sb_to_clash), ("mobile", sb_to_clash_qr)):
+        proxies, _ = module.collect_clash_proxies(sb_config)
+        by_name = {p['name']: p for p in proxies}
+        for p in clash_proxies:
+            if p.get('name'):
+                by_name[p['name']] = p
+        source["clash_by_device"][device] = list(by_name.values())
+    return source
+
+
+def _init_worker(source):
+    global _SOURCE
+    _SOURCE = source
+
+
+def _node_filter(profile):
+    include = re.compile(profile["include"]) if profile.get("include") else None
+    exclude = re.compile(profile["exclude"]) if profile.get("exclude") else None
+
+    def match(name):
+        name = name or ""
+        if include and not include.search(name):
+            return False
+        return not (exclude and exclude.search(name))
+    return match
+
+
+def render_clash(profile, source):
+    import yaml
+    device = profile.get("device", "desktop")
+    match = _node_filter(profile)
+    proxies = [p for p in source["clash_by_device"][device] if match(p.get('name'))]
+    if not proxies:
+        raise ValueError("no proxies left after applying the node filter")
+    names = [p['name'] for p in proxies]
+
+    if device == "mobile":
+        config = sb_to_clash_qr.build_clash_config(proxies, names)
+    else:
+        config = sb_to_clash.build_clash_config(proxies, names, source["fake_ip_filter"])
+
+    if profile.get("rules", "cn-direct") == "global":
+        # 全局代理：只保留局域网直连与兜底规则
+        config["rules"] = [r for r in config["rules"] if r.startswith("MATCH") or r.endswith("private,DIRECT")]
+    return yaml.dump(config, allow_unicode=True, sort_keys=False), len(proxies)
+
+
+def render_singbox(profile, source):
+    bind_interface = profile.get("bind_interface", merge_configs.CLASH_OUTBOUND_BIND_INTERFACE)
+    outbounds = [dict(o, bind_interface=bind_interface) if bind_interface else o
+                 for o in source["clash_outbounds"]]
+
+    # 不匹配过滤条件的节点按健康检查失败处理：删除 (仍被引用的只移出策略组)
+    match = _node_filter(profile)
+    _, remaining = merge_configs.split_outbounds(source["sb_config"], outbounds)
+    health = {o.get('tag'): {"alive": match(o.get('tag')), "latency": None} for o in outbounds + remaining}
+
+    config, members = merge_configs.merge_outbounds(
+        source["sb_config"], outbounds, health=health, drop_failed=True,
+        tiered=profile.get("tiered", False), quiet=True)
+    if not members:
+        raise ValueError("no proxies left after applying the node filter")
+
+    if profile.get("rules", "cn-direct") == "global":
+        route = config.get("route", {})
+        route["rules"] = [r for r in route.get("rules", [])
+                          if r.get("outbound") != "direct" or r.get("ip_is_private")]
+
+    errors = validate_config(config)
+    if errors:
+        raise ValueError("validation failed: " + "; ".join(errors[:5]))
+    return json.dumps(config, indent=2, ensure_ascii=False), len(members)
+
+
+def render_profile(profile, output_dir):
+    """在子进程中渲染单个 profile 并写入文件，返回结果字典"""
+    name = profile["name"]
+    target = profile.get("target", "clash")
+    try:
+        if target == "singbox":
+            text, nodes = render_singbox(profile, _SOURCE)
+            ext = "json"
+        else:
+            text, nodes = render_clash(profile, _SOURCE)
+            ext = "yaml"
+        path = profile.get("output") or os.path.join(output_dir, f"{name}.{ext}")
+        atomic_write(path, text)
+        return {"name": name, "ok": True, "path": path, "nodes": nodes}
+    except Exception as e:
+        return {"name": name, "ok": False, "error": str(e)}
+
+
+def check_manifest(manifest):
+    """检查 manifest 中 profile 的字段，返回错误列表"""
+    errors = []
+    seen = set()
+    for i, p in enumerate(manifest.get("profiles", [])):
+        name = p.get("name")
+        if not name or not re.match(r"^[\w.-]+$", name):
+            errors.append(f"profiles[{i}]: invalid name {name!r}")
+        elif name in seen:
+            errors.append(f"profiles[{i}]: duplicate name {name!r}")
+        seen.add(name)
+        if p.get("target", "clash") not in ("clash", "singbox"):
+            errors.append(f"profile {name}: unknown target {p.get('target')!r}")
+        if p.get("device", "desktop") not in CLASH_DEVICES:
+            errors.append(f"profile {name}: unknown device {p.get('device')!r}")
+        if p.get("rules", "cn-direct") not in RULE_PRESETS:
+            errors.append(f"profile {name}: unknown rules preset {p.get('rules')!r}")
+        for key in ("include", "exclude"):
+            try:
+                re.compile(p.get(key) or "")
+            except re.error as e:
+                errors.append(f"profile {name}: invalid {key} regex: {e}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render many client profiles (Clash / Sing-box) from one parsed source.',
+                                     epilog=f"Manifest example:\n{EXAMPLE_MANIFEST}",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-m', '--manifest', required=True, help='Path to the profile manifest (JSON)')
+    parser.add_argument('-d', '--output-dir', help='Directory for generated files (overrides manifest output_dir)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='Worker processes (default: CPU count)')
+    parser.add_argument('--profile', action='store_true', help='Record cProfile/tracemalloc data and write a report into the output directory')
+    args = parser.parse_args()
+
+    if args.profile:
+        from profiling import Profiler
+        METRICS.profiler = Profiler("generate_profiles")
+        METRICS.profiler.write_report_at_exit(os.path.join(args.output_dir or ".", "generate_profiles"))
+
+    if not os.path.exists(args.manifest):
+        print(f"Error: Manifest not found at {args.manifest}")
+        sys.exit(1)
+    with open(args.manifest, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    errors = check_manifest(manifest)
+    if errors:
+        print(f"Error: Manifest has {len(errors)} problem(s):")
+        print_errors(errors)
+        sys.exit(1)
+
+    sb_path = os.path.expanduser(manifest.get("singbox", "/etc/sing-box/config.json"))
+    clash_path = os.path.expanduser(manifest["clash"]) if manifest.get("clash") else None
+    output_dir = args.output_dir or manifest.get("output_dir", "profiles")
+    profiles = manifest.get("profiles", [])
+
+    if not os.path.exists(sb_path):
+        print(f"Error: Sing-box config not found at {sb_path}")
+        sys.exit(1)
+    if clash_path and not os.path.exists(clash_path):
+        print(f"Error: Clash config not found at {clash_path}")
+        sys.exit(1)
+    os.makedirs(output_dir, exist_ok=True)
+    if METRICS.profiler:
+        METRICS.profiler.write_report_at_exit(os.path.join(output_dir, "generate_profiles"))
+
+    print(f"[*] Reading Sing-box config: {sb_path}")
+    with METRICS.phase("load"):
+        with open(sb_path, 'r') as f:
+            sb_config = json.load(f)
+        clash_config = None
+        if clash_path:
+            import yaml
+            print(f"[*] Reading Clash config: {clash_path}")
+            with open(clash_path, 'r') as f:
+                clash_config = yaml.safe_load(f)
+
+    with METRICS.phase("convert"):
+        source = prepare_source(sb_config, clash_config)
+
+    from concurrent.futures import ProcessPoolExecutor
+    jobs = max(1, min(args.jobs, len(profiles)))
+    print(f"[*] Rendering {len(profiles)} profiles with {jobs} worker(s)...")
+    with METRICS.phase("render"):
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(source,)) as pool:
+            results = list(pool.map(render_profile, profiles, [output_dir] * len(profiles), chunksize=max(1, len(profiles) // (jobs * 4))))
+
+    failed = [r for r in results if not r["ok"]]
+    for r in results:
+        if r["ok"]:
+            print(f"[+] {r['name']}: {r['nodes']} nodes -> {r['path']}")
+        else:
+            print(f"[!] {r['name']}: {r['error']}")
+    METRICS.set("profiles_rendered", len(results) - len(failed))
+    METRICS.set("profiles_failed", len(failed))
+    METRICS.finish(not failed)
+    if METRICS.profiler:
+        METRICS.profiler.write_report(os.path.join(output_dir, "generate_profiles"))
+
+    print(f"[+] Generated {len(results) - len(failed)}/{len(results)} profiles in {output_dir}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+import heapq
+import ipaddress
+import socket
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from config_apply import atomic_write
+
+# 二进制文件格式: 魔数 + 版本 + IPv4 数量 + IPv6 数量，随后是小端序的 uint32 数组
+# 以及 IPv6 高 64 位 / 低 64 位两个 uint64 数组
+BIN_MAGIC = b"IPCS"
+BIN_VERSION = 1
+BIN_HEADER = struct.Struct("<4sHQQ")
+
+# 文本中的 CIDR 最多展开的地址数 (IPv4 /16、IPv6 /112)，避免误写 /8 或 IPv6 /64 之类导致内存爆炸
+MAX_EXPAND_ADDRESSES = 65536
+
+# 逐个添加的 IPv4 攒够该数量后排序成一段有序数组，排序时的临时 int 列表不会随集合规模增长
+PENDING_CHUNK = 65536
+# write_text 每次编码写出的行数
+WRITE_CHUNK = 65536
+
+_U64 = (1 << 64) - 1
+
+
+def _sorted_unique(values, typecode):
+    """排序并去重，返回新的 array"""
+    out = array(typecode)
+    last = None
+    for v in sorted(values):
+        if v != last:
+            out.append(v)
+            last = v
+    return out
+
+
+def _common_run(a, i, b, j):
+    """a[i] == b[j] 时，返回两边从该位置起都连续递增 1 的公共长度 (倍增查找，至少为 1)
+
+    CIDR 展开得到的集合由大段连续整数组成，公共部分可以整段切片复制而不必逐个比较。
+    """
+    limit = min(len(a) - i, len(b) - j)
+    x = a[i]
+    step = 1
+    good = 1
+    while good < limit:
+        probe = min(good + step, limit)
+        if a[i + probe - 1] - x == probe - 1 and b[j + probe - 1] - x == probe - 1:
+            good = probe
+            step *= 2
+        elif step == 1:
+            break
+        else:
+            step = 1
+    return good
+
+
+def _merge_union(a, b, out):
+    """有序序列归并求并集，结果追加到 out (array 或 list)
+
+    不重叠的部分按二分查找的位置整段切片复制，只有交错的元素才逐个处理。
+    """
+    i = j = 0
+    na, nb = len(a), len(b)
+    while i < na and j < nb:
+        x, y = a[i], b[j]
+        if x < y:
+            k = bisect_left(a, y, i)
+            out.extend(a[i:k])
+            i = k
+        elif y < x:
+            k = bisect_left(b, x, j)
+            out.extend(b[j:k])
+            j = k
+        else:
+            n = _common_run(a, i, b, j)
+            out.extend(a[i:i + n])
+            i += n
+            j += n
+    out.extend(a[i:])
+    out.extend(b[j:])
+    return out
+
+
+def _merge_intersection(a, b, out):
+    """有序序列求交集：二分跳过不相交的部分，公共的连续段整段复制"""
+    i = j = 0
+    na, nb = len(a), len(b)
+    while i < na and j < nb:
+        x, y = a[i], b[j]
+        if x < y:
+            i = bisect_left(a, y, i)
+        elif y < x:
+            j = bisect_left(b, x, j)
+        else:
+            n = _common_run(a, i, b, j)
+            out.extend(a[i:i + n])
+            i += n
+            j += n
+    return out
+
+
+def _merge_difference(a, b, out):
+    """有序序列求差集 a - b：不在 b 中的部分整段复制"""
+    i = j = 0
+    na, nb = len(a), len(b)
+    while i < na and j < nb:
+        x, y = a[i], b[j]
+        if x < y:
+            k = bisect_left(a, y, i)
+            out.extend(a[i:k])
+            i = k
+        elif y < x:
+            j = bisect_left(b, x, j)
+        else:
+            n = _common_run(a, i, b, j)
+            i += n
+            j += n
+    out.extend(a[i:])
+    return out
+
+
+def _merge_runs(runs, typecode):
+    """合并多段有序去重数组：互不重叠的段直接拼接，重叠的段两两归并"""
+    runs = sorted((r for r in runs if r), key=lambda r: r[0])
+    out = array(typecode)
+    cluster = []
+    cluster_end = None
+    for run in runs + [None]:
+        if run is not None and cluster and run[0] <= cluster_end:
+            cluster.append(run)
+            cluster_end = max(cluster_end, run[-1])
+            continue
+        if len(cluster) == 1:
+            out.extend(cluster[0])
+        elif cluster:
+            # 重叠的段按长度从小到大归并，减少重复复制
+            heap = [(len(r), n, r) for n, r in enumerate(cluster)]
+            heapq.heapify(heap)
+            while len(heap) > 1:
+                _, _, a = heapq.heappop(heap)
+                _, n, b = heapq.heappop(heap)
+                merged = _merge_union(a, b, array(typecode))
+                heapq.heappush(heap, (len(merged), n, merged))
+            out.extend(heap[0][2])
+        if run is not None:
+            cluster = [run]
+            cluster_end = run[-1]
+    return out
+
+
+def _contains(arr, value):
+    i = bisect_left(arr, value)
+    return i < len(arr) and arr[i] == value
+
+
+class IPCandidateSet:
+    """以有序整数数组存储的 IP 候选集合 (IPv4 为 uint32，IPv6 拆为两个 uint64)
+
+    与 Python 字符串集合相比，每个 IPv4 只占 4 字节；集合运算基于有序数组的归并与二分查找。
+    添加的元素先进入缓冲区 (CIDR 直接展开为有序数组段，单个 IP 每 PENDING_CHUNK 个排序成一段)，
+    首次查询时统一归并去重，整个过程不产生与集合规模成正比的 Python 对象。
+    """
+
+    def __init__(self, ips=None):
+        self._v4 = array('I')
+        self._v6 = array('Q')       # 按 (hi, lo) 交错存放，便于整体排序
+        self._runs_v4 = []          # 待归并的有序去重数组段
+        self._runs_v6 = []          # 展开的 IPv6 网段，与 _v6 相同的 (hi, lo) 交错格式
+        self._pending_v4 = array('I')
+        self._pending_v6 = []
+        if ips is not None:
+            self.update(ips)
+
+    # ---------- 添加 ----------
+
+    def add(self, ip):
+        """添加一个 IP 字符串，无效地址返回 False"""
+        try:
+            self._pending_v4.append(struct.unpack("!I", socket.inet_pton(socket.AF_INET, ip))[0])
+        except (OSError, TypeError):
+            pass
+        else:
+            if len(self._pending_v4) >= PENDING_CHUNK:
+                self._flush_pending_v4()
+            return True
+        try:
+            self._pending_v6.append(int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big"))
+            return True
+        except (OSError, TypeError):
+            return False
+
+    def add_network(self, cidr):
+        """展开一个 CIDR 网段 (地址数需 <= MAX_EXPAND_ADDRESSES)"""
+        net = ipaddress.ip_network(cidr, strict=False)
+        if net.num_addresses > MAX_EXPAND_ADDRESSES:
+            raise ValueError(f"refusing to expand {cidr}: more than {MAX_EXPAND_ADDRESSES} addresses")
+        start, end = int(net.network_address), int(net.broadcast_address)
+        if net.version == 4:
+            self._runs_v4.append(array('I', range(start, end + 1)))
+        else:
+            # 网段不超过 /112，高 64 位相同，低 64 位连续
+            run = array('Q', [start >> 64, 0]) * net.num_addresses
+            run[1::2] = array('Q', range(start & _U64, (end & _U64) + 1))
+            self._runs_v6.append(run)
+
+    def update(self, other):
+        """合并另一个 IPCandidateSet 或任意 IP 字符串可迭代对象"""
+        if isinstance(other, IPCandidateSet):
+            other._normalize()
+            self._normalize()
+            self._v4 = _merge_union(self._v4, other._v4, array('I'))
+            self._v6 = self._pack_v6(_merge_union(self._v6_keys(), other._v6_keys(), []))
+            return
+        for ip in other:
+            self.add(ip)
+
+    # ---------- 内部整理 ----------
+
+    @staticmethod
+    def _pack_v6(values):
+        out = array('Q')
+        for v in values:
+            out.append(v >> 64)
+            out.append(v & _U64)
+        return out
+
+    def _iter_v6_ints(self):
+        v6 = self._v6
+        for i in range(0, len(v6), 2):
+            yield (v6[i] << 64) | v6[i + 1]
+
+    def _flush_pending_v4(self):
+        self._runs_v4.append(_sorted_unique(self._pending_v4, 'I'))
+        self._pending_v4 = array('I')
+
+    def _normalize(self):
+        if self._pending_v4:
+            self._flush_pending_v4()
+        if self._runs_v4:
+            self._v4 = _merge_runs([self._v4] + self._runs_v4, 'I')
+            self._runs_v4 = []
+        if self._pending_v6 or self._runs_v6:
+            merged = set(self._iter_v6_ints())
+            merged.update(self._pending_v6)
+            for run in self._runs_v6:
+                merged.update((run[i] << 64) | run[i + 1] for i in range(0, len(run), 2))
+            self._v6 = self._pack_v6(sorted(merged))
+            self._pending_v6 = []
+            self._runs_v6 = []
+
+    def _v6_keys(self):
+        # IPv6 数量通常很少，查询时临时还原为整数列表
+        return list(self._iter_v6_ints())
+
+    # ---------- 查询 ----------
+
+    def __len__(self):
+        self._normalize()
+        return len(self._v4) + len(self._v6) // 2
+
+    def __bool__(self):
+        return bool(self._v4 or self._v6 or self._runs_v4 or self._runs_v6 or self._pending_v4 or self._pending_v6)
+
+    def __contains__(self, ip):
+        self._normalize()
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        if addr.version == 4:
+            return _contains(self._v4, int(addr))
+        return _contains(self._v6_keys(), int(addr))
+
+    def __iter__(self):
+        """按数值顺序输出 IP 字符串 (IPv4 在前)"""
+        self._normalize()
+        pack = struct.Struct("!I").pack
+        for v in self._v4:
+            yield socket.inet_ntop(socket.AF_INET, pack(v))
+        for v in self._iter_v6_ints():
+            yield socket.inet_ntop(socket.AF_INET6, v.to_bytes(16, "big"))
+
+    def count_in_network(self, cidr):
+        """统计落在 CIDR 网段内的 IP 数量 (二分查找，不展开网段)"""
+        lo, hi, keys = self._network_bounds(cidr)
+        return bisect_right(keys, hi) - bisect_left(keys, lo)
+
+    def filter_network(self, cidr):
+        """返回落在 CIDR 网段内的 IP 组成的新集合"""
+        lo, hi, keys = self._network_bounds(cidr)
+        result = IPCandidateSet()
+        start, end = bisect_left(keys, lo), bisect_right(keys, hi)
+        if isinstance(keys, array):
+            result._v4 = keys[start:end]
+        else:
+            result._v6 = self._pack_v6(keys[start:end])
+        return result
+
+    def _network_bounds(self, cidr):
+        self._normalize()
+        net = ipaddress.ip_network(cidr, strict=False)
+        keys = self._v4 if net.version == 4 else self._v6_keys()
+        return int(net.network_address), int(net.broadcast_address), keys
+
+    # ---------- 集合运算 ----------
+
+    def _binary_op(self, other, merge):
+        self._normalize()
+        other._normalize()
+        result = IPCandidateSet()
+        result._v4 = merge(self._v4, other._v4, array('I'))
+        # IPv6 以 128 位整数参与运算
+        if self._v6 or other._v6:
+            result._v6 = self._pack_v6(merge(self._v6_keys(), other._v6_keys(), []))
+        return result
+
+    def __or__(self, other):
+        return self._binary_op(other, _merge_union)
+
+    def __and__(self, other):
+        return self._binary_op(other, _merge_intersection)
+
+    def __sub__(self, other):
+        return self._binary_op(other, _merge_difference)
+
+    # ---------- 序列化 ----------
+
+    def nbytes(self):
+        """数组占用的字节数 (不含缓冲区)"""
+        self._normalize()
+        return self._v4.itemsize * len(self._v4) + self._v6.itemsize * len(self._v6)
+
+    def save(self, path):
+        """原子写入二进制格式 (小端序)"""
+        self._normalize()
+        v4, v6 = self._v4, self._v6
+        if sys.byteorder != "little":
+            v4, v6 = array('I', v4), array('Q', v6)
+            v4.byteswap()
+            v6.byteswap()
+        header = BIN_HEADER.pack(BIN_MAGIC, BIN_VERSION, len(v4), len(v6) // 2)
+        atomic_write(path, [header, memoryview(v4), memoryview(v6)])
+
+    @classmethod
+    def load(cls, path):
+        """读取 save() 写出的二进制文件"""
+        result = cls()
+        with open(path, 'rb') as f:
+            magic, version, n4, n6 = BIN_HEADER.unpack(f.read(BIN_HEADER.size))
+            if magic != BIN_MAGIC or version != BIN_VERSION:
+                raise ValueError(f"{path}: not an IP candidate file")
+            result._v4.fromfile(f, n4)
+            result._v6.fromfile(f, n6 * 2)
+        if sys.byteorder != "little":
+            result._v4.byteswap()
+            result._v6.byteswap()
+        return result
+
+    def write_text(self, path):
+        """按数值顺序原子写出每行一个 IP 的文本文件 (分块编码，不构造完整的字符串列表)"""
+        atomic_write(path, self._text_chunks())
+
+    def _text_chunks(self):
+        ips = iter(self)
+        sep = ''
+        while True:
+            chunk = '\n'.join(islice(ips, WRITE_CHUNK))
+            if not chunk:
+                return
+            yield sep + chunk
+            sep = '\n'
@@ -0,0 +1,87 @@
+import heapq
+import socket
+import struct
+
+# 默认的多样性约束：每个数据中心 / 每个子网最多选中的 IP 数
+DEFAULT_MAX_PER_COLO = 5
+DEFAULT_MAX_PER_SUBNET = 2
+DEFAULT_SUBNET_PREFIX = 24
+
+
+def subnet_key(ip, prefix=DEFAULT_SUBNET_PREFIX):
+    """返回 IP 所在子网的整数键 (IPv4 按 prefix 截断，IPv6 固定按 /48)"""
+    try:
+        value = struct.unpack("!I", socket.inet_aton(ip))[0]
+        return (4, value >> (32 - prefix))
+    except OSError:
+        pass
+    try:
+        return (6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), "big") >> 80)
+    except OSError:
+        return (0, ip)
+
+
+def select_top(candidates, count):
+    """基准策略：只按分数取前 N 个"""
+    return heapq.nlargest(count, candidates, key=lambda c: c["score"])
+
+
+def select_diverse(candidates, count, max_per_colo=DEFAULT_MAX_PER_COLO,
+                   max_per_subnet=DEFAULT_MAX_PER_SUBNET, subnet_prefix=DEFAULT_SUBNET_PREFIX):
+    """在每个数据中心 / 子网的数量上限内，贪心地按分数从高到低选出 N 个候选
+
+    candidates 为 [{ip, score, colo, ...}]，colo 为空的候选不受数据中心上限约束。
+    上限为 0 或 None 表示不限制。满足全部约束的候选不足 N 个时逐级放宽：
+    先放开数据中心上限 (仍保持子网分散)，再放开全部约束，保证尽量返回 N 个结果。
+    返回按选中顺序排列的候选列表。
+    """
+    if count <= 0:
+        return []
+    # 堆中只保存 (负分数, 下标)，避免比较字典；同分时保持输入顺序
+    heap = [(-c["score"], i) for i, c in enumerate(candidates)]
+    heapq.heapify(heap)
+
+    selected = []
+    deferred = []  # 因约束被跳过的候选，保持分数降序
+    per_colo = {}
+    per_subnet = {}
+    seen = set()
+
+    def take(c, subnet):
+        selected.append(c)
+        seen.add(c["ip"])
+        if c.get("colo"):
+            per_colo[c["colo"]] = per_colo.get(c["colo"], 0) + 1
+        per_subnet[subnet] = per_subnet.get(subnet, 0) + 1
+
+    while heap and len(selected) < count:
+        _, i = heapq.heappop(heap)
+        c = candidates[i]
+        if c["ip"] in seen:
+            continue
+        subnet = subnet_key(c["ip"], subnet_prefix)
+        colo = c.get("colo")
+        if (max_per_colo and colo and per_colo.get(colo, 0) >= max_per_colo) or \
+           (max_per_subnet and per_subnet.get(subnet, 0) >= max_per_subnet):
+            deferred.append((c, subnet))
+            continue
+        take(c, subnet)
+
+    # 逐级放宽约束补足数量
+    for subnet_limited in (True, False):
+        for c, subnet in deferred:
+            if len(selected) >= count:
+                break
+            if c["ip"] in seen:
+                continue
+            if subnet_limited and max_per_subnet and per_subnet.get(subnet, 0) >= max_per_subnet:
+                continue
+            take(c, subnet)
+    return selected
+
+
+def diversity_summary(selected, subnet_prefix=DEFAULT_SUBNET_PREFIX):
+    """返回 (数据中心数, 子网数)"""
+    colos = {c.get("colo") for c in selected if c.get("colo")}
+    subnets = {subnet_key(c["ip"], subnet_prefix) for c in selected}
+    return len(colos), len(subnets)
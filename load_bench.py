@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import math
+import os
+import socket
+import ssl
+import sys
+import time
+from urllib.parse import urlsplit
+
+# 与 cfst 下载测速使用同一个测速地址 (SNI / Host 为该域名，连接目标为被测 IP)
+DEFAULT_URL = "https://speed.19910417.xyz/__down?bytes=100000000"
+DEFAULT_STREAMS = 32          # 并发下载数，按轮询分配到各 IP
+DEFAULT_DURATION = 10.0       # 测试时长 (秒)
+DEFAULT_TIMEOUT = 5.0         # 建连 / 读取超时 (秒)
+DEFAULT_HISTORY = os.getenv("BENCH_HISTORY", "./bench_history.jsonl")
+# 负载下单 IP 每个流的吞吐低于其它 IP 中位数的该比例，或失败请求比例超过 DEFAULT_MAX_ERROR_RATE 时视为在负载下失效。
+# 各 IP 共享本机带宽，因此与其它 IP 比较而不是与 cfst 单独测速结果比较：带宽受限时各 IP 同样变慢，不会被误判。
+DEFAULT_COLLAPSE_RATIO = 0.5
+DEFAULT_MAX_ERROR_RATE = 0.2
+
+MB = 1024 * 1024  # 与 cfst 的 MB/s 单位一致
+_READ_SIZE = 256 * 1024
+
+
+def download(ip, port, host, path, deadline, context, timeout=DEFAULT_TIMEOUT):
+    """向 ip:port 发起一次 HTTPS 下载 (SNI 为 host)，读到 deadline 或响应结束为止
+
+    返回 {ip, bytes, seconds, connect, ttfb, error}，connect / ttfb 单位为 ms。
+    """
+    result = {"ip": ip, "bytes": 0, "seconds": 0.0, "connect": None, "ttfb": None, "error": None}
+    start = time.perf_counter()
+    try:
+        with socket.create_connection((ip, port), timeout=timeout) as raw:
+            with context.wrap_socket(raw, server_hostname=host) as sock:
+                result["connect"] = (time.perf_counter() - start) * 1000
+                sock.sendall(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: load_bench\r\n"
+                             f"Connection: close\r\n\r\n".encode())
+                sent = time.perf_counter()
+                header = b""
+                while b"\r\n\r\n" not in header:
+                    chunk = sock.recv(4096)
+                    if not chunk:
+                        raise ConnectionError("connection closed before response headers")
+                    if not header:
+                        result["ttfb"] = (time.perf_counter() - sent) * 1000
+                    header += chunk
+                head, _, body = header.partition(b"\r\n\r\n")
+                status = head.split(b"\r\n", 1)[0].decode('latin-1')
+                if status.split(" ")[1:2] != ["200"]:
+                    raise ConnectionError(f"unexpected response: {status}")
+                received = len(body)
+                buf = bytearray(_READ_SIZE)
+                while time.perf_counter() < deadline:
+                    n = sock.recv_into(buf)
+                    if not n:
+                        break
+                    received += n
+                result["bytes"] = received
+    except (OSError, ValueError) as e:
+        result["error"] = str(e) or e.__class__.__name__
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def stream(ip, port, host, path, deadline, context, timeout=DEFAULT_TIMEOUT):
+    """单个并发流：在 deadline 之前连续下载，返回每次请求的结果列表"""
+    requests = []
+    while time.perf_counter() < deadline:
+        r = download(ip, port, host, path, deadline, context, timeout)
+        requests.append(r)
+        if r["error"]:
+            time.sleep(0.2)  # 失败后稍作等待，避免空转
+    return requests
+
+
+def percentile(values, p):
+    """最近秩百分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+def jain_fairness(values):
+    """Jain 公平性指数：各 IP 吞吐完全相同时为 1，只有一个 IP 有吞吐时为 1/n"""
+    if not values or not any(values):
+        return 0.0
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+
+def run_benchmark(ips, url=DEFAULT_URL, streams=DEFAULT_STREAMS, duration=DEFAULT_DURATION,
+                  port=None, timeout=DEFAULT_TIMEOUT, insecure=False):
+    """把 streams 个并发下载按轮询分配到 ips，持续 duration 秒，返回 (全部请求结果, 实际耗时秒)"""
+    parts = urlsplit(url)
+    host = parts.hostname
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    port = port or parts.port or 443
+    context = ssl.create_default_context()
+    if insecure:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+
+    from concurrent.futures import ThreadPoolExecutor
+    streams = max(streams, len(ips))
+    start = time.perf_counter()
+    deadline = start + duration
+    with ThreadPoolExecutor(max_workers=streams) as pool:
+        futures = [pool.submit(stream, ips[i % len(ips)], port, host, path, deadline, context, timeout)
+                   for i in range(streams)]
+        requests = [r for f in futures for r in f.result()]
+    return requests, time.perf_counter() - start
+
+
+def summarize(requests, ips, wall, solo=None, streams=None, collapse_ratio=DEFAULT_COLLAPSE_RATIO,
+              max_error_rate=DEFAULT_MAX_ERROR_RATE):
+    """汇总为一条记录：总吞吐、各 IP 吞吐与公平性、首字节延迟的 p50/p95/p99
+
+    collapsed 表示该 IP 在负载下明显落后于同一次测试中的其它 IP：失败请求比例超过 max_error_rate，
+    或每个流的吞吐低于其它 IP 中位数的 collapse_ratio。所有 IP 因本机带宽受限而同样变慢时不会被标记。
+    streams 为并发流总数 (按 run_benchmark 的轮询方式计算每个 IP 的流数)，solo 为 IP -> cfst 单独测速的 MB/s，仅用于展示。
+    """
+    solo = solo or {}
+    streams = max(streams or len(ips), len(ips))
+    per_ip = {}
+    for i, ip in enumerate(ips):
+        own = [r for r in requests if r["ip"] == ip]
+        errors = sum(1 for r in own if r["error"])
+        mbps = sum(r["bytes"] for r in own) / wall / MB if wall else 0.0
+        ttfbs = [r["ttfb"] for r in own if r["ttfb"] is not None]
+        ip_streams = streams // len(ips) + (1 if i < streams % len(ips) else 0)
+        per_ip[ip] = {
+            "mbps": mbps,
+            "streams": ip_streams,
+            "stream_mbps": mbps / ip_streams,
+            "requests": len(own),
+            "errors": errors,
+            "error_rate": errors / len(own) if own else 1.0,
+            "ttfb_p95": percentile(ttfbs, 95),
+            "solo_mbps": solo.get(ip),
+        }
+
+    for ip, entry in per_ip.items():
+        others = [e["stream_mbps"] for other, e in per_ip.items() if other != ip]
+        baseline = percentile(others, 50)
+        slow = baseline is not None and entry["stream_mbps"] < baseline * collapse_ratio
+        entry["collapsed"] = entry["error_rate"] > max_error_rate or slow
+
+    ttfbs = [r["ttfb"] for r in requests if r["ttfb"] is not None]
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "ips": len(ips),
+        "requests": len(requests),
+        "errors": sum(1 for r in requests if r["error"]),
+        "seconds": wall,
+        "aggregate_mbps": sum(r["bytes"] for r in requests) / wall / MB if wall else 0.0,
+        "fairness": jain_fairness([e["mbps"] for e in per_ip.values()]),
+        "ttfb_p50": percentile(ttfbs, 50),
+        "ttfb_p95": percentile(ttfbs, 95),
+        "ttfb_p99": percentile(ttfbs, 99),
+        "per_ip": per_ip,
+    }
+
+
+def load_last_record(path):
+    """读取历史记录文件中的最后一条记录，不存在时返回 None"""
+    if not os.path.exists(path):
+        return None
+    last = None
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                try:
+                    last = json.loads(line)
+                except ValueError:
+                    continue
+    return last
+
+
+def append_record(path, record):
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _ms(value):
+    return f"{value:.0f} ms" if value is not None else "-"
+
+
+def format_report(record, previous=None):
+    """可读报告；提供上一次记录时附带变化量"""
+    lines = [f"{'IP':<40} {'MB/s':>7} {'solo':>7} {'req':>5} {'err':>4} {'ttfb p95':>9}"]
+    for ip, e in sorted(record["per_ip"].items(), key=lambda kv: -kv[1]["mbps"]):
+        solo = f"{e['solo_mbps']:.1f}" if e.get("solo_mbps") else "-"
+        flag = "  collapsed under load" if e["collapsed"] else ""
+        lines.append(f"{ip:<40} {e['mbps']:7.2f} {solo:>7} {e['requests']:5d} {e['errors']:4d} {_ms(e['ttfb_p95']):>9}{flag}")
+    lines.append(f"Aggregate: {record['aggregate_mbps']:.2f} MB/s over {record['ips']} IPs, "
+                 f"{record['requests']} requests ({record['errors']} failed) in {record['seconds']:.1f}s")
+    lines.append(f"Fairness (Jain): {record['fairness']:.3f}")
+    lines.append(f"TTFB p50 / p95 / p99: {_ms(record['ttfb_p50'])} / {_ms(record['ttfb_p95'])} / {_ms(record['ttfb_p99'])}")
+    if previous:
+        def delta(key, unit, fmt="{:+.2f}"):
+            if record.get(key) is None or previous.get(key) is None:
+                return f"{key}: -"
+            return f"{key}: " + fmt.format(record[key] - previous[key]) + unit
+        lines.append(f"Since {previous.get('time', 'previous run')}: "
+                     + ", ".join([delta("aggregate_mbps", " MB/s"), delta("fairness", "", "{:+.3f}"),
+                                  delta("ttfb_p99", " ms", "{:+.0f}")]))
+    return "\n".join(lines)
+
+
+def load_solo_speeds(csv_path):
+    """从 cfst result.csv 读取每个 IP 单独测速的速度 (MB/s)"""
+    if not csv_path or not os.path.exists(csv_path):
+        return {}
+    from vantage import load_vantage_source
+    return {r["ip"]: r["speed"] for rows in load_vantage_source(csv_path).values() for r in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark concurrent download throughput across a set of Cloudflare IPs.')
+    parser.add_argument('-c', '--config', default='/etc/sing-box/config.json', help='Sing-box config whose cloudflare* outbounds are tested')
+    parser.add_argument('--ips', help='Comma-separated IPs to test instead of the config')
+    parser.add_argument('--url', default=DEFAULT_URL, help='Download URL; its host is used as SNI/Host (default: cfst speed URL)')
+    parser.add_argument('--port', type=int, help='Port to connect to on each IP (default: from URL, 443)')
+    parser.add_argument('-n', '--streams', type=int, default=DEFAULT_STREAMS, help=f'Concurrent downloads (default: {DEFAULT_STREAMS})')
+    parser.add_argument('-t', '--duration', type=float, default=DEFAULT_DURATION, help=f'Seconds to run (default: {DEFAULT_DURATION:g})')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help=f'Connect/read timeout in seconds (default: {DEFAULT_TIMEOUT:g})')
+    parser.add_argument('--solo-csv', default='./result.csv', help='cfst result.csv with each IP\'s solo speed (default: ./result.csv)')
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help=f'JSONL file results are appended to (default: {DEFAULT_HISTORY})')
+    parser.add_argument('--insecure', action='store_true', help='Skip TLS certificate verification (for local test servers)')
+    parser.add_argument('--json', action='store_true', help='Print the record as JSON')
+    args = parser.parse_args()
+
+    if args.ips:
+        ips = [ip.strip() for ip in args.ips.split(",") if ip.strip()]
+    else:
+        from update_cloudflare_ips import current_cloudflare_servers
+        ips = list(dict.fromkeys(current_cloudflare_servers(args.config).values()))
+    if not ips:
+        print("Error: No IPs to benchmark.")
+        sys.exit(1)
+
+    print(f"[*] Benchmarking {len(ips)} IPs with {max(args.streams, len(ips))} concurrent downloads for {args.duration:g}s...",
+          file=sys.stderr)
+    requests, wall = run_benchmark(ips, args.url, args.streams, args.duration, args.port, args.timeout, args.insecure)
+    record = summarize(requests, ips, wall, load_solo_speeds(args.solo_csv), args.streams)
+    record.update(url=args.url, streams=max(args.streams, len(ips)))
+    previous = load_last_record(args.history) if args.history else None
+    if args.history:
+        append_record(args.history, record)
+
+    if args.json:
+        print(json.dumps(record, indent=2))
+    else:
+        print(format_report(record, previous))
+    if any(e["collapsed"] for e in record["per_ip"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,23 @@
 import os
 import sys
 import json
-import yaml
 import argparse
+import copy
 
-# 支持的代理类型
-PROXY_TYPES = {
-    "vless", "vmess", "shadowsocks", "trojan", 
-    "hysteria2", "tuic", "wireguard", "hysteria", 
-    "shadowsocksr"
-}
+import config_apply
+from singbox_validate import PROXY_TYPES, validate_config, print_errors
+from metrics import Metrics
+from node_health import check_nodes, DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT
+import udp_probe
+from tiered_groups import build_tiered_groups, is_generated_group, load_geoip_csv
 
 # Clash Verge 同步节点统一绑定网卡
 CLASH_OUTBOUND_BIND_INTERFACE = "wlp4s0"
 
-def convert_clash_to_singbox(proxy):
+# 运行指标 (通过 METRICS_EVENT_LOG / METRICS_PROM_FILE 环境变量输出)
+METRICS = Metrics("merge_configs")
+
+def convert_clash_to_singbox(proxy, bind_interface=CLASH_OUTBOUND_BIND_INTERFACE):
     name = proxy.get('name')
     ptype = proxy.get('type')
     
@@ -36,8 +39,8 @@ def convert_clash_to_singbox(proxy):
                 "type": proxy.get('obfs'),
                 "password": proxy.get('obfs-password')
             }
-        if CLASH_OUTBOUND_BIND_INTERFACE:
-            outbound["bind_interface"] = CLASH_OUTBOUND_BIND_INTERFACE
+        if bind_interface:
+            outbound["bind_interface"] = bind_interface
         return outbound
         
     elif ptype == 'vless':
@@ -77,8 +80,8 @@ def convert_clash_to_singbox(proxy):
                 "path": proxy.get('ws-opts', {}).get('path', '/'),
                 "headers": proxy.get('ws-opts', {}).get('headers', {})
             }
-        if CLASH_OUTBOUND_BIND_INTERFACE:
-            outbound["bind_interface"] = CLASH_OUTBOUND_BIND_INTERFACE
+        if bind_interface:
+            outbound["bind_interface"] = bind_interface
         return outbound
     
     elif ptype == 'shadowsocks':
@@ -90,8 +93,8 @@ def convert_clash_to_singbox(proxy):
             "method": proxy.get('cipher'),
             "password": proxy.get('password')
         }
-        if CLASH_OUTBOUND_BIND_INTERFACE:
-            outbound["bind_interface"] = CLASH_OUTBOUND_BIND_INTERFACE
+        if bind_interface:
+            outbound["bind_interface"] = bind_interface
         return outbound
     
     elif ptype == 'trojan':
@@ -107,19 +110,172 @@ def convert_clash_to_singbox(proxy):
                 "insecure": proxy.get('skip-cert-verify', False)
             }
         }
-        if CLASH_OUTBOUND_BIND_INTERFACE:
-            outbound["bind_interface"] = CLASH_OUTBOUND_BIND_INTERFACE
+        if bind_interface:
+            outbound["bind_interface"] = bind_interface
         return outbound
 
     return None
 
+def convert_clash_proxies(clash_proxies, bind_interface=CLASH_OUTBOUND_BIND_INTERFACE):
+    """批量转换 Clash 代理节点，跳过不支持的协议"""
+    outbounds = []
+    for p in clash_proxies:
+        sb_out = convert_clash_to_singbox(p, bind_interface)
+        if sb_out:
+            outbounds.append(sb_out)
+    return outbounds
+
+def split_outbounds(sb_config, new_outbounds):
+    """分类 Sing-box 原有的 outbounds，返回 (非代理出站, 未被新节点覆盖的原有代理节点)"""
+    old_outbounds = sb_config.get('outbounds', [])
+    non_proxy_outbounds = [] # direct, dns 等
+    original_proxies = {}   # tag -> config
+    
+    # 按照在原配置中的出现顺序记录
+    for o in old_outbounds:
+        tag = o.get('tag')
+        if o.get('type') in PROXY_TYPES:
+            original_proxies[tag] = o
+        elif tag not in ["Clash-Auto", "Auto-Select-All"] and not is_generated_group(o):
+            non_proxy_outbounds.append(o)
+    
+    # 如果存在同名节点，则从原有代理池中移除（标记为已由新节点替换）
+    for o in new_outbounds:
+        if o['tag'] in original_proxies:
+            del original_proxies[o['tag']]
+    return non_proxy_outbounds, list(original_proxies.values())
+
+def merge_outbounds(sb_config, new_outbounds, health=None, drop_failed=False, tiered=False, geoip=None, quiet=False):
+    """将新的 sing-box 代理节点合并进配置，生成 Auto-Select-All 策略组并替换单节点引用
+
+    不修改传入的 sb_config，返回 (合并后的配置, 组内节点 tag 列表)。
+    health 为 node_health.check_nodes() 的结果：失败节点不进入策略组，
+    drop_failed 时直接删除 (仍被其它策略组或 detour 引用的节点只降级)。
+    """
+    log = (lambda *a: None) if quiet else print
+    non_proxy_outbounds, remaining_sb_proxies = split_outbounds(sb_config, new_outbounds)
+    new_clash_outbounds = list(new_outbounds)
+    
+    if not quiet:
+        original_tags = {o.get('tag') for o in sb_config.get('outbounds', []) if o.get('type') in PROXY_TYPES}
+        for o in new_clash_outbounds:
+            if o['tag'] in original_tags:
+                print(f"[*] Overwriting existing proxy: {o['tag']}")
+                METRICS.inc("proxies_overwritten")
+    
+    new_clash_tags = [o['tag'] for o in new_clash_outbounds]
+    remaining_sb_tags = [o.get('tag') for o in remaining_sb_proxies]
+    
+    # 引用替换需要覆盖所有代理节点 (包括被健康检查剔除的节点)
+    all_proxy_tags_set = set(new_clash_tags + remaining_sb_tags)
+    
+    latencies = {}
+    if health:
+        failed = {tag for tag, r in health.items() if not r['alive']}
+        latencies = {tag: r['latency'] for tag, r in health.items() if r['alive']}
+        if drop_failed:
+            # 仍被其它策略组或 detour 引用的节点只降级、不删除，避免产生悬空引用
+            referenced = set()
+            for o in non_proxy_outbounds + new_clash_outbounds + remaining_sb_proxies:
+                referenced.update(o.get('outbounds', []))
+                if o.get('detour'):
+                    referenced.add(o['detour'])
+            dropped = failed - referenced
+            new_clash_outbounds = [o for o in new_clash_outbounds if o['tag'] not in dropped]
+            remaining_sb_proxies = [o for o in remaining_sb_proxies if o.get('tag') not in dropped]
+            log(f"[*] Dropped {len(dropped)} unreachable nodes, demoted {len(failed) - len(dropped)} referenced ones.")
+        else:
+            log(f"[*] Demoted {len(failed)} unreachable nodes out of the auto-select group.")
+        new_clash_tags = [t for t in new_clash_tags if t not in failed]
+        remaining_sb_tags = [t for t in remaining_sb_tags if t not in failed]
+    
+    # 构建最终的 outbounds 列表
+    # 顺序：基础出站 (direct等) -> Clash 节点 -> Sing-box 剩余节点 -> 策略组
+    final_outbounds = non_proxy_outbounds + new_clash_outbounds + remaining_sb_proxies
+    
+    all_proxy_tags = new_clash_tags + remaining_sb_tags
+    
+    # DNS 与路由部分会被改写，复制一份避免影响调用方
+    merged = dict(sb_config)
+    for key in ('dns', 'route'):
+        if key in merged:
+            merged[key] = copy.deepcopy(merged[key])
+    
+    if not all_proxy_tags:
+        log("Warning: No proxy nodes found.")
+    else:
+        # 创建自动选择组
+        group_tag = "Auto-Select-All"
+        if tiered:
+            # 按地区与延迟分层，小组各自测速，顶层组在各层与 direct 之间测速选择
+            member_set = set(all_proxy_tags)
+            proxy_outbounds = [o for o in new_clash_outbounds + remaining_sb_proxies if o.get('tag') in member_set]
+            groups = build_tiered_groups(proxy_outbounds, latencies, geoip)
+            final_outbounds.extend(groups)
+            log(f"[*] Built {len(groups) - 1} tiered urltest groups: {', '.join(g['tag'] for g in groups[:-1])}")
+            METRICS.set("tiered_groups", len(groups) - 1)
+        else:
+            urltest_group = {
+                "type": "urltest",
+                "tag": group_tag,
+                "outbounds": all_proxy_tags + ["direct"],
+                "url": "http://www.gstatic.com/generate_204",
+                "interval": "3m",
+                "tolerance": 50
+            }
+            final_outbounds.append(urltest_group)
+        
+        # 优化：全局替换单节点引用为代理组
+        log(f"[*] Optimizing proxy references (detour/outbound) to use group: {group_tag}")
+        
+        # 1. 替换 DNS detour
+        dns_config = merged.get('dns', {})
+        for server in dns_config.get('servers', []):
+            if server.get('detour') in all_proxy_tags_set:
+                server['detour'] = group_tag
+        
+        # 2. 替换 Route rules
+        route_config = merged.get('route', {})
+        for rule in route_config.get('rules', []):
+            if rule.get('outbound') in all_proxy_tags_set:
+                rule['outbound'] = group_tag
+        
+        # 3. 强制 final 路由指向这个组
+        if "route" in merged:
+            merged["route"]["final"] = group_tag
+
+    merged["outbounds"] = final_outbounds
+    return merged, all_proxy_tags
+
 def main():
     parser = argparse.ArgumentParser(description='Merge Clash proxies into Sing-box configuration.')
     parser.add_argument('-s', '--singbox', help='Path to Sing-box client config', default='/etc/sing-box/config.json')
     parser.add_argument('-c', '--clash', help='Path to Clash config (YAML)')
     parser.add_argument('-o', '--output', help='Path for the merged output file', default='merged_config.json')
+    parser.add_argument('--health-check', action='store_true', help='Probe every node (TCP connect / QUIC reachability) before merging')
+    parser.add_argument('--health-action', choices=['demote', 'drop'], default='demote',
+                        help='What to do with unreachable nodes: keep them out of Auto-Select-All (demote) or remove them (drop)')
+    parser.add_argument('--health-timeout', type=float, default=DEFAULT_TIMEOUT, help=f'Per-node probe timeout in seconds (default: {DEFAULT_TIMEOUT})')
+    parser.add_argument('--health-concurrency', type=int, default=DEFAULT_CONCURRENCY, help=f'Maximum concurrent probes (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--udp-probe', action='store_true',
+                        help='Measure RTT/loss/jitter of hysteria2/tuic nodes with repeated QUIC probes and rank them by it')
+    parser.add_argument('--udp-probe-count', type=udp_probe.positive_int, default=udp_probe.DEFAULT_COUNT,
+                        help=f'QUIC probes per node for --udp-probe (default: {udp_probe.DEFAULT_COUNT})')
+    parser.add_argument('--udp-max-loss', type=float, default=udp_probe.DEFAULT_MAX_LOSS,
+                        help=f'Treat nodes above this packet loss as unreachable (default: {udp_probe.DEFAULT_MAX_LOSS})')
+    parser.add_argument('--tiered', action='store_true',
+                        help='Build per-region/latency urltest groups under Auto-Select-All instead of one flat group')
+    parser.add_argument('--geoip-csv', help='IPv4 "CIDR,country" CSV used to locate nodes whose names carry no region')
+    parser.add_argument('--apply', action='store_true',
+                        help='Treat the output as the live config: restart sing-box after writing and roll back if it does not become healthy')
+    parser.add_argument('--profile', action='store_true', help='Record cProfile/tracemalloc data and write <output>.profile.txt')
     args = parser.parse_args()
 
+    if args.profile:
+        from profiling import Profiler
+        METRICS.profiler = Profiler("merge_configs")
+        METRICS.profiler.write_report_at_exit(args.output)
+
     sb_path = args.singbox
     clash_path = args.clash
     output_path = args.output
@@ -155,91 +311,82 @@ def main():
     print(f"[*] Reading Sing-box config: {sb_path}")
     print(f"[*] Reading Clash config: {clash_path}")
 
-    with open(sb_path, 'r') as f:
-        sb_config = json.load(f)
-    
-    with open(clash_path, 'r') as f:
-        clash_config = yaml.safe_load(f)
-    
-    # 分类 Sing-box 原有的 outbounds
-    old_outbounds = sb_config.get('outbounds', [])
-    non_proxy_outbounds = [] # direct, dns 等
-    original_proxies = {}   # tag -> config
-    
-    # 按照在原配置中的出现顺序记录
-    for o in old_outbounds:
-        tag = o.get('tag')
-        if o.get('type') in PROXY_TYPES:
-            original_proxies[tag] = o
-        elif tag not in ["Clash-Auto", "Auto-Select-All"]:
-            non_proxy_outbounds.append(o)
+    with METRICS.phase("load"):
+        with open(sb_path, 'r') as f:
+            sb_config = json.load(f)
+        
+        import yaml  # 按需加载，参数或路径错误时无需付出 PyYAML 的导入开销
+        with open(clash_path, 'r') as f:
+            clash_config = yaml.safe_load(f)
     
     # 转换 Clash 代理节点
     clash_proxies = clash_config.get('proxies', [])
-    new_clash_outbounds = []
-    new_clash_tags = []
-    
-    for p in clash_proxies:
-        sb_out = convert_clash_to_singbox(p)
-        if sb_out:
-            tag = sb_out['tag']
-            # 如果存在同名节点，则从原有代理池中移除（标记为已由 Clash 替换）
-            if tag in original_proxies:
-                print(f"[*] Overwriting existing proxy: {tag}")
-                del original_proxies[tag]
-            
-            new_clash_outbounds.append(sb_out)
-            new_clash_tags.append(tag)
-    
-    # 剩余的 original_proxies 就是没被 Clash 替换的 SB 节点
-    remaining_sb_proxies = list(original_proxies.values())
-    remaining_sb_tags = [o.get('tag') for o in remaining_sb_proxies]
-    
-    # 构建最终的 outbounds 列表
-    # 顺序：基础出站 (direct等) -> Clash 节点 -> Sing-box 剩余节点 -> 策略组
-    final_outbounds = non_proxy_outbounds + new_clash_outbounds + remaining_sb_proxies
+    with METRICS.phase("convert"):
+        new_clash_outbounds = convert_clash_proxies(clash_proxies)
+    METRICS.set("clash_proxies", len(clash_proxies))
+    METRICS.set("proxies_converted", len(new_clash_outbounds))
     
-    all_proxy_tags = new_clash_tags + remaining_sb_tags
-    all_proxy_tags_set = set(all_proxy_tags)
+    # 健康检查：不可达节点不进入 Auto-Select-All，减少 urltest 的无效探测
+    health = None
+    if args.health_check:
+        _, remaining_sb_proxies = split_outbounds(sb_config, new_clash_outbounds)
+        candidates = new_clash_outbounds + remaining_sb_proxies
+        print(f"[*] Health checking {len(candidates)} nodes (concurrency {args.health_concurrency}, timeout {args.health_timeout}s)...")
+        with METRICS.phase("health_check"):
+            health = check_nodes(candidates, args.health_concurrency, args.health_timeout)
+        failed = [tag for tag, r in health.items() if not r['alive']]
+        for tag in failed:
+            print(f"[!] Unreachable ({health[tag]['method']}): {tag} - {health[tag]['error']}")
+        METRICS.set("nodes_checked", len(candidates))
+        METRICS.set("nodes_failed", len(failed))
+
+    # UDP 路径测量：hysteria2 / tuic 的 TCP 结果没有参考价值，改用 RTT、丢包与抖动折算的等效延迟参与排名
+    if args.udp_probe:
+        _, remaining_sb_proxies = split_outbounds(sb_config, new_clash_outbounds)
+        candidates = new_clash_outbounds + remaining_sb_proxies
+        with METRICS.phase("udp_probe"):
+            udp_results = udp_probe.probe_nodes(candidates, args.health_concurrency, args.udp_probe_count)
+        print(f"[*] UDP path probed {len(udp_results)} QUIC-based nodes ({args.udp_probe_count} probes each).")
+        health = dict(health or {})
+        for tag, result in udp_results.items():
+            health[tag] = udp_probe.to_health(result, args.udp_max_loss)
+            print(f"[{'+' if health[tag]['alive'] else '!'}] {tag}: {udp_probe.format_result(result)}")
+        METRICS.set("udp_nodes_probed", len(udp_results))
+        METRICS.set("udp_nodes_failed", sum(1 for tag in udp_results if not health[tag]['alive']))
     
-    if not all_proxy_tags:
-        print("Warning: No proxy nodes found.")
-    else:
-        # 创建自动选择组
-        group_tag = "Auto-Select-All"
-        urltest_group = {
-            "type": "urltest",
-            "tag": group_tag,
-            "outbounds": all_proxy_tags + ["direct"],
-            "url": "http://www.gstatic.com/generate_204",
-            "interval": "3m",
-            "tolerance": 50
-        }
-        final_outbounds.append(urltest_group)
-        
-        # 优化：全局替换单节点引用为代理组
-        print(f"[*] Optimizing proxy references (detour/outbound) to use group: {group_tag}")
-        
-        # 1. 替换 DNS detour
-        dns_config = sb_config.get('dns', {})
-        for server in dns_config.get('servers', []):
-            if server.get('detour') in all_proxy_tags_set:
-                server['detour'] = group_tag
-        
-        # 2. 替换 Route rules
-        route_config = sb_config.get('route', {})
-        for rule in route_config.get('rules', []):
-            if rule.get('outbound') in all_proxy_tags_set:
-                rule['outbound'] = group_tag
-        
-        # 3. 强制 final 路由指向这个组
-        if "route" in sb_config:
-            sb_config["route"]["final"] = group_tag
+    sb_config, all_proxy_tags = merge_outbounds(
+        sb_config, new_clash_outbounds,
+        health=health,
+        drop_failed=args.health_action == 'drop',
+        tiered=args.tiered,
+        geoip=load_geoip_csv(args.geoip_csv) if args.tiered else None
+    )
+    group_tag = "Auto-Select-All"
 
-    sb_config["outbounds"] = final_outbounds
+    # 写入前进行进程内校验，避免生成无法被 sing-box 加载的配置
+    with METRICS.phase("validate"):
+        errors = validate_config(sb_config)
+    if errors:
+        print(f"Error: Merged config failed validation ({len(errors)} problem(s)), not saved:")
+        print_errors(errors)
+        METRICS.finish(False)
+        sys.exit(1)
 
-    with open(output_path, 'w') as f:
-        json.dump(sb_config, f, indent=2, ensure_ascii=False)
+    if args.apply:
+        # 事务式应用：保存旧版本 -> 原子替换 -> 重启 sing-box -> 健康检查，失败时回滚
+        with METRICS.phase("apply"):
+            applied = config_apply.apply_config(sb_config, output_path)
+        if not applied:
+            print(f"Error: sing-box did not become healthy with the merged config, {output_path} was rolled back.")
+            METRICS.finish(False)
+            sys.exit(1)
+    else:
+        with METRICS.phase("dump"):
+            config_apply.write_json(output_path, sb_config)
+    METRICS.set("group_members", len(all_proxy_tags))
+    METRICS.finish(True)
+    if METRICS.profiler:
+        METRICS.profiler.write_report(output_path)
     
     print(f"[+] Successfully merged/replaced proxies.")
     print(f"[+] Target group '{group_tag}' contains {len(all_proxy_tags)} nodes.")
@@ -0,0 +1,115 @@
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+# 通过环境变量开启输出 (默认只在内存中统计)
+# METRICS_EVENT_LOG: JSON Lines 事件日志路径 (追加写入)
+# METRICS_PROM_FILE: Prometheus node_exporter textfile collector 输出路径 (*.prom)，
+#                    若为目录则写入 <目录>/<job>.prom，便于多个工具共用一个目录
+METRICS_EVENT_LOG = os.getenv("METRICS_EVENT_LOG", "")
+METRICS_PROM_FILE = os.getenv("METRICS_PROM_FILE", "")
+
+PROM_PREFIX = "singbox_tools"
+
+
+class Metrics:
+    """按阶段计时与计数，并可输出 JSON Lines 事件日志和 Prometheus textfile"""
+
+    def __init__(self, job, event_log=None, prom_file=None):
+        self.job = job
+        self.event_log = METRICS_EVENT_LOG if event_log is None else event_log
+        self.prom_file = METRICS_PROM_FILE if prom_file is None else prom_file
+        self.started = time.time()
+        self.phases = {}    # phase -> 累计耗时 (秒)
+        self.counters = {}  # name -> 数值
+        self.success = None
+        self.profiler = None  # 可选的 profiling.Profiler，开启后每个阶段同时被 profile
+
+    def event(self, name, **fields):
+        """写入一条事件到 JSON Lines 日志"""
+        if not self.event_log:
+            return
+        record = {"ts": round(time.time(), 3), "job": self.job, "event": name}
+        record.update(fields)
+        try:
+            with open(self.event_log, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Warning: 无法写入事件日志 {self.event_log}: {e}")
+
+    @contextmanager
+    def phase(self, name):
+        """统计一个阶段的耗时，异常时同样记录并继续抛出"""
+        start = time.perf_counter()
+        ok = True
+        try:
+            with self.profiler.phase(name) if self.profiler else nullcontext():
+                yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+            self.event("phase", phase=name, seconds=round(elapsed, 6), ok=ok)
+
+    def inc(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        self.counters[name] = value
+
+    def finish(self, success=True):
+        """结束本次运行：记录汇总事件并输出 Prometheus 文件"""
+        self.success = success
+        duration = time.time() - self.started
+        self.event("finish", success=success, seconds=round(duration, 6),
+                   phases={k: round(v, 6) for k, v in self.phases.items()},
+                   counters=self.counters)
+        if self.prom_file:
+            self.write_prometheus(duration)
+
+    def summary(self):
+        """返回可打印的阶段耗时摘要"""
+        return ", ".join(f"{k}={v:.2f}s" for k, v in self.phases.items())
+
+    def write_prometheus(self, duration):
+        """原子写入 textfile collector 格式，避免 node_exporter 读到半个文件"""
+        job = self.job.replace('\\', '\\\\').replace('"', '\\"')
+        lines = [
+            f"# HELP {PROM_PREFIX}_phase_duration_seconds Duration of each phase of the last run.",
+            f"# TYPE {PROM_PREFIX}_phase_duration_seconds gauge",
+        ]
+        for name, seconds in self.phases.items():
+            lines.append(f'{PROM_PREFIX}_phase_duration_seconds{{job="{job}",phase="{name}"}} {seconds:.6f}')
+
+        lines += [
+            f"# HELP {PROM_PREFIX}_count Counters recorded during the last run.",
+            f"# TYPE {PROM_PREFIX}_count gauge",
+        ]
+        for name, value in self.counters.items():
+            lines.append(f'{PROM_PREFIX}_count{{job="{job}",name="{name}"}} {value}')
+
+        lines += [
+            f"# HELP {PROM_PREFIX}_run_duration_seconds Total duration of the last run.",
+            f"# TYPE {PROM_PREFIX}_run_duration_seconds gauge",
+            f'{PROM_PREFIX}_run_duration_seconds{{job="{job}"}} {duration:.6f}',
+            f"# HELP {PROM_PREFIX}_run_success Whether the last run succeeded.",
+            f"# TYPE {PROM_PREFIX}_run_success gauge",
+            f'{PROM_PREFIX}_run_success{{job="{job}"}} {1 if self.success else 0}',
+            f"# HELP {PROM_PREFIX}_last_run_timestamp_seconds Unix time the last run finished.",
+            f"# TYPE {PROM_PREFIX}_last_run_timestamp_seconds gauge",
+            f'{PROM_PREFIX}_last_run_timestamp_seconds{{job="{job}"}} {time.time():.0f}',
+        ]
+
+        prom_path = self.prom_file
+        if os.path.isdir(prom_path):
+            prom_path = os.path.join(prom_path, f"{self.job}.prom")
+        tmp_path = f"{prom_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, prom_path)
+        except OSError as e:
+            print(f"Warning: 无法写入 Prometheus 指标文件 {prom_path}: {e}")
@@ -0,0 +1,99 @@
+import os
+import socket
+import time
+
+# 基于 QUIC (UDP) 的协议，其余协议按 TCP 检查
+UDP_PROTOCOLS = {"hysteria2", "hysteria", "tuic", "wireguard"}
+
+DEFAULT_TIMEOUT = 3.0
+DEFAULT_CONCURRENCY = 32
+
+# QUIC 长包头 + 保留版本号 (0x?a?a?a?a)，正常的 QUIC 服务端会回复 Version Negotiation 包。
+# 按 RFC 9000 要求，客户端 Initial 包需填充到至少 1200 字节才会被服务端处理。
+QUIC_PROBE_VERSION = b"\x1a\x2a\x3a\x4a"
+QUIC_PROBE_SIZE = 1200
+
+
+def build_quic_probe():
+    """构造触发 QUIC Version Negotiation 的探测包"""
+    dcid = os.urandom(8)
+    scid = os.urandom(8)
+    header = b"\xc0" + QUIC_PROBE_VERSION + bytes([len(dcid)]) + dcid + bytes([len(scid)]) + scid
+    return header + b"\x00" * (QUIC_PROBE_SIZE - len(header))
+
+
+def probe_tcp(server, port, timeout=DEFAULT_TIMEOUT, interface=None):
+    """TCP 握手探测，返回 (alive, 延迟 ms, 错误信息)
+
+    指定 interface 时用 SO_BINDTODEVICE 绑定物理网卡 (需要 root / CAP_NET_RAW)，
+    探测包不会被 sing-box 的 tun (auto_route) 截获，测到的是直连路径。
+    """
+    try:
+        family, _, _, _, addr = socket.getaddrinfo(server, port, 0, socket.SOCK_STREAM)[0]
+    except OSError as e:
+        return False, None, str(e) or e.__class__.__name__
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        if interface:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, interface.encode())
+        sock.settimeout(timeout)
+        start = time.perf_counter()
+        sock.connect(addr)
+        return True, (time.perf_counter() - start) * 1000, None
+    except OSError as e:
+        return False, None, str(e) or e.__class__.__name__
+    finally:
+        sock.close()
+
+
+def probe_udp(server, port, timeout=DEFAULT_TIMEOUT):
+    """UDP/QUIC 可达性探测，返回 (alive, 延迟 ms, 错误信息)
+
+    收到任意回包视为存活；收到 ICMP 端口不可达或无法解析/路由视为失败；
+    超时无回包 (例如开启了 obfs 的 hysteria2 会静默丢弃) 无法判断，按存活处理但延迟为 None。
+    """
+    try:
+        family, _, _, _, addr = socket.getaddrinfo(server, port, 0, socket.SOCK_DGRAM)[0]
+    except OSError as e:
+        return False, None, str(e) or e.__class__.__name__
+
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    try:
+        # connect 之后内核才会把 ICMP 不可达作为 ConnectionRefusedError 返回
+        sock.connect(addr)
+        start = time.perf_counter()
+        sock.send(build_quic_probe())
+        sock.recv(2048)
+        return True, (time.perf_counter() - start) * 1000, None
+    except socket.timeout:
+        return True, None, "no reply (unknown)"
+    except OSError as e:
+        return False, None, str(e) or e.__class__.__name__
+    finally:
+        sock.close()
+
+
+def check_node(outbound, timeout=DEFAULT_TIMEOUT):
+    """按协议检查单个 sing-box 出站，返回结果字典"""
+    server = outbound.get('server')
+    port = outbound.get('server_port')
+    proto = "udp" if outbound.get('type') in UDP_PROTOCOLS else "tcp"
+    if not server or not isinstance(port, int):
+        return {"alive": False, "latency": None, "method": proto, "error": "missing server/server_port"}
+
+    if proto == "udp":
+        alive, latency, error = probe_udp(server, port, timeout)
+    else:
+        alive, latency, error = probe_tcp(server, port, timeout)
+    return {"alive": alive, "latency": latency, "method": proto, "error": error}
+
+
+def check_nodes(outbounds, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+    """并发检查一组出站 (全局并发上限 concurrency)，返回 tag -> 结果"""
+    if not outbounds:
+        return {}
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(outbounds)))) as pool:
+        results = pool.map(lambda ob: check_node(ob, timeout), outbounds)
+        return {ob.get('tag'): r for ob, r in zip(outbounds, results)}
@@ -0,0 +1,90 @@
+import atexit
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+TOP_FUNCTIONS = 15
+TOP_ALLOCATIONS = 10
+
+
+class Profiler:
+    """在各阶段 (load/convert/dump 等) 周围记录 cProfile 与 tracemalloc 快照，并生成文本报告"""
+
+    def __init__(self, job):
+        self.job = job
+        self.phases = []  # (name, seconds, pstats 文本, 分配点列表, 阶段峰值)
+        self.exit_report_path = None
+        self.written = False
+        tracemalloc.start(25)
+
+    @contextmanager
+    def phase(self, name):
+        profile = cProfile.Profile()
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+
+            out = io.StringIO()
+            stats = pstats.Stats(profile, stream=out)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+
+            # 只保留本阶段新增的分配，忽略 tracemalloc 自身
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+            diff = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+            allocations = [d for d in diff if d.size_diff > 0][:TOP_ALLOCATIONS]
+            self.phases.append((name, elapsed, out.getvalue(), allocations, peak))
+
+    def report(self):
+        """生成可读的性能报告文本"""
+        _, overall_peak = tracemalloc.get_traced_memory()
+        lines = [f"Profile report for {self.job}", "=" * 60]
+        for name, elapsed, _, _, peak in self.phases:
+            lines.append(f"{name:<20} {elapsed * 1000:10.2f} ms   peak {peak / 1024 / 1024:8.2f} MiB")
+        overall_peak = max([overall_peak] + [p[4] for p in self.phases])
+        lines.append(f"{'peak memory':<20} {overall_peak / 1024 / 1024:24.2f} MiB")
+
+        for name, elapsed, stats_text, allocations, _ in self.phases:
+            lines += ["", "-" * 60, f"[{name}] top functions (cumulative time)", "-" * 60]
+            lines.append(stats_text.strip())
+            lines += ["", f"[{name}] top allocation sites"]
+            if not allocations:
+                lines.append("  (none)")
+            for stat in allocations:
+                frame = stat.traceback[0]
+                lines.append(f"  {frame.filename}:{frame.lineno}: +{stat.size_diff / 1024:.1f} KiB ({stat.count_diff:+d} blocks)")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, output_path):
+        """将报告写到输出文件旁边 (<output>.profile.txt)，返回报告路径"""
+        report_path = f"{output_path}.profile.txt"
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(self.report())
+        tracemalloc.stop()
+        self.written = True
+        print(f"[+] Profile report saved to: {report_path}")
+        return report_path
+
+    def write_report_at_exit(self, output_path):
+        """进程退出时写出报告 (包括提前 sys.exit、未捕获的异常与 Ctrl-C)，再次调用可更新输出路径"""
+        if self.exit_report_path is None:
+            atexit.register(self._write_exit_report)
+        self.exit_report_path = output_path
+
+    def _write_exit_report(self):
+        if self.written:
+            return
+        try:
+            self.write_report(self.exit_report_path)
+        except OSError as e:
+            print(f"[!] Failed to write profile report: {e}")
@@ -0,0 +1,381 @@
+import struct
+import zlib
+
+# 纯 Python 实现的 QR 码编码器 (字节模式，版本 1~40，自动选择掩码)
+# 参考 ISO/IEC 18004 与 Project Nayuki 的 QR Code generator 实现，用于替代 npx qrcode-terminal。
+
+# 纠错等级在格式信息中的编码
+ECC_FORMAT_BITS = {"L": 1, "M": 0, "Q": 3, "H": 2}
+ECC_INDEX = {"L": 0, "M": 1, "Q": 2, "H": 3}
+
+# 每个块的纠错码字数 [纠错等级][版本]
+ECC_CODEWORDS_PER_BLOCK = (
+    (-1, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28, 28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    (-1, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26, 26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    (-1, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30, 28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    (-1, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28, 30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+)
+
+# 纠错块数量 [纠错等级][版本]
+NUM_ERROR_CORRECTION_BLOCKS = (
+    (-1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8, 8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    (-1, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16, 17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    (-1, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20, 23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    (-1, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25, 25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+)
+
+MASK_PATTERNS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+
+
+def _get_bit(value, i):
+    return (value >> i) & 1 != 0
+
+
+# ---------- Reed-Solomon (GF(2^8)，本原多项式 0x11D) ----------
+
+def _rs_multiply(x, y):
+    z = 0
+    for i in reversed(range(8)):
+        z = (z << 1) ^ ((z >> 7) * 0x11D)
+        z ^= ((y >> i) & 1) * x
+    return z
+
+
+def _rs_divisor(degree):
+    result = [0] * (degree - 1) + [1]
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            result[j] = _rs_multiply(result[j], root)
+            if j + 1 < degree:
+                result[j] ^= result[j + 1]
+        root = _rs_multiply(root, 0x02)
+    return result
+
+
+def _rs_remainder(data, divisor):
+    result = [0] * len(divisor)
+    for b in data:
+        factor = b ^ result.pop(0)
+        result.append(0)
+        for i, coef in enumerate(divisor):
+            result[i] ^= _rs_multiply(coef, factor)
+    return result
+
+
+# ---------- 容量计算 ----------
+
+def _num_raw_data_modules(ver):
+    result = (16 * ver + 128) * ver + 64
+    if ver >= 2:
+        num_align = ver // 7 + 2
+        result -= (25 * num_align - 10) * num_align - 55
+        if ver >= 7:
+            result -= 36
+    return result
+
+
+def _num_data_codewords(ver, ecl):
+    e = ECC_INDEX[ecl]
+    return _num_raw_data_modules(ver) // 8 - ECC_CODEWORDS_PER_BLOCK[e][ver] * NUM_ERROR_CORRECTION_BLOCKS[e][ver]
+
+
+def _alignment_positions(ver):
+    if ver == 1:
+        return []
+    size = ver * 4 + 17
+    num_align = ver // 7 + 2
+    step = 26 if ver == 32 else (ver * 4 + num_align * 2 + 1) // (num_align * 2 - 2) * 2
+    result = [size - 7 - i * step for i in range(num_align - 1)] + [6]
+    return list(reversed(result))
+
+
+# ---------- 编码 ----------
+
+def _encode_data(data, ecl):
+    """字节模式编码，返回 (版本, 数据码字)"""
+    for ver in range(1, 41):
+        count_bits = 8 if ver <= 9 else 16
+        capacity = _num_data_codewords(ver, ecl) * 8
+        used = 4 + count_bits + len(data) * 8
+        if len(data) < (1 << count_bits) and used <= capacity:
+            break
+    else:
+        raise ValueError(f"data too long for a QR code ({len(data)} bytes)")
+
+    bits = []
+
+    def append(value, length):
+        bits.extend((value >> i) & 1 for i in reversed(range(length)))
+
+    append(0b0100, 4)  # 字节模式
+    append(len(data), count_bits)
+    for b in data:
+        append(b, 8)
+
+    append(0, min(4, capacity - len(bits)))   # 终止符
+    append(0, -len(bits) % 8)                  # 补齐到字节边界
+    codewords = [int("".join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8)]
+    pad = 0xEC
+    while len(codewords) < capacity // 8:
+        codewords.append(pad)
+        pad ^= 0xEC ^ 0x11
+    return ver, codewords
+
+
+def _add_ecc_and_interleave(data, ver, ecl):
+    e = ECC_INDEX[ecl]
+    num_blocks = NUM_ERROR_CORRECTION_BLOCKS[e][ver]
+    block_ecc_len = ECC_CODEWORDS_PER_BLOCK[e][ver]
+    raw_codewords = _num_raw_data_modules(ver) // 8
+    num_short_blocks = num_blocks - raw_codewords % num_blocks
+    short_block_len = raw_codewords // num_blocks
+
+    divisor = _rs_divisor(block_ecc_len)
+    blocks = []
+    k = 0
+    for i in range(num_blocks):
+        dat = data[k:k + short_block_len - block_ecc_len + (0 if i < num_short_blocks else 1)]
+        k += len(dat)
+        ecc = _rs_remainder(dat, divisor)
+        if i < num_short_blocks:
+            dat.append(0)
+        blocks.append(dat + ecc)
+
+    result = []
+    for i in range(len(blocks[0])):
+        for j, block in enumerate(blocks):
+            # 短块中的填充字节不输出
+            if i != short_block_len - block_ecc_len or j >= num_short_blocks:
+                result.append(block[i])
+    return result
+
+
+class QRCode:
+    """QR 码矩阵，modules[y][x] 为 True 表示深色模块"""
+
+    def __init__(self, ver, ecl, codewords, mask=None):
+        self.version = ver
+        self.ecl = ecl
+        self.size = ver * 4 + 17
+        self.modules = [[False] * self.size for _ in range(self.size)]
+        self._function = [[False] * self.size for _ in range(self.size)]
+
+        self._draw_function_patterns()
+        self._draw_codewords(codewords)
+
+        if mask is None:
+            best = None
+            for m in range(8):
+                self._apply_mask(m)
+                self._draw_format_bits(m)
+                penalty = self._penalty_score()
+                if best is None or penalty < best[0]:
+                    best = (penalty, m)
+                self._apply_mask(m)  # 再次异或即可撤销
+            mask = best[1]
+        self.mask = mask
+        self._apply_mask(mask)
+        self._draw_format_bits(mask)
+        self._function = None
+
+    # ----- 功能图形 -----
+
+    def _set_function(self, x, y, dark):
+        self.modules[y][x] = dark
+        self._function[y][x] = True
+
+    def _draw_function_patterns(self):
+        size = self.size
+        for i in range(size):
+            self._set_function(6, i, i % 2 == 0)
+            self._set_function(i, 6, i % 2 == 0)
+
+        for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):
+            for dy in range(-4, 5):
+                for dx in range(-4, 5):
+                    x, y = cx + dx, cy + dy
+                    if 0 <= x < size and 0 <= y < size:
+                        self._set_function(x, y, max(abs(dx), abs(dy)) not in (2, 4))
+
+        positions = _alignment_positions(self.version)
+        last = len(positions) - 1
+        for i, px in enumerate(positions):
+            for j, py in enumerate(positions):
+                if (i, j) in ((0, 0), (0, last), (last, 0)):
+                    continue
+                for dy in range(-2, 3):
+                    for dx in range(-2, 3):
+                        self._set_function(px + dx, py + dy, max(abs(dx), abs(dy)) != 1)
+
+        self._draw_format_bits(0)  # 先占位，掩码确定后再写入
+        self._draw_version()
+
+    def _draw_format_bits(self, mask):
+        size = self.size
+        data = ECC_FORMAT_BITS[self.ecl] << 3 | mask
+        rem = data
+        for _ in range(10):
+            rem = (rem << 1) ^ ((rem >> 9) * 0x537)
+        bits = (data << 10 | rem) ^ 0x5412
+
+        for i in range(0, 6):
+            self._set_function(8, i, _get_bit(bits, i))
+        self._set_function(8, 7, _get_bit(bits, 6))
+        self._set_function(8, 8, _get_bit(bits, 7))
+        self._set_function(7, 8, _get_bit(bits, 8))
+        for i in range(9, 15):
+            self._set_function(14 - i, 8, _get_bit(bits, i))
+
+        for i in range(0, 8):
+            self._set_function(size - 1 - i, 8, _get_bit(bits, i))
+        for i in range(8, 15):
+            self._set_function(8, size - 15 + i, _get_bit(bits, i))
+        self._set_function(8, size - 8, True)  # 固定的深色模块
+
+    def _draw_version(self):
+        if self.version < 7:
+            return
+        rem = self.version
+        for _ in range(12):
+            rem = (rem << 1) ^ ((rem >> 11) * 0x1F25)
+        bits = self.version << 12 | rem
+        for i in range(18):
+            bit = _get_bit(bits, i)
+            a, b = self.size - 11 + i % 3, i // 3
+            self._set_function(a, b, bit)
+            self._set_function(b, a, bit)
+
+    # ----- 数据区 -----
+
+    def _draw_codewords(self, data):
+        size = self.size
+        i = 0
+        total = len(data) * 8
+        right = size - 1
+        while right >= 1:
+            if right == 6:
+                right = 5
+            upward = ((right + 1) & 2) == 0
+            for vert in range(size):
+                y = size - 1 - vert if upward else vert
+                for j in range(2):
+                    x = right - j
+                    if not self._function[y][x] and i < total:
+                        self.modules[y][x] = _get_bit(data[i >> 3], 7 - (i & 7))
+                        i += 1
+            right -= 2
+
+    def _apply_mask(self, mask):
+        pattern = MASK_PATTERNS[mask]
+        for y in range(self.size):
+            row, func = self.modules[y], self._function[y]
+            for x in range(self.size):
+                if not func[x] and pattern(x, y):
+                    row[x] = not row[x]
+
+    # ----- 掩码评分 (N1~N4 规则) -----
+
+    def _penalty_score(self):
+        size = self.size
+        modules = self.modules
+        columns = [[modules[y][x] for y in range(size)] for x in range(size)]
+        result = 0
+        finder_like = ([True, False, True, True, True, False, True, False, False, False, False],
+                       [False, False, False, False, True, False, True, True, True, False, True])
+
+        for line in modules + columns:
+            run_color, run_len = None, 0
+            for dark in line:
+                if dark == run_color:
+                    run_len += 1
+                    if run_len == 5:
+                        result += 3
+                    elif run_len > 5:
+                        result += 1
+                else:
+                    run_color, run_len = dark, 1
+            for i in range(size - 10):
+                segment = line[i:i + 11]
+                if segment == finder_like[0] or segment == finder_like[1]:
+                    result += 40
+
+        for y in range(size - 1):
+            for x in range(size - 1):
+                c = modules[y][x]
+                if c == modules[y][x + 1] == modules[y + 1][x] == modules[y + 1][x + 1]:
+                    result += 3
+
+        dark = sum(sum(row) for row in modules)
+        total = size * size
+        k = (abs(dark * 20 - total * 10) + total - 1) // total - 1
+        result += k * 10
+        return result
+
+    # ----- 输出 -----
+
+    def to_terminal(self, border=2):
+        """使用半高方块字符与 ANSI 颜色输出，两行模块合并为一行文本"""
+        size = self.size
+        def dark(x, y):
+            return 0 <= x < size and 0 <= y < size and self.modules[y][x]
+
+        lines = []
+        for y in range(-border, size + border, 2):
+            parts = []
+            for x in range(-border, size + border):
+                top = 30 if dark(x, y) else 37
+                bottom = 40 if dark(x, y + 1) else 47
+                parts.append(f"\033[{top};{bottom}m▀")
+            lines.append("".join(parts) + "\033[0m")
+        return "\n".join(lines)
+
+    def to_svg(self, scale=8, border=4):
+        dim = (self.size + border * 2) * scale
+        rects = []
+        for y, row in enumerate(self.modules):
+            for x, dark in enumerate(row):
+                if dark:
+                    rects.append(f"M{(x + border) * scale},{(y + border) * scale}h{scale}v{scale}h-{scale}z")
+        return (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {dim} {dim}" width="{dim}" height="{dim}">'
+                f'<rect width="100%" height="100%" fill="#fff"/>'
+                f'<path d="{"".join(rects)}" fill="#000"/></svg>\n')
+
+    def to_png(self, scale=8, border=4):
+        """输出 1 位灰度 PNG"""
+        dim = (self.size + border * 2) * scale
+        raw = bytearray()
+        for y in range(-border, self.size + border):
+            bits = []
+            for x in range(-border, self.size + border):
+                dark = 0 <= x < self.size and 0 <= y < self.size and self.modules[y][x]
+                bits.extend([0 if dark else 1] * scale)
+            bits.extend([0] * (-len(bits) % 8))
+            row = bytes(int("".join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+            for _ in range(scale):
+                raw.append(0)  # 过滤类型: None
+                raw.extend(row)
+
+        def chunk(kind, data):
+            return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+        return (b"\x89PNG\r\n\x1a\n"
+                + chunk(b"IHDR", struct.pack(">IIBBBBB", dim, dim, 1, 0, 0, 0, 0))
+                + chunk(b"IDAT", zlib.compress(bytes(raw), 9))
+                + chunk(b"IEND", b""))
+
+
+def encode(text, ecl="M"):
+    """将文本编码为 QRCode 对象"""
+    data = text.encode('utf-8') if isinstance(text, str) else bytes(text)
+    ver, codewords = _encode_data(data, ecl)
+    return QRCode(ver, ecl, _add_ecc_and_interleave(codewords, ver, ecl))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import update_cloudflare_ips as cf
+from vantage import parse_result_csv, load_vantage_source, aggregate_rankings
+from metrics import Metrics
+
+# 运行指标 (通过 METRICS_EVENT_LOG / METRICS_PROM_FILE 环境变量输出)
+METRICS = Metrics("replay_selection")
+
+# 选择策略：对应 update_cloudflare_ips.py 中的多样性约束设置
+STRATEGIES = {
+    "top": {"max_per_colo": 0, "max_per_subnet": 0},   # 只按速度排名 (原始行为)
+    "diverse": {"max_per_colo": None, "max_per_subnet": None},  # 使用 MAX_PER_COLO / MAX_PER_SUBNET
+}
+
+
+def list_runs(paths):
+    """展开历史记录：CSV 文件为一次测速；目录中每个 *.csv 为一次测速，每个子目录为一次多测速点测速"""
+    runs = []
+    for path in paths:
+        if os.path.isdir(path) and not any(f.endswith(".csv") for f in os.listdir(path)):
+            runs.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                        if os.path.isdir(os.path.join(path, name)))
+        elif os.path.isdir(path):
+            runs.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                        if name.endswith(".csv") or os.path.isdir(os.path.join(path, name)))
+        else:
+            runs.append(path)
+    return runs
+
+
+def load_run(path):
+    """读取一次测速记录，返回 IP -> {speed, colo}；多测速点目录取各点平均速度"""
+    if os.path.isdir(path):
+        ranking = aggregate_rankings({k: v for k, v in load_vantage_source(path).items() if v})
+        return {r["ip"]: {"speed": r["speed"], "colo": r["colo"]} for r in ranking}
+    with open(path, 'r', encoding='utf-8') as f:
+        rows = parse_result_csv(f.read())
+    result = {}
+    for r in rows:
+        if r["ip"] not in result or r["speed"] > result[r["ip"]]["speed"]:
+            result[r["ip"]] = {"speed": r["speed"], "colo": r["colo"]}
+    return result
+
+
+@contextlib.contextmanager
+def pipeline_settings(run_path, strategy, max_tags, min_speed):
+    """临时修改 update_cloudflare_ips 的模块配置，使其读取录制的数据"""
+    names = ("RESULT_CSV_FILE", "VANTAGE_SOURCES", "MAX_TAGS", "MIN_SPEED", "MAX_PER_COLO", "MAX_PER_SUBNET")
+    saved = {name: getattr(cf, name) for name in names}
+    try:
+        if os.path.isdir(run_path):
+            cf.VANTAGE_SOURCES = [run_path]
+        else:
+            cf.RESULT_CSV_FILE = run_path
+        cf.MAX_TAGS = max_tags
+        cf.MIN_SPEED = min_speed
+        for key, value in STRATEGIES[strategy].items():
+            if value is not None:
+                setattr(cf, key.upper(), value)
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(cf, name, value)
+
+
+def select_run(run_path, strategy, max_tags, min_speed):
+    """用真实的选择逻辑处理一次录制的测速结果，返回选中的 IP 列表"""
+    with pipeline_settings(run_path, strategy, max_tags, min_speed):
+        if os.path.isdir(run_path):
+            return cf.get_aggregated_top_ips(False, max_tags, min_speed)
+        return cf.get_top_ips(run_path, max_tags, min_speed)
+
+
+def evaluate(selected, next_run, max_tags, min_speed):
+    """按下一次测速的结果评估本次选择：实际吞吐、相对最优选择的比例、机房故障后的剩余吞吐"""
+    speeds = [next_run[ip]["speed"] if ip in next_run else 0.0 for ip in selected]
+    realized = sum(speeds)
+    oracle = sum(sorted((v["speed"] for v in next_run.values()), reverse=True)[:max_tags])
+
+    # 最大贡献的数据中心整体拥塞时剩余的吞吐
+    per_colo = {}
+    for ip, speed in zip(selected, speeds):
+        colo = next_run.get(ip, {}).get("colo") or "?"
+        per_colo[colo] = per_colo.get(colo, 0.0) + speed
+    colo_loss = realized - max(per_colo.values(), default=0.0)
+
+    return {
+        "realized": realized,
+        "oracle": oracle,
+        "ratio": realized / oracle if oracle else 0.0,
+        "colo_loss_retained": colo_loss / realized if realized else 0.0,
+        "still_fast": sum(1 for s in speeds if s >= min_speed),
+        "measured": sum(1 for ip in selected if ip in next_run),
+    }
+
+
+def replay(runs, config_path, strategy, max_tags, min_speed, work_dir, verbose=False):
+    """按时间顺序回放全部测速记录，每次的输出配置作为下一次的输入，返回每次的结果列表"""
+    current_config = os.path.join(work_dir, f"{strategy}-{max_tags}-{min_speed:g}.json")
+    shutil.copyfile(config_path, current_config)
+    loaded = [load_run(path) for path in runs]
+    results = []
+    previous = []
+    for i, run_path in enumerate(runs):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(sys.stdout if verbose else output):
+            selected = select_run(run_path, strategy, max_tags, min_speed)
+            replaced = cf.update_singbox_config(current_config, selected, current_config) if selected else 0
+        entry = {
+            "run": os.path.basename(run_path.rstrip("/")),
+            "selected": selected,
+            "outbounds_replaced": replaced,
+            "churn": len(set(selected) - set(previous)) if previous else len(selected),
+            "colos": len({loaded[i].get(ip, {}).get("colo") for ip in selected} - {None, ""}),
+        }
+        if selected:
+            previous = selected
+        if i + 1 < len(runs):
+            entry.update(evaluate(selected, loaded[i + 1], max_tags, min_speed))
+        results.append(entry)
+    return results, current_config
+
+
+def summarize(results):
+    scored = [r for r in results if "realized" in r]
+    if not scored:
+        return None
+
+    def mean(key):
+        return sum(r[key] for r in scored) / len(scored)
+    return {
+        "runs": len(scored),
+        "realized": mean("realized"),
+        "ratio": mean("ratio"),
+        "colo_loss_retained": mean("colo_loss_retained"),
+        "colos": sum(r["colos"] for r in scored) / len(scored),
+        "churn": sum(r["churn"] for r in scored[1:]) / max(1, len(scored) - 1),
+        "empty": sum(1 for r in scored if not r["selected"]),
+    }
+
+
+def _parse_list(text, cast):
+    return [cast(v) for v in text.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded cfst results through the Cloudflare IP selection pipeline offline.')
+    parser.add_argument('history', nargs='+', help='Recorded result CSVs, or directories of them (sub-directories are multi-vantage runs), in chronological order')
+    parser.add_argument('-c', '--config', default=cf.CONFIG_JSON_FILE, help=f'Sing-box config used as the starting point (default: {cf.CONFIG_JSON_FILE})')
+    parser.add_argument('-s', '--strategy', default=",".join(STRATEGIES), help=f'Comma-separated strategies: {", ".join(STRATEGIES)}')
+    parser.add_argument('--max-tags', default=str(cf.MAX_TAGS), help='Comma-separated MAX_TAGS values to compare')
+    parser.add_argument('--min-speed', default=str(cf.MIN_SPEED), help='Comma-separated MIN_SPEED values (MB/s) to compare')
+    parser.add_argument('-o', '--output-dir', help='Keep the final replayed config of every variant in this directory')
+    parser.add_argument('--json', action='store_true', help='Print per-run results as JSON')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show the output of the selection pipeline')
+    parser.add_argument('--profile', action='store_true', help='Record cProfile/tracemalloc data and write a report into the output directory')
+    args = parser.parse_args()
+
+    strategies = _parse_list(args.strategy, str)
+    unknown = [s for s in strategies if s not in STRATEGIES]
+    if unknown:
+        parser.error(f"unknown strategy: {', '.join(unknown)}")
+    if args.profile:
+        from profiling import Profiler
+        METRICS.profiler = Profiler("replay_selection")
+        METRICS.profiler.write_report_at_exit(os.path.join(args.output_dir or ".", "replay_selection"))
+
+    runs = list_runs(args.history)
+    if len(runs) < 2:
+        print("Error: Need at least two recorded runs (each run is scored against the next one).")
+        sys.exit(1)
+    if not os.path.exists(args.config):
+        print(f"Error: Sing-box config not found at {args.config}")
+        sys.exit(1)
+    if not args.json:
+        print(f"[*] Replaying {len(runs)} recorded runs from {runs[0]} to {runs[-1]}")
+
+    work_dir = args.output_dir or tempfile.mkdtemp(prefix="replay_selection.")
+    os.makedirs(work_dir, exist_ok=True)
+    report = []
+    try:
+        with METRICS.phase("replay"):
+            for strategy in strategies:
+                for max_tags in _parse_list(args.max_tags, int):
+                    for min_speed in _parse_list(args.min_speed, float):
+                        results, final_config = replay(runs, args.config, strategy, max_tags, min_speed, work_dir, args.verbose)
+                        report.append({"strategy": strategy, "max_tags": max_tags, "min_speed": min_speed,
+                                       "summary": summarize(results), "runs": results,
+                                       "config": final_config if args.output_dir else None})
+    finally:
+        if not args.output_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    METRICS.set("runs_replayed", len(runs))
+    METRICS.set("variants", len(report))
+    METRICS.finish(True)
+    if METRICS.profiler:
+        METRICS.profiler.write_report(os.path.join(args.output_dir or ".", "replay_selection"))
+
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        return
+
+    print(f"\n{'strategy':<10}{'tags':>5}{'min MB/s':>9}{'MB/s':>9}{'oracle%':>9}{'colo-loss%':>11}{'colos':>7}{'churn':>7}{'empty':>6}")
+    for r in report:
+        s = r["summary"]
+        if s is None:
+            continue
+        print(f"{r['strategy']:<10}{r['max_tags']:>5}{r['min_speed']:>9g}{s['realized']:>9.1f}{s['ratio'] * 100:>8.1f}%"
+              f"{s['colo_loss_retained'] * 100:>10.1f}%{s['colos']:>7.1f}{s['churn']:>7.1f}{s['empty']:>6}")
+    print("\nMB/s: next-run throughput of the chosen IPs; oracle%: share of the best possible top-N in the next run;")
+    print("colo-loss%: throughput left if the busiest data centre of the selection became congested.")
+    if args.output_dir:
+        print(f"[+] Final replayed configs written to: {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
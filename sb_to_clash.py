@@ -1,15 +1,20 @@
 import json
-import yaml
 import sys
 import os
 import argparse
 
+from config_apply import atomic_write
+from metrics import Metrics
+
 # Sing-box 代理类型映射
 PROXY_TYPES = {
     "vless", "vmess", "shadowsocks", "trojan", 
     "hysteria2", "tuic", "wireguard", "hysteria"
 }
 
+# 运行指标 (通过 METRICS_EVENT_LOG / METRICS_PROM_FILE 环境变量输出)
+METRICS = Metrics("sb_to_clash")
+
 def convert_singbox_to_clash(outbound):
     otype = outbound.get('type')
     tag = outbound.get('tag')
@@ -91,29 +96,8 @@ def convert_singbox_to_clash(outbound):
 
     return None
 
-def main():
-    parser = argparse.ArgumentParser(description='Convert Sing-box configuration to Clash Verge format.')
-    parser.add_argument('-i', '--input', help='Path to Sing-box client config', default='/etc/sing-box/config.json')
-    parser.add_argument('-o', '--output', help='Path for the converted Clash YAML file', default='clash_config.yaml')
-    args = parser.parse_args()
-
-    sb_path = args.input
-    output_path = args.output
-    
-    # 自动重定向测试路径 (保持原样)
-    if not os.path.exists(sb_path) and os.path.exists("./singbox_client_config.json") and "etc" in sb_path:
-        sb_path = "./singbox_client_config.json"
-    elif not os.path.exists(sb_path) and os.path.exists("./config.json") and "etc" in sb_path:
-        sb_path = "./config.json"
-
-    if not os.path.exists(sb_path):
-        print(f"Error: Sing-box config not found at {sb_path}")
-        sys.exit(1)
-
-    print(f"[*] Reading Sing-box config: {sb_path}")
-    with open(sb_path, 'r') as f:
-        sb_config = json.load(f)
-
+def collect_clash_proxies(sb_config):
+    """转换 Sing-box 配置中的全部代理出站，返回 (Clash 代理列表, 名称列表)"""
     proxies = []
     proxy_names = []
     
@@ -124,12 +108,10 @@ def main():
             if clash_p:
                 proxies.append(clash_p)
                 proxy_names.append(clash_p['name'])
+    return proxies, proxy_names
 
-    if not proxies:
-        print("Warning: No proxy outbounds found in Sing-box config.")
-        sys.exit(1)
-
-    # 自动提取 FakeIP 过滤域名 (扫描指向非 FakeIP 服务的 DNS 规则)
+def extract_fake_ip_filter(sb_config):
+    """自动提取 FakeIP 过滤域名 (扫描指向非 FakeIP 服务的 DNS 规则)"""
     fake_ip_filter = ["*.lan", "*.local", "*.arpa"]
     dns_rules = sb_config.get('dns', {}).get('rules', [])
     for rule in dns_rules:
@@ -157,7 +139,10 @@ def main():
 
     # 去重并保持顺序
     fake_ip_filter = list(dict.fromkeys(fake_ip_filter))
+    return fake_ip_filter
 
+def build_clash_config(proxies, proxy_names, fake_ip_filter):
+    """生成完整的 Clash 配置 (DNS、TUN、策略组与路由规则)"""
     # Clash 基础配置模板
     clash_template = {
         "port": 7890,
@@ -210,9 +195,54 @@ def main():
             "MATCH,🐟 漏网之鱼"
         ]
     }
+    return clash_template
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert Sing-box configuration to Clash Verge format.')
+    parser.add_argument('-i', '--input', help='Path to Sing-box client config', default='/etc/sing-box/config.json')
+    parser.add_argument('-o', '--output', help='Path for the converted Clash YAML file', default='clash_config.yaml')
+    parser.add_argument('--profile', action='store_true', help='Record cProfile/tracemalloc data and write <output>.profile.txt')
+    args = parser.parse_args()
+
+    if args.profile:
+        from profiling import Profiler
+        METRICS.profiler = Profiler("sb_to_clash")
+        METRICS.profiler.write_report_at_exit(args.output)
+
+    sb_path = args.input
+    output_path = args.output
+    
+    # 自动重定向测试路径 (保持原样)
+    if not os.path.exists(sb_path) and os.path.exists("./singbox_client_config.json") and "etc" in sb_path:
+        sb_path = "./singbox_client_config.json"
+    elif not os.path.exists(sb_path) and os.path.exists("./config.json") and "etc" in sb_path:
+        sb_path = "./config.json"
+
+    if not os.path.exists(sb_path):
+        print(f"Error: Sing-box config not found at {sb_path}")
+        sys.exit(1)
+
+    print(f"[*] Reading Sing-box config: {sb_path}")
+    with METRICS.phase("load"):
+        with open(sb_path, 'r') as f:
+            sb_config = json.load(f)
+
+    with METRICS.phase("convert"):
+        proxies, proxy_names = collect_clash_proxies(sb_config)
+    METRICS.set("proxies_converted", len(proxies))
+
+    if not proxies:
+        print("Warning: No proxy outbounds found in Sing-box config.")
+        sys.exit(1)
+
+    clash_template = build_clash_config(proxies, proxy_names, extract_fake_ip_filter(sb_config))
 
-    with open(output_path, 'w') as f:
-        yaml.dump(clash_template, f, allow_unicode=True, sort_keys=False)
+    with METRICS.phase("dump"):
+        import yaml
+        atomic_write(output_path, yaml.dump(clash_template, allow_unicode=True, sort_keys=False))
+    METRICS.finish(True)
+    if METRICS.profiler:
+        METRICS.profiler.write_report(output_path)
 
     print(f"[+] Successfully converted {len(proxies)} proxies.")
     print(f"[+] Clash config saved to: {output_path}")
@@ -1,12 +1,15 @@
 import json
-import yaml
 import sys
 import os
+import re
+import base64
+import html
 import argparse
-import socket
-import threading
-import subprocess
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from urllib.parse import quote, urlencode
+
+import qr_code
+from config_apply import atomic_write
+from metrics import Metrics
 
 # Sing-box 代理类型映射
 PROXY_TYPES = {
@@ -14,8 +17,15 @@ PROXY_TYPES = {
     "hysteria2", "tuic", "wireguard", "hysteria"
 }
 
+# 批量导出二维码支持的格式
+QR_FORMATS = ("png", "svg", "terminal")
+
+# 运行指标 (通过 METRICS_EVENT_LOG / METRICS_PROM_FILE 环境变量输出)
+METRICS = Metrics("sb_to_clash_qr")
+
 def get_local_ip():
     """获取本机局域网 IP"""
+    import socket
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         # 尝试连接公网 DNS 以获取出站接口 IP
@@ -136,59 +146,8 @@ def convert_singbox_to_clash(outbound):
 
     return None
 
-def start_share_server(file_path, port=8080):
-    """启动一个简单的 HTTP 服务器共享文件"""
-    class SingleFileHandler(SimpleHTTPRequestHandler):
-        def do_GET(self):
-            if self.path == '/' + os.path.basename(file_path):
-                return super().do_GET()
-            else:
-                self.send_response(404)
-                self.end_headers()
-
-    server = HTTPServer(('0.0.0.0', port), SingleFileHandler)
-    thread = threading.Thread(target=server.serve_forever)
-    thread.daemon = True
-    thread.start()
-    return server
-
-def show_qr(url):
-    """使用 npx qrcode-terminal 展示二维码"""
-    print(f"[*] Generating QR code for: {url}")
-    try:
-        subprocess.run(["npx", "-y", "qrcode-terminal", url], check=True)
-    except Exception as e:
-        print(f"[!] Failed to show QR code via npx: {e}")
-        print(f"[!] Please manually access the URL: {url}")
-
-def main():
-    parser = argparse.ArgumentParser(description='Convert Sing-box configuration to Clash Verge format and share.')
-    parser.get_default('-v')
-    parser.add_argument('-i', '--input', help='Path to Sing-box client config', default='/etc/sing-box/config.json')
-    parser.add_argument('-o', '--output', help='Path for the converted Clash YAML file', default='clash_config.yaml')
-    parser.add_argument('--share', action='store_true', help='Share the config via HTTP and show QR code')
-    parser.add_argument('--port', type=int, default=10086, help='Port for the share server (default: 10086)')
-    args = parser.parse_args()
-
-    sb_path = args.input
-    output_path = args.output
-    
-    # 自动重定向测试路径
-    if not os.path.exists(sb_path):
-        search_paths = ["./singbox_client_config.json", "./config.json", "/etc/sing-box/config.json"]
-        for p in search_paths:
-            if os.path.exists(p):
-                sb_path = p
-                break
-
-    if not os.path.exists(sb_path):
-        print(f"Error: Sing-box config not found.")
-        sys.exit(1)
-
-    print(f"[*] Reading Sing-box config: {sb_path}")
-    with open(sb_path, 'r') as f:
-        sb_config = json.load(f)
-
+def collect_clash_proxies(sb_config):
+    """转换 Sing-box 配置中的全部代理出站，返回 (Clash 代理列表, 名称列表)"""
     proxies = []
     proxy_names = []
     
@@ -199,11 +158,10 @@ def main():
             if clash_p:
                 proxies.append(clash_p)
                 proxy_names.append(clash_p['name'])
+    return proxies, proxy_names
 
-    if not proxies:
-        print("Warning: No supported proxy outbounds found.")
-        sys.exit(1)
-
+def build_clash_config(proxies, proxy_names):
+    """生成 Mihomo/Meta 风格的 Clash 配置 (适用于手机等移动设备)"""
     # Clash 基础配置模板 (Mihomo/Meta Style)
     clash_template = {
         "port": 7890,
@@ -241,21 +199,299 @@ def main():
             "MATCH,🚀 节点选择"
         ]
     }
+    return clash_template
 
-    with open(output_path, 'w') as f:
-        yaml.dump(clash_template, f, allow_unicode=True, sort_keys=False)
+def _host_port(outbound):
+    server = outbound.get('server', '')
+    if ':' in server:
+        server = f"[{server}]"  # IPv6 地址需加方括号
+    return f"{server}:{outbound.get('server_port')}"
+
+
+def _query(params):
+    return urlencode({k: v for k, v in params.items() if v not in (None, "", False)}, quote_via=quote)
+
+
+def build_share_uri(outbound):
+    """生成单个 Sing-box 出站的分享链接 (vless:// hysteria2:// tuic:// ss:// trojan:// vmess://)，不支持的类型返回 None"""
+    otype = outbound.get('type')
+    tag = quote(outbound.get('tag') or "", safe="")
+    tls = outbound.get('tls', {})
+    transport = outbound.get('transport', {})
+    address = _host_port(outbound)
+
+    if otype == 'vless':
+        reality = tls.get('reality', {})
+        params = {
+            "encryption": "none",
+            "flow": outbound.get('flow'),
+            "security": "reality" if reality.get('enabled') else ("tls" if tls.get('enabled') else "none"),
+            "sni": tls.get('server_name'),
+            "fp": tls.get('utls', {}).get('fingerprint'),
+            "pbk": reality.get('public_key'),
+            "sid": reality.get('short_id'),
+            "type": transport.get('type', 'tcp'),
+            "serviceName": transport.get('service_name') if transport.get('type') == 'grpc' else None,
+            "path": transport.get('path') if transport.get('type') == 'ws' else None,
+            "packetEncoding": outbound.get('packet_encoding'),
+        }
+        return f"vless://{outbound.get('uuid')}@{address}?{_query(params)}#{tag}"
+
+    if otype == 'hysteria2':
+        obfs = outbound.get('obfs', {})
+        params = {
+            "sni": tls.get('server_name'),
+            "insecure": "1" if tls.get('insecure') else None,
+            "obfs": obfs.get('type'),
+            "obfs-password": obfs.get('password'),
+        }
+        return f"hysteria2://{quote(outbound.get('password', ''), safe='')}@{address}/?{_query(params)}#{tag}"
+
+    if otype == 'tuic':
+        params = {
+            "sni": tls.get('server_name'),
+            "alpn": ",".join(tls.get('alpn', ["h3"])),
+            "congestion_control": outbound.get('congestion_control', 'cubic'),
+            "udp_relay_mode": "native",
+            "allow_insecure": "1" if tls.get('insecure') else None,
+        }
+        userinfo = f"{outbound.get('uuid')}:{quote(outbound.get('password', ''), safe='')}"
+        return f"tuic://{userinfo}@{address}?{_query(params)}#{tag}"
+
+    if otype == 'shadowsocks':
+        # SIP002: userinfo 为 base64url(method:password)
+        userinfo = base64.urlsafe_b64encode(f"{outbound.get('method')}:{outbound.get('password')}".encode()).decode().rstrip('=')
+        return f"ss://{userinfo}@{address}#{tag}"
+
+    if otype == 'trojan':
+        params = {
+            "sni": tls.get('server_name'),
+            "allowInsecure": "1" if tls.get('insecure') else None,
+            "type": transport.get('type'),
+            "path": transport.get('path') if transport.get('type') == 'ws' else None,
+        }
+        return f"trojan://{quote(outbound.get('password', ''), safe='')}@{address}?{_query(params)}#{tag}"
+
+    if otype == 'vmess':
+        # v2rayN 格式：base64(JSON)
+        info = {
+            "v": "2", "ps": outbound.get('tag'), "add": outbound.get('server'),
+            "port": str(outbound.get('server_port')), "id": outbound.get('uuid'),
+            "aid": str(outbound.get('alter_id', 0)), "scy": outbound.get('security', 'auto'),
+            "net": transport.get('type', 'tcp'), "path": transport.get('path', ''),
+            "tls": "tls" if tls.get('enabled') else "", "sni": tls.get('server_name', ''),
+        }
+        return "vmess://" + base64.b64encode(json.dumps(info, ensure_ascii=False).encode()).decode()
+
+    return None
+
+
+def _qr_file_stem(index, tag):
+    return f"{index:03d}-{re.sub(r'[^A-Za-z0-9_.-]+', '_', tag or 'node').strip('_') or 'node'}"
+
+
+def render_node_qr(item, output_dir, formats):
+    """在子进程中为单个节点生成二维码文件，返回索引条目 (terminal 格式返回渲染好的文本)"""
+    stem, tag, uri = item
+    entry = {"tag": tag, "uri": uri, "files": {}}
+    try:
+        qr = qr_code.encode(uri)
+    except ValueError as e:
+        entry["error"] = str(e)
+        return entry
+    if "png" in formats:
+        atomic_write(os.path.join(output_dir, f"{stem}.png"), qr.to_png())
+        entry["files"]["png"] = f"{stem}.png"
+    if "svg" in formats:
+        atomic_write(os.path.join(output_dir, f"{stem}.svg"), qr.to_svg())
+        entry["files"]["svg"] = f"{stem}.svg"
+    if "terminal" in formats:
+        entry["terminal"] = qr.to_terminal()
+    return entry
+
+
+def write_share_index(output_dir, entries, config_name=None):
+    """生成批量分享页面 index.html：每个节点一张二维码 + 分享链接"""
+    rows = []
+    for e in entries:
+        image = e["files"].get("svg") or e["files"].get("png")
+        img_html = f'<img src="{html.escape(image)}" width="240" alt="">' if image else html.escape(e.get("error", ""))
+        rows.append(f'<div class="node"><h3>{html.escape(e["tag"] or "")}</h3>{img_html}'
+                    f'<textarea readonly rows="3">{html.escape(e["uri"])}</textarea></div>')
+    config_link = f'<p><a href="/{html.escape(config_name)}">{html.escape(config_name)}</a> (Clash)</p>' if config_name else ""
+    page = ("<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+            "<meta name=\"viewport\" content=\"width=device-width, initial-scale=1\"><title>Nodes</title>"
+            "<style>body{font-family:sans-serif;margin:1em}.node{display:inline-block;width:260px;margin:8px;vertical-align:top}"
+            "textarea{width:100%;font-size:11px}</style></head><body>"
+            f"<h2>{len(entries)} nodes</h2>{config_link}{''.join(rows)}</body></html>\n")
+    atomic_write(os.path.join(output_dir, "index.html"), page)
+
+
+def export_qr_batch(sb_config, output_dir, formats=("png", "svg"), jobs=None, config_name=None):
+    """为配置中的全部代理出站并行生成分享链接二维码，返回索引条目列表"""
+    items = []
+    for o in sb_config.get('outbounds', []):
+        if o.get('type') in PROXY_TYPES:
+            uri = build_share_uri(o)
+            if uri:
+                items.append((_qr_file_stem(len(items), o.get('tag')), o.get('tag'), uri))
+    if not items:
+        return []
+
+    from concurrent.futures import ProcessPoolExecutor
+    from functools import partial
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(items)))
+    worker = partial(render_node_qr, output_dir=output_dir, formats=formats)
+    if jobs == 1:
+        entries = [worker(item) for item in items]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            entries = list(pool.map(worker, items))
+
+    atomic_write(os.path.join(output_dir, "links.txt"), "\n".join(e["uri"] for e in entries) + "\n")
+    write_share_index(output_dir, entries, config_name)
+    return entries
+
+
+def start_share_server(file_path, port=8080, share_dir=None, share_files=()):
+    """启动多线程 HTTP 服务器共享配置文件；指定 share_dir 时同时提供批量二维码页面 (/ 为 index.html)
+
+    只提供白名单内的文件：/<配置文件名>，以及 share_dir 中的 index.html、links.txt 与 share_files 列出的二维码文件，
+    其它路径一律返回 404 (share_dir 可能是任意已有目录，服务监听在 0.0.0.0)。
+    """
+    # 仅在 --share 时加载 HTTP 服务相关模块
+    import threading
+    from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+    from urllib.parse import unquote
+    config_name = os.path.basename(file_path)
+    allowed = {}
+    if share_dir:
+        for name in ("index.html", "links.txt", *share_files):
+            allowed['/' + name] = os.path.join(os.path.abspath(share_dir), name)
+        allowed['/'] = allowed['/index.html']
+    allowed['/' + config_name] = os.path.abspath(file_path)
+
+    class ShareHandler(SimpleHTTPRequestHandler):
+        def translate_path(self, path):
+            return allowed.get(unquote(path.split('?', 1)[0].split('#', 1)[0]), "")
+
+        def send_head(self):
+            if not self.translate_path(self.path):
+                self.send_error(404)
+                return None
+            return super().send_head()
+
+        def list_directory(self, path):
+            self.send_error(404)
+            return None
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), ShareHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def show_qr(url):
+    """在终端中展示二维码 (纯 Python 编码，无需 npx)"""
+    print(f"[*] Generating QR code for: {url}")
+    try:
+        print(qr_code.encode(url).to_terminal())
+    except ValueError as e:
+        print(f"[!] Failed to generate QR code: {e}")
+        print(f"[!] Please manually access the URL: {url}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert Sing-box configuration to Clash Verge format and share.')
+    parser.get_default('-v')
+    parser.add_argument('-i', '--input', help='Path to Sing-box client config', default='/etc/sing-box/config.json')
+    parser.add_argument('-o', '--output', help='Path for the converted Clash YAML file', default='clash_config.yaml')
+    parser.add_argument('--share', action='store_true', help='Share the config via HTTP and show QR code')
+    parser.add_argument('--port', type=int, default=10086, help='Port for the share server (default: 10086)')
+    parser.add_argument('--qr-dir', metavar='DIR', help='Export a share link QR code for every node into DIR (with index.html; served by --share)')
+    parser.add_argument('--qr-format', default='png,svg',
+                        help=f'Comma-separated QR formats for --qr-dir: {",".join(QR_FORMATS)} (default: png,svg)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='Worker processes for QR export (default: CPU count)')
+    parser.add_argument('--profile', action='store_true', help='Record cProfile/tracemalloc data and write <output>.profile.txt')
+    args = parser.parse_args()
+
+    qr_formats = [f.strip() for f in args.qr_format.split(',') if f.strip()]
+    unknown = [f for f in qr_formats if f not in QR_FORMATS]
+    if unknown:
+        parser.error(f"unknown QR format(s): {', '.join(unknown)}")
+
+    if args.profile:
+        from profiling import Profiler
+        METRICS.profiler = Profiler("sb_to_clash_qr")
+        METRICS.profiler.write_report_at_exit(args.output)
+
+    sb_path = args.input
+    output_path = args.output
+    
+    # 自动重定向测试路径
+    if not os.path.exists(sb_path):
+        search_paths = ["./singbox_client_config.json", "./config.json", "/etc/sing-box/config.json"]
+        for p in search_paths:
+            if os.path.exists(p):
+                sb_path = p
+                break
+
+    if not os.path.exists(sb_path):
+        print(f"Error: Sing-box config not found.")
+        sys.exit(1)
+
+    print(f"[*] Reading Sing-box config: {sb_path}")
+    with METRICS.phase("load"):
+        with open(sb_path, 'r') as f:
+            sb_config = json.load(f)
+
+    with METRICS.phase("convert"):
+        proxies, proxy_names = collect_clash_proxies(sb_config)
+    METRICS.set("proxies_converted", len(proxies))
+
+    if not proxies:
+        print("Warning: No supported proxy outbounds found.")
+        sys.exit(1)
+
+    clash_template = build_clash_config(proxies, proxy_names)
+
+    with METRICS.phase("dump"):
+        import yaml
+        atomic_write(output_path, yaml.dump(clash_template, allow_unicode=True, sort_keys=False))
+
+    qr_entries = []
+    if args.qr_dir:
+        with METRICS.phase("qr_export"):
+            qr_entries = export_qr_batch(sb_config, args.qr_dir, qr_formats, args.jobs,
+                                         config_name=os.path.basename(output_path) if args.share else None)
+        METRICS.set("qr_exported", len(qr_entries))
+    METRICS.finish(True)
+    if METRICS.profiler:
+        METRICS.profiler.write_report(output_path)
 
     print(f"[+] Successfully converted {len(proxies)} proxies.")
     print(f"[+] Clash config saved to: {output_path}")
 
+    if args.qr_dir:
+        for e in qr_entries:
+            if e.get("error"):
+                print(f"[!] {e['tag']}: {e['error']}")
+            elif e.get("terminal"):
+                print(f"\n[*] {e['tag']}: {e['uri']}")
+                print(e["terminal"])
+        print(f"[+] Exported {len(qr_entries)} node QR codes to: {args.qr_dir}")
+
     if args.share:
         local_ip = get_local_ip()
         share_url = f"http://{local_ip}:{args.port}/{os.path.basename(output_path)}"
         
         print(f"\n[!] Starting share server at {share_url}")
-        server = start_share_server(output_path, args.port)
+        qr_files = [name for e in qr_entries for name in e["files"].values()]
+        server = start_share_server(output_path, args.port, args.qr_dir, qr_files)
         
         show_qr(share_url)
+        if args.qr_dir:
+            print(f"[*] Node QR codes: http://{local_ip}:{args.port}/")
         
         print("\n" + "="*50)
         print(f"Share URL: {share_url}")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import os
+import sys
+from importlib import import_module
+
+# 统一命令入口: python3 -m sbtools <命令> [参数...]
+# 各工具模块只在被调用时才导入，startup 命令检查每个入口的导入耗时是否超出预算。
+
+# 命令 -> (模块, 入口函数, 说明)
+COMMANDS = {
+    "merge": ("merge_configs", "main", "Merge Clash proxies into a Sing-box config"),
+    "clash": ("sb_to_clash", "main", "Convert a Sing-box config to Clash (desktop)"),
+    "share": ("sb_to_clash_qr", "main", "Convert to Clash (mobile), share via HTTP and QR codes"),
+    "profiles": ("generate_profiles", "main", "Render many client profiles from one manifest"),
+    "validate": ("singbox_validate", "main", "Validate a Sing-box config without the sing-box binary"),
+    "cfip": ("update_cloudflare_ips", "cli", "Select Cloudflare IPs with cfst and update the config"),
+    "replay": ("replay_selection", "main", "Replay recorded cfst results through the IP selection"),
+    "apply": ("config_apply", "main", "Apply a config with health check and automatic rollback"),
+    "fleet": ("fleet_provision", "main", "Provision many servers in parallel and merge their nodes"),
+    "bench": ("load_bench", "main", "Benchmark concurrent throughput across the selected Cloudflare IPs"),
+}
+
+# 入口模块导入耗时预算 (毫秒)，可通过 SBTOOLS_STARTUP_BUDGET_MS 调整
+STARTUP_BUDGET_MS = float(os.getenv("SBTOOLS_STARTUP_BUDGET_MS", "80"))
+
+# 只应在实际用到时才加载的模块
+LAZY_MODULES = ("yaml", "cProfile", "tracemalloc", "http.server", "urllib.request", "concurrent.futures")
+
+
+def measure_import(module):
+    """在新的解释器中以 -X importtime 导入模块，返回 (累计耗时 ms, 导入的模块名集合)"""
+    import subprocess
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"import {module} failed")
+    total = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        if not cumulative.strip().isdigit():
+            continue  # 表头
+        imported.add(name.strip())
+        if name.strip() == module and not name[1:].startswith(" "):
+            total = int(cumulative) / 1000
+    return total, imported
+
+
+def check_lazy_imports():
+    """只检查各入口是否提前加载了 LAZY_MODULES，返回问题列表
+
+    结果只取决于 -X importtime 列出的模块，不受机器快慢影响，每个入口导入一次即可，适合在 CI 中作为硬性检查。
+    """
+    problems = []
+    for command, (module, _, _) in COMMANDS.items():
+        _, imported = measure_import(module)
+        eager = sorted(m for m in LAZY_MODULES if m in imported)
+        print(f"[{'FAIL' if eager else 'ok':^4}] {command:<9} {module}" + (f"  eager: {', '.join(eager)}" if eager else ""))
+        if eager:
+            problems.append(f"{module}: imports {', '.join(eager)} at startup")
+    return problems
+
+
+def check_startup(budget_ms=STARTUP_BUDGET_MS, runs=5, report_only=False):
+    """检查每个入口的导入耗时 (取多次中的最小值) 与不应提前加载的模块，返回问题列表
+
+    report_only 时超出耗时预算只输出提示、不计入问题 (共享 CI 机器上的计时波动较大)，
+    提前加载按需模块与计时无关，仍然计入问题。
+    """
+    problems = []
+    for command, (module, _, _) in COMMANDS.items():
+        timings = []
+        imported = set()
+        for _ in range(runs):
+            total, imported = measure_import(module)
+            timings.append(total)
+        best = min(timings)
+        eager = sorted(m for m in LAZY_MODULES if m in imported)
+        slow = best > budget_ms
+        status = "FAIL" if eager or (slow and not report_only) else ("slow" if slow else "ok")
+        print(f"[{status:^4}] {command:<9} {module:<24} {best:7.1f} ms" + (f"  eager: {', '.join(eager)}" if eager else ""))
+        if slow and not report_only:
+            problems.append(f"{module}: import takes {best:.1f} ms (budget {budget_ms:g} ms)")
+        if eager:
+            problems.append(f"{module}: imports {', '.join(eager)} at startup")
+    return problems
+
+
+def usage():
+    lines = ["usage: python3 -m sbtools <command> [args...]", "", "commands:"]
+    for command, (_, _, description) in COMMANDS.items():
+        lines.append(f"  {command:<10}{description}")
+    lines.append(f"  {'startup':<10}Check start-up import time of every command (budget {STARTUP_BUDGET_MS:g} ms)")
+    lines.append(f"  {'':<10}usage: startup [--report-only | --lazy-only] [BUDGET_MS]")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return 0
+    command, args = argv[0], argv[1:]
+
+    if command == "startup":
+        report_only = "--report-only" in args
+        lazy_only = "--lazy-only" in args
+        rest = [a for a in args if a not in ("--report-only", "--lazy-only")]
+        try:
+            budget = float(rest[0]) if rest else STARTUP_BUDGET_MS
+        except ValueError:
+            budget = None
+        if budget is None or len(rest) > 1 or (lazy_only and (report_only or rest)):
+            print(f"Error: invalid startup arguments {args!r}\n\n{usage()}")
+            return 2
+        problems = check_lazy_imports() if lazy_only else check_startup(budget, report_only=report_only)
+        for p in problems:
+            print(f"[!] {p}")
+        return 1 if problems else 0
+
+    if command not in COMMANDS:
+        print(f"Error: unknown command {command!r}\n\n{usage()}")
+        return 2
+    module, func, _ = COMMANDS[command]
+    # 让被调用的工具看到与直接运行脚本时一致的 argv
+    sys.argv = [f"{module}.py"] + args
+    return getattr(import_module(module), func)()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
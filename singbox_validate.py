@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+import json
+import os
+import sys
+import argparse
+
+# 支持的代理类型 (merge_configs.py / fleet_provision.py 共用此定义)
+PROXY_TYPES = {
+    "vless", "vmess", "shadowsocks", "trojan",
+    "hysteria2", "tuic", "wireguard", "hysteria",
+    "shadowsocksr"
+}
+
+# 策略组类型，需要检查成员引用
+GROUP_TYPES = {"selector", "urltest"}
+
+# 其它合法的出站类型
+OTHER_OUTBOUND_TYPES = {
+    "direct", "block", "dns", "socks", "http",
+    "shadowtls", "tor", "ssh", "anytls"
+}
+
+KNOWN_OUTBOUND_TYPES = PROXY_TYPES | GROUP_TYPES | OTHER_OUTBOUND_TYPES
+
+
+def build_tag_index(outbounds):
+    """构建 tag -> outbound 索引，同时返回重复的 tag 列表"""
+    index = {}
+    duplicates = []
+    for ob in outbounds:
+        if not isinstance(ob, dict):
+            continue
+        tag = ob.get('tag')
+        if not isinstance(tag, str) or not tag:
+            continue
+        if tag in index:
+            duplicates.append(tag)
+        else:
+            index[tag] = ob
+    return index, duplicates
+
+
+def _is_valid_port(port):
+    # bool 是 int 的子类，需要排除
+    return isinstance(port, int) and not isinstance(port, bool) and 1 <= port <= 65535
+
+
+def _check_outbound(ob, pos, tag_index, errors):
+    otype = ob.get('type')
+    tag = ob.get('tag')
+    where = f"outbounds[{pos}]" if not tag else f"outbound '{tag}'"
+
+    if not isinstance(tag, str) or not tag:
+        errors.append(f"{where}: missing tag")
+    if otype not in KNOWN_OUTBOUND_TYPES:
+        errors.append(f"{where}: unknown type {otype!r}")
+        return
+
+    if otype in PROXY_TYPES:
+        if not ob.get('server'):
+            errors.append(f"{where}: missing server")
+        # wireguard 可以使用 peers 而不是 server_port
+        if otype != 'wireguard' or 'server_port' in ob:
+            if not _is_valid_port(ob.get('server_port')):
+                errors.append(f"{where}: invalid server_port {ob.get('server_port')!r}")
+
+    elif otype in GROUP_TYPES:
+        members = ob.get('outbounds')
+        if not isinstance(members, list) or not members:
+            errors.append(f"{where}: {otype} group has no outbounds")
+            members = []
+        seen = set()
+        for m in members:
+            if m == tag:
+                errors.append(f"{where}: group references itself")
+            elif m not in tag_index:
+                errors.append(f"{where}: group member '{m}' does not exist")
+            if m in seen:
+                errors.append(f"{where}: duplicate group member '{m}'")
+            seen.add(m)
+        default = ob.get('default')
+        if otype == 'selector' and default is not None and default not in seen:
+            errors.append(f"{where}: default '{default}' is not a group member")
+
+    detour = ob.get('detour')
+    if detour is not None:
+        if detour == tag:
+            errors.append(f"{where}: detour references itself")
+        elif detour not in tag_index:
+            errors.append(f"{where}: dangling detour '{detour}'")
+
+
+def validate_config(config, tag_index=None):
+    """校验 sing-box 配置的结构与引用关系，返回错误信息列表 (为空表示通过)
+
+    tag_index 可以传入调用方已构建好的 build_tag_index() 结果，避免重复扫描。
+    """
+    errors = []
+    if not isinstance(config, dict):
+        return ["config: top level must be an object"]
+
+    outbounds = config.get('outbounds', [])
+    if not isinstance(outbounds, list):
+        return ["config: outbounds must be a list"]
+
+    if tag_index is None:
+        tag_index, duplicates = build_tag_index(outbounds)
+    else:
+        duplicates = []
+        seen = set()
+        for ob in outbounds:
+            tag = ob.get('tag') if isinstance(ob, dict) else None
+            if tag in seen:
+                duplicates.append(tag)
+            seen.add(tag)
+    for tag in duplicates:
+        errors.append(f"outbound '{tag}': duplicate tag")
+
+    for pos, ob in enumerate(outbounds):
+        if not isinstance(ob, dict):
+            errors.append(f"outbounds[{pos}]: must be an object")
+            continue
+        _check_outbound(ob, pos, tag_index, errors)
+
+    # 入站端口范围与 tag 唯一性
+    inbound_tags = set()
+    for pos, ib in enumerate(config.get('inbounds', []) or []):
+        if not isinstance(ib, dict):
+            errors.append(f"inbounds[{pos}]: must be an object")
+            continue
+        tag = ib.get('tag')
+        if tag:
+            if tag in inbound_tags:
+                errors.append(f"inbound '{tag}': duplicate tag")
+            inbound_tags.add(tag)
+        if 'listen_port' in ib and not _is_valid_port(ib.get('listen_port')):
+            errors.append(f"inbound '{tag or pos}': invalid listen_port {ib.get('listen_port')!r}")
+
+    # DNS 服务器 detour 与 DNS 规则引用
+    dns_config = config.get('dns', {}) or {}
+    dns_tags = set()
+    for server in dns_config.get('servers', []) or []:
+        if server.get('tag'):
+            dns_tags.add(server['tag'])
+        detour = server.get('detour')
+        if detour is not None and detour not in tag_index:
+            errors.append(f"dns server '{server.get('tag')}': dangling detour '{detour}'")
+    for pos, rule in enumerate(dns_config.get('rules', []) or []):
+        server = rule.get('server')
+        if server is not None and dns_tags and server not in dns_tags:
+            errors.append(f"dns.rules[{pos}]: unknown dns server '{server}'")
+    dns_final = dns_config.get('final')
+    if dns_final is not None and dns_tags and dns_final not in dns_tags:
+        errors.append(f"dns.final: unknown dns server '{dns_final}'")
+
+    # 路由规则引用
+    route_config = config.get('route', {}) or {}
+    for pos, rule in enumerate(route_config.get('rules', []) or []):
+        outbound = rule.get('outbound')
+        if outbound is not None and outbound not in tag_index:
+            errors.append(f"route.rules[{pos}]: unknown outbound '{outbound}'")
+        inbound = rule.get('inbound')
+        if inbound and inbound_tags:
+            for ib in ([inbound] if isinstance(inbound, str) else inbound):
+                if ib not in inbound_tags:
+                    errors.append(f"route.rules[{pos}]: unknown inbound '{ib}'")
+    final = route_config.get('final')
+    if final is not None and final not in tag_index:
+        errors.append(f"route.final: unknown outbound '{final}'")
+
+    return errors
+
+
+def print_errors(errors, limit=20):
+    """打印校验错误 (最多 limit 条)"""
+    for e in errors[:limit]:
+        print(f"  - {e}")
+    if len(errors) > limit:
+        print(f"  ... and {len(errors) - limit} more")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Validate Sing-box configuration without spawning sing-box check.')
+    parser.add_argument('configs', nargs='+', help='Path(s) to Sing-box config')
+    args = parser.parse_args()
+
+    failed = False
+    for path in args.configs:
+        if not os.path.exists(path):
+            print(f"Error: Sing-box config not found at {path}")
+            failed = True
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except ValueError as e:
+            print(f"[!] {path}: invalid JSON: {e}")
+            failed = True
+            continue
+
+        errors = validate_config(config)
+        if errors:
+            print(f"[!] {path}: {len(errors)} problem(s) found:")
+            print_errors(errors)
+            failed = True
+        else:
+            print(f"[+] {path}: OK")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import bisect
+import csv
+import ipaddress
+import os
+import re
+
+# 生成的子分组都放在顶层组的命名空间下，重新合并时只清理这些分组，不影响用户自建的 Auto-* 分组
+TOP_GROUP_TAG = "Auto-Select-All"
+GROUP_PREFIX = f"{TOP_GROUP_TAG}-"
+# 旧版本生成的分组名 (Auto-<地区>-T<n> / Auto-Tier<n>)，升级后重新合并时一并清理
+LEGACY_GROUP_RE = re.compile(r"^Auto-(?:Tier\d+|[A-Z]{2}-T\d+|Other-T\d+)$")
+TEST_URL = "http://www.gstatic.com/generate_204"
+
+# 延迟分层阈值 (ms)：<150 为 T1，<300 为 T2，其余及未测得延迟的为 T3
+LATENCY_TIERS = [150, 300]
+
+# 节点名称中的地区关键字 (按顺序匹配，先匹配到的优先)
+REGION_KEYWORDS = [
+    ("HK", ["香港", "hong kong", "hongkong", "hk"]),
+    ("TW", ["台湾", "台灣", "taiwan", "tw"]),
+    ("JP", ["日本", "东京", "大阪", "japan", "tokyo", "osaka", "jp"]),
+    ("SG", ["新加坡", "狮城", "singapore", "sg"]),
+    ("KR", ["韩国", "首尔", "korea", "seoul", "kr"]),
+    ("US", ["美国", "洛杉矶", "圣何塞", "united states", "los angeles", "san jose", "usa", "us"]),
+    ("GB", ["英国", "伦敦", "united kingdom", "london", "uk", "gb"]),
+    ("DE", ["德国", "法兰克福", "germany", "frankfurt", "de"]),
+    ("FR", ["法国", "巴黎", "france", "paris", "fr"]),
+    ("NL", ["荷兰", "阿姆斯特丹", "netherlands", "amsterdam", "nl"]),
+    ("CA", ["加拿大", "canada", "ca"]),
+    ("AU", ["澳大利亚", "澳洲", "australia", "au"]),
+    ("IN", ["印度", "india", "in"]),
+    ("RU", ["俄罗斯", "russia", "ru"]),
+]
+UNKNOWN_REGION = "Other"
+
+# 国旗 emoji 由两个 Regional Indicator 字符组成，可直接还原为 ISO 国家代码
+FLAG_RE = re.compile("([\U0001F1E6-\U0001F1FF])([\U0001F1E6-\U0001F1FF])")
+
+
+def _keyword_regex(keyword):
+    # 纯 ASCII 的短关键字需要按单词边界匹配，避免 "us" 命中 "russia"
+    if keyword.isascii():
+        return re.compile(r"(?<![a-z])" + re.escape(keyword) + r"(?![a-z])")
+    return re.compile(re.escape(keyword))
+
+
+REGION_PATTERNS = [(region, [_keyword_regex(k) for k in keywords]) for region, keywords in REGION_KEYWORDS]
+
+
+def load_geoip_csv(path):
+    """加载 "CIDR,国家代码" 格式的 IPv4 GeoIP 表，返回用于 bisect 查找的有序区间"""
+    ranges = []
+    if not path or not os.path.exists(path):
+        return ranges
+    with open(path, 'r', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].startswith('#'):
+                continue
+            try:
+                net = ipaddress.IPv4Network(row[0].strip(), strict=False)
+            except ValueError:
+                continue
+            ranges.append((int(net.network_address), int(net.broadcast_address), row[1].strip().upper()))
+    ranges.sort()
+    return ranges
+
+
+def lookup_geoip(ranges, server):
+    if not ranges or not server:
+        return None
+    try:
+        ip = int(ipaddress.IPv4Address(server))
+    except ValueError:
+        return None
+    i = bisect.bisect_right(ranges, (ip, float('inf'), "")) - 1
+    if i >= 0 and ranges[i][0] <= ip <= ranges[i][1]:
+        return ranges[i][2]
+    return None
+
+
+def detect_region(outbound, geoip=None):
+    """根据节点名称 (国旗 emoji / 关键字) 或服务器 GeoIP 推断地区代码"""
+    tag = outbound.get('tag') or ""
+    flag = FLAG_RE.search(tag)
+    if flag:
+        return "".join(chr(ord(c) - 0x1F1E6 + ord('A')) for c in flag.groups())
+
+    lowered = tag.lower()
+    for region, patterns in REGION_PATTERNS:
+        if any(p.search(lowered) for p in patterns):
+            return region
+
+    return lookup_geoip(geoip, outbound.get('server')) or UNKNOWN_REGION
+
+
+def latency_tier(latency):
+    """按延迟返回分层编号 (1 起)，未测得延迟的节点归入最后一层"""
+    if latency is None:
+        return len(LATENCY_TIERS) + 1
+    for i, threshold in enumerate(LATENCY_TIERS):
+        if latency < threshold:
+            return i + 1
+    return len(LATENCY_TIERS) + 1
+
+
+def scaled_interval(members):
+    """成员越多，测速间隔越长：每 10 个成员增加 1 分钟，范围 1m ~ 10m"""
+    return f"{min(10, 1 + members // 10)}m"
+
+
+def urltest(tag, members, tolerance=50):
+    return {
+        "type": "urltest",
+        "tag": tag,
+        "outbounds": members,
+        "url": TEST_URL,
+        "interval": scaled_interval(len(members)),
+        "tolerance": tolerance
+    }
+
+
+def is_generated_group(outbound):
+    """判断是否为本模块生成的分组 (重新合并时需要先移除)"""
+    tag = outbound.get('tag') or ""
+    return outbound.get('type') == 'urltest' and (tag.startswith(GROUP_PREFIX) or bool(LEGACY_GROUP_RE.match(tag)))
+
+
+def build_tiered_groups(outbounds, latencies=None, geoip=None, fallback="direct"):
+    """按地区与延迟对代理节点分层，返回需要追加的策略组列表
+
+    - 叶子组 Auto-Select-All-<地区>-T<n>：每个节点只属于一个叶子组，组内按延迟排序
+    - 分层组 Auto-Select-All-Tier<n>：同一延迟层的所有叶子组
+    - 顶层组 Auto-Select-All：对各分层组与 fallback 测速，选延迟最低的一个
+    latencies 为 tag -> 延迟 (ms)；完全没有延迟数据时所有节点视为同一层。
+
+    sing-box 没有按顺序回落的 fallback 出站，顶层组只能是 urltest。低层级的组延迟本身更低，
+    正常时会被选中；某一层全部不可用时该组测速失败，顶层组自然切换到下一层。
+    """
+    latencies = latencies or {}
+    has_latency = any(v is not None for v in latencies.values())
+
+    buckets = {}  # (tier, region) -> [(latency, tag)]
+    for ob in outbounds:
+        tag = ob.get('tag')
+        latency = latencies.get(tag)
+        tier = latency_tier(latency) if has_latency else 1
+        region = detect_region(ob, geoip)
+        buckets.setdefault((tier, region), []).append((latency, tag))
+
+    groups = []
+    tiers = {}  # tier -> [leaf tag]
+    for (tier, region), members in sorted(buckets.items()):
+        members.sort(key=lambda m: (m[0] is None, m[0] or 0))
+        leaf_tag = f"{GROUP_PREFIX}{region}-T{tier}"
+        groups.append(urltest(leaf_tag, [m[1] for m in members]))
+        tiers.setdefault(tier, []).append(leaf_tag)
+
+    chain = []
+    for tier, leaves in sorted(tiers.items()):
+        if len(leaves) == 1:
+            chain.append(leaves[0])
+        else:
+            tier_tag = f"{GROUP_PREFIX}Tier{tier}"
+            groups.append(urltest(tier_tag, leaves))
+            chain.append(tier_tag)
+
+    # 顶层组成员很少，保持 3m 间隔；较大的 tolerance 避免在延迟接近的层级之间频繁切换
+    top = urltest(TOP_GROUP_TAG, chain + ([fallback] if fallback else []), tolerance=100)
+    top["interval"] = "3m"
+    groups.append(top)
+    return groups
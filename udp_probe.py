@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+import re
+import select
+import socket
+import sys
+import time
+
+from node_health import UDP_PROTOCOLS, build_quic_probe
+
+# 每个节点发送的探测包数量与发送间隔
+DEFAULT_COUNT = 10
+DEFAULT_INTERVAL = 0.05
+DEFAULT_TIMEOUT = 1.0
+DEFAULT_CONCURRENCY = 16
+
+# 丢包率超过该值的节点在排名中视为不可用
+DEFAULT_MAX_LOSS = 0.5
+
+# 探测包中 DCID 的位置 (1 字节首部 + 4 字节版本 + 1 字节长度)，用于匹配回包
+_DCID_OFFSET = 6
+_DCID_LEN = 8
+
+
+def positive_int(value):
+    """argparse 类型：大于 0 的整数"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def _stats(rtts, sent):
+    """由 RTT 列表计算统计值：中位数 / p90 / 抖动 (相邻 RTT 差值的平均绝对值) / 丢包率"""
+    loss = 1 - len(rtts) / sent if sent else 1.0
+    if not rtts:
+        return {"sent": sent, "received": 0, "loss": loss, "rtt": None, "rtt_p90": None, "jitter": None}
+    ordered = sorted(rtts)
+    jitter = (sum(abs(b - a) for a, b in zip(rtts, rtts[1:])) / (len(rtts) - 1)) if len(rtts) > 1 else 0.0
+    return {
+        "sent": sent,
+        "received": len(rtts),
+        "loss": loss,
+        "rtt": ordered[len(ordered) // 2],
+        "rtt_p90": ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))],
+        "jitter": jitter,
+    }
+
+
+def probe_path(server, port, count=DEFAULT_COUNT, interval=DEFAULT_INTERVAL, timeout=DEFAULT_TIMEOUT):
+    """按固定间隔发送 count 个 QUIC Version Negotiation 探测包，统计 RTT、丢包与抖动
+
+    回包通过探测包中的随机连接 ID 匹配 (VN 回包会交换 DCID/SCID，回显服务原样返回)，
+    因此乱序与重复回包都不会影响统计。返回结果字典，error 非空表示无法探测
+    (解析失败或收到 ICMP 端口不可达)。
+    """
+    if count < 1:
+        raise ValueError(f"count must be at least 1, got {count}")
+    try:
+        family, _, _, _, addr = socket.getaddrinfo(server, port, 0, socket.SOCK_DGRAM)[0]
+    except OSError as e:
+        return dict(_stats([], 0), error=str(e) or e.__class__.__name__)
+
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    pending = {}  # 连接 ID -> 发送时间
+    rtts = []
+    sent = 0
+    error = None
+    try:
+        # connect 之后内核才会把 ICMP 不可达作为 ConnectionRefusedError 返回
+        sock.connect(addr)
+        next_send = time.perf_counter()
+        deadline = None
+        while True:
+            now = time.perf_counter()
+            if sent < count and now >= next_send:
+                packet = build_quic_probe()
+                pending[packet[_DCID_OFFSET:_DCID_OFFSET + _DCID_LEN]] = now
+                sock.send(packet)
+                sent += 1
+                next_send = now + interval
+                if sent == count:
+                    deadline = now + timeout
+            if deadline is not None and (now >= deadline or not pending):
+                break
+
+            wait = (next_send if sent < count else deadline) - time.perf_counter()
+            readable, _, _ = select.select([sock], [], [], max(0.0, wait))
+            if not readable:
+                continue
+            reply = sock.recv(2048)
+            received_at = time.perf_counter()
+            for cid, sent_at in list(pending.items()):
+                if cid in reply:
+                    rtts.append((received_at - sent_at) * 1000)
+                    del pending[cid]
+                    break
+    except OSError as e:
+        error = str(e) or e.__class__.__name__
+    finally:
+        sock.close()
+    return dict(_stats(rtts, sent or count), error=error)
+
+
+def effective_latency(result, max_loss=DEFAULT_MAX_LOSS):
+    """用于排名的等效延迟 (ms)：(中位 RTT + 2 × 抖动) / (1 - 丢包率)
+
+    丢包率超过 max_loss 或没有任何回包时返回 None。
+    """
+    if result.get("rtt") is None or result["loss"] > max_loss:
+        return None
+    return (result["rtt"] + 2 * result["jitter"]) / (1 - result["loss"])
+
+
+def to_health(result, max_loss=DEFAULT_MAX_LOSS):
+    """转换为 node_health.check_node() 的结果格式，供 merge_configs 的健康检查与分层使用
+
+    完全没有回包 (例如开启了 obfs 的 hysteria2 静默丢弃) 时无法判断，与 node_health 一致按存活处理。
+    """
+    if result.get("error"):
+        return {"alive": False, "latency": None, "method": "udp-path", "error": result["error"]}
+    if result["received"] and result["loss"] > max_loss:
+        return {"alive": False, "latency": None, "method": "udp-path", "error": f"loss {result['loss']:.0%}"}
+    return {
+        "alive": True,
+        "latency": effective_latency(result, max_loss),
+        "method": "udp-path",
+        "error": None if result["received"] else "no reply (unknown)",
+    }
+
+
+def probe_nodes(outbounds, concurrency=DEFAULT_CONCURRENCY, count=DEFAULT_COUNT,
+                interval=DEFAULT_INTERVAL, timeout=DEFAULT_TIMEOUT):
+    """并发探测基于 QUIC 的出站 (hysteria2 / tuic 等)，返回 tag -> probe_path() 结果"""
+    targets = [o for o in outbounds if o.get('type') in UDP_PROTOCOLS
+               and o.get('server') and isinstance(o.get('server_port'), int)]
+    if not targets:
+        return {}
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(targets)))) as pool:
+        results = pool.map(lambda o: probe_path(o['server'], o['server_port'], count, interval, timeout), targets)
+        return {o.get('tag'): r for o, r in zip(targets, results)}
+
+
+def serve_echo(port, host="127.0.0.1", loss=0.0, delay_ms=0.0):
+    """UDP 回显服务 (阻塞运行)，可模拟丢包与固定延迟，用于在本地代替真实的 QUIC 服务端"""
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, port))
+    print(f"[*] UDP echo server on {host}:{port} (loss {loss:.0%}, delay {delay_ms:g} ms)")
+    delayed = []  # (发送时间, 数据, 地址)
+    try:
+        while True:
+            wait = max(0.0, delayed[0][0] - time.perf_counter()) if delayed else None
+            readable, _, _ = select.select([sock], [], [], wait)
+            if readable:
+                data, addr = sock.recvfrom(2048)
+                if random.random() >= loss:
+                    delayed.append((time.perf_counter() + delay_ms / 1000, data, addr))
+            now = time.perf_counter()
+            while delayed and delayed[0][0] <= now:
+                _, data, addr = delayed.pop(0)
+                sock.sendto(data, addr)
+    except KeyboardInterrupt:
+        print("\n[*] Stopping echo server...")
+    finally:
+        sock.close()
+
+
+def format_result(result):
+    """单行的可读结果"""
+    if result.get("error"):
+        return f"error: {result['error']}"
+    if not result["received"]:
+        return f"no reply from {result['sent']} probes"
+    return (f"rtt {result['rtt']:.1f} ms (p90 {result['rtt_p90']:.1f}), jitter {result['jitter']:.1f} ms, "
+            f"loss {result['loss']:.0%} ({result['received']}/{result['sent']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure UDP path RTT, loss and jitter to QUIC-based (hysteria2/tuic) nodes.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    probe = sub.add_parser('probe', help='Probe the QUIC-based outbounds of a Sing-box config, or one host:port')
+    probe.add_argument('-i', '--input', default='/etc/sing-box/config.json', help='Path to Sing-box config')
+    probe.add_argument('-t', '--target', help='Probe a single HOST:PORT instead of the config')
+    probe.add_argument('--tag', help='Only probe outbounds whose tag matches this regex')
+    probe.add_argument('-n', '--count', type=positive_int, default=DEFAULT_COUNT, help=f'Probes per node (default: {DEFAULT_COUNT})')
+    probe.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help=f'Seconds between probes (default: {DEFAULT_INTERVAL})')
+    probe.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help=f'Seconds to wait after the last probe (default: {DEFAULT_TIMEOUT})')
+    probe.add_argument('-j', '--concurrency', type=int, default=DEFAULT_CONCURRENCY, help=f'Nodes probed at once (default: {DEFAULT_CONCURRENCY})')
+    probe.add_argument('--json', action='store_true', help='Print results as JSON')
+
+    echo = sub.add_parser('echo', help='Run a local UDP echo server that stands in for a QUIC server')
+    echo.add_argument('-p', '--port', type=int, required=True, help='UDP port to listen on')
+    echo.add_argument('--host', default='127.0.0.1', help='Address to bind (default: 127.0.0.1)')
+    echo.add_argument('--loss', type=float, default=0.0, help='Fraction of packets to drop (0-1)')
+    echo.add_argument('--delay', type=float, default=0.0, help='Added one-way delay in ms')
+    args = parser.parse_args()
+
+    if args.command == 'echo':
+        serve_echo(args.port, args.host, args.loss, args.delay)
+        return
+
+    if args.target:
+        host, _, port = args.target.rpartition(':')
+        if not host or not port.isdigit():
+            parser.error("--target must be HOST:PORT")
+        results = {args.target: probe_path(host.strip('[]'), int(port), args.count, args.interval, args.timeout)}
+    else:
+        try:
+            with open(args.input, 'r') as f:
+                outbounds = json.load(f).get('outbounds', [])
+        except (OSError, ValueError) as e:
+            print(f"Error: Cannot read Sing-box config {args.input}: {e}")
+            sys.exit(1)
+        if args.tag:
+            pattern = re.compile(args.tag)
+            outbounds = [o for o in outbounds if pattern.search(o.get('tag') or "")]
+        print(f"[*] Probing QUIC-based outbounds in {args.input}...", file=sys.stderr)
+        results = probe_nodes(outbounds, args.concurrency, args.count, args.interval, args.timeout)
+        if not results:
+            print("Warning: No hysteria2/tuic outbounds found.")
+            sys.exit(1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for tag, result in sorted(results.items(), key=lambda kv: (effective_latency(kv[1]) is None, effective_latency(kv[1]) or 0)):
+        print(f"[{'+' if effective_latency(result) is not None else '!'}] {tag}: {format_result(result)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,23 @@
 #!/usr/bin/env python3
+import argparse
 import json
 import os
 import subprocess
 import csv
 import sys
 import copy
+import time
+import ipaddress
+import traceback
+from collections import deque
+
+import config_apply
+from singbox_validate import validate_config, print_errors
+from metrics import Metrics
+from ip_pool import IPCandidateSet
+from ip_selection import select_diverse, diversity_summary, subnet_key
+from node_health import probe_tcp
+from vantage import load_vantages, load_vantage_source, aggregate_rankings, serve_collector
 
 # ================= 配置部分 =================
 # 默认输入文件路径
@@ -17,6 +30,7 @@ CONFIG_JSON_FILE = os.getenv("CONFIG_JSON_FILE", DEFAULT_CONFIG_PATH)
 
 # 默认输出文件路径
 MERGED_IP_FILE = "./ip.txt"
+MERGED_IP_BIN_FILE = "./ip.bin"  # 与 ip.txt 内容相同的紧凑二进制格式 (见 ip_pool.py)
 RESULT_CSV_FILE = "./result.csv"
 NEW_CONFIG_JSON_FILE = "./config.json"
 
@@ -24,10 +38,41 @@ NEW_CONFIG_JSON_FILE = "./config.json"
 TAG_PREFIX = "cloudflare"
 MAX_TAGS = 15
 MIN_SPEED = 13.0  # 最低速度阈值 (MB/s)
+# 多样性约束：每个数据中心 (CSV 地区码列) / 每个 /24 子网最多选中的 IP 数，0 表示不限制
+MAX_PER_COLO = int(os.getenv("MAX_PER_COLO", "5"))
+MAX_PER_SUBNET = int(os.getenv("MAX_PER_SUBNET", "2"))
 EXTRA_RESULT_CSV = os.path.expanduser("~/user_data/tools/cfsppedtest/443/result.csv")
+
+# 多测速点聚合：逗号分隔的 CSV 文件 / 目录 / collector URL
+VANTAGE_SOURCES = [s.strip() for s in os.getenv("VANTAGE_SOURCES", "").split(",") if s.strip()]
+LOCAL_VANTAGE = os.getenv("LOCAL_VANTAGE", "local")  # 本机 result.csv 在聚合中的测速点名称
+COLLECTOR_DIR = os.getenv("COLLECTOR_DIR", os.path.expanduser("~/user_data/tools/cfvantage"))
+COLLECTOR_PORT = int(os.getenv("COLLECTOR_PORT", "10087"))
+COLLECTOR_BIND = os.getenv("COLLECTOR_BIND", "127.0.0.1")  # 需要接收其它测速点上传时改为 0.0.0.0 或内网地址
+COLLECTOR_TOKEN = os.getenv("COLLECTOR_TOKEN", "")         # 收集服务的共享令牌，上传与拉取均需携带
+
+# 持续监测模式 (--watch)：低频探测在用 IP 与少量轮换的备选 IP，在用 IP 明显变差时立即替换
+WATCH_INTERVAL = int(os.getenv("WATCH_INTERVAL", "60"))              # 每轮间隔 (秒)
+WATCH_RESERVE_SAMPLE = int(os.getenv("WATCH_RESERVE_SAMPLE", "5"))   # 每轮抽测的备选 IP 数
+WATCH_RESERVE_POOL = int(os.getenv("WATCH_RESERVE_POOL", "50"))      # 备选池大小 (按上次测速排名取前 N 个)
+WATCH_DEGRADE_RATIO = float(os.getenv("WATCH_DEGRADE_RATIO", "2.0")) # 在用 IP 中位延迟超过最佳备选的倍数即视为变差
+WATCH_SHORTLIST = int(os.getenv("WATCH_SHORTLIST", "3"))            # 每轮都探测的最佳备选数 (替换候选)
+# 探测绑定的物理网卡：sing-box 运行时 tun 的 auto_route 会截获普通连接，必须绕过 tun 才能测到直连延迟。
+# 为空时依次取 cloudflare 出站 / direct 出站的 bind_interface，再取系统默认路由的网卡
+WATCH_INTERFACE = os.getenv("WATCH_INTERFACE", "")
+WATCH_FAIL_LIMIT = 3        # 连续探测失败次数上限
+WATCH_WINDOW = 5            # 每个 IP 保留的最近探测结果数
+WATCH_MIN_SAMPLES = 3       # 判定变差前至少需要的探测次数
+WATCH_TIMEOUT = 2.0
+WATCH_CONCURRENCY = 4
+
+# 负载测试 (--bench)：并发下载按轮询分布到配置中的 cloudflare 出站 IP，结果追加到 BENCH_HISTORY
+BENCH_STREAMS = int(os.getenv("BENCH_STREAMS", "32"))        # 并发下载数
+BENCH_DURATION = float(os.getenv("BENCH_DURATION", "10"))    # 测试时长 (秒)
 # ===========================================
 
-import ipaddress
+# 运行指标 (通过 METRICS_EVENT_LOG / METRICS_PROM_FILE 环境变量输出)
+METRICS = Metrics("update_cloudflare_ips")
 
 def is_valid_ip(address):
     """验证是否为有效的 IPv4 地址"""
@@ -39,7 +84,7 @@ def is_valid_ip(address):
 
 def load_text_ips(file_path):
     """从文本文件加载 IP 地址，处理 IP#标签 格式"""
-    ips = set()
+    ips = IPCandidateSet()
     if not os.path.exists(file_path):
         print(f"Warning: {file_path} 不存在。")
         return ips
@@ -59,13 +104,20 @@ def load_text_ips(file_path):
             
             if is_valid_ip(clean_ip):
                 ips.add(clean_ip)
+            elif '/' in clean_ip:
+                # 支持 CIDR 网段 (展开为单个 IP)
+                try:
+                    if ipaddress.ip_network(clean_ip, strict=False).version == 4:
+                        ips.add_network(clean_ip)
+                except ValueError as e:
+                    print(f"Warning: 跳过网段 {clean_ip}: {e}")
             # 如果需要支持 IPv6，可以添加 elif is_valid_ipv6(clean_ip)
                 
     return ips
 
 def extract_ips_from_config(config_path):
     """从 sing-box 配置文件提取 outbound 中 443 端口的 IP"""
-    ips = set()
+    ips = IPCandidateSet()
     if not os.path.exists(config_path):
         print(f"Warning: {config_path} 不存在。")
         return ips
@@ -112,41 +164,76 @@ def run_cfst(ip_file):
     return True
 
 def get_top_ips(csv_path, count=15, min_speed=13.0):
-    """从 result.csv 提取速度大于 min_speed 的前 N 个 IP"""
-    new_ips = []
+    """从 result.csv 提取速度大于 min_speed 的 IP，并在数据中心 / 子网上限内选出前 N 个"""
+    candidates = []
     if not os.path.exists(csv_path):
         print(f"Error: {csv_path} 未生成。")
-        return new_ips
+        return []
 
     try:
         with open(csv_path, 'r', encoding='utf-8') as f:
             reader = csv.reader(f)
             header = next(reader) # 跳过表头
-            # 标准 CloudflareSpeedTest CSV 格式:
-            # IP 地址, 端口, 数据中心, 下载速度 (MB/s), 延迟 (ms), 测速时间
-            # 下载速度通常在第 4 列 (index 3)
+            # cfst CSV 格式:
+            # IP 地址, 已发送, 已接收, 丢包率, 平均延迟, 下载速度 (MB/s), 地区码
             for row in reader:
-                if row and len(row) > 3:
+                if row and len(row) > 5:
                     try:
                         speed = float(row[5])
                         if speed >= min_speed:
-                            new_ips.append(row[0])
+                            candidates.append({
+                                "ip": row[0],
+                                "score": speed,
+                                "colo": row[6].strip() if len(row) > 6 else "",
+                            })
                         else:
                             # 既然 CSV 是按速度降序排列的，如果当前速度小于阈值，后面的肯定也小于
                             break
                     except ValueError:
                         continue
-                if len(new_ips) >= count:
-                    break
     except Exception as e:
         print(f"解析 CSV 出错: {e}")
 
-    return new_ips
+    return [c["ip"] for c in select_with_diversity(candidates, count)]
+
+
+def select_with_diversity(candidates, count):
+    """按 MAX_PER_COLO / MAX_PER_SUBNET 约束选出前 N 个候选并打印分布情况"""
+    selected = select_diverse(candidates, count, MAX_PER_COLO, MAX_PER_SUBNET)
+    colos, subnets = diversity_summary(selected)
+    METRICS.set("colos_selected", colos)
+    METRICS.set("subnets_selected", subnets)
+    if selected:
+        print(f"从 {len(candidates)} 个候选中选出 {len(selected)} 个 IP，分布在 {colos} 个数据中心、{subnets} 个 /24 子网。")
+    return selected
+
+
+def get_aggregated_top_ips(include_local=True, count=15, min_speed=13.0, vantages=None):
+    """综合多个测速点的结果选出前 N 个 IP (各测速点平均速度需不低于 min_speed)
+
+    vantages 为调用方已加载的测速点结果 (load_vantages 的返回值)，未提供时从 VANTAGE_SOURCES 加载。
+    """
+    vantages = dict(load_vantages(VANTAGE_SOURCES, COLLECTOR_TOKEN) if vantages is None else vantages)
+    if include_local:
+        local_rows = list(load_vantage_source(RESULT_CSV_FILE).values())
+        if local_rows and local_rows[0]:
+            vantages[LOCAL_VANTAGE] = local_rows[0]
+    METRICS.set("vantages", len(vantages))
+    if not vantages:
+        print("Error: 没有可用的测速点结果。")
+        return []
+
+    print(f"正在聚合 {len(vantages)} 个测速点的结果: {', '.join(sorted(vantages))}")
+    ranking = aggregate_rankings(vantages)
+    top = select_with_diversity([r for r in ranking if r["speed"] >= min_speed], count)
+    for r in top[:3]:
+        print(f"  {r['ip']}: 综合分数 {r['score']:.3f}, 平均速度 {r['speed']:.2f} MB/s, 覆盖 {r['vantages']}/{len(vantages)} 个测速点")
+    return [r["ip"] for r in top]
 
 
 def extract_ips_from_csv(file_path):
     """从 CSV 文件提取第一列的 IP 地址"""
-    ips = set()
+    ips = IPCandidateSet()
     if not os.path.exists(file_path):
         return ips
     
@@ -168,10 +255,13 @@ def extract_ips_from_csv(file_path):
     return ips
 
 def update_singbox_config(original_config_path, new_ips, output_path):
-    """更新配置文件中 443 端口且为 IPv4 的 IP，并支持扩展和更新 urltest-selector-tcp"""
+    """更新配置文件中 443 端口且为 IPv4 的 IP，并支持扩展和更新 urltest-selector-tcp
+
+    返回写入配置的出站数量，未写入 (找不到文件、无模板、校验失败或出错) 时返回 0。
+    """
     if not os.path.exists(original_config_path):
         print(f"Error: 找不到原始配置文件 {original_config_path}")
-        return
+        return 0
     
     try:
         with open(original_config_path, 'r', encoding='utf-8') as f:
@@ -214,7 +304,7 @@ def update_singbox_config(original_config_path, new_ips, output_path):
         
         if not template_outbound and new_ips:
             print("Warning: 未找到符合条件的 outbound 或 cloudflare1 作为模板，无法扩展。")
-            return
+            return 0
 
         updated_count = 0
         # 2. 覆盖现有的符合条件的项
@@ -250,15 +340,23 @@ def update_singbox_config(original_config_path, new_ips, output_path):
                 ob['outbounds'] = all_cf_tags
                 break
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        # 写入前进行进程内校验
+        errors = validate_config(config)
+        if errors:
+            print(f"Error: 更新后的配置未通过校验 ({len(errors)} 个问题)，未写入 {output_path}:")
+            print_errors(errors)
+            return 0
         
+        config_apply.write_json(output_path, config)
+        
+        METRICS.set("outbounds_replaced", updated_count)
         print(f"成功更新/扩展了 {updated_count} 个 443 端口的 IPv4 地址到 {output_path}")
+        return updated_count
         
     except Exception as e:
         print(f"更新配置文件出错: {e}")
-        import traceback
         traceback.print_exc()
+        return 0
 
 def update_bestcf_repo():
     """更新 BestCF 仓库"""
@@ -289,7 +387,7 @@ def update_bestcf_repo():
 
 def manage_singbox_service(action):
     """使用 sudo systemctl 管理 sing-box 服务"""
-    if action not in ["stop", "start"]:
+    if action not in ["stop", "start", "restart"]:
         return
     
     print(f"正在执行: sudo systemctl {action} sing-box...")
@@ -300,54 +398,422 @@ def manage_singbox_service(action):
     except FileNotFoundError:
         print("错误: 未找到 systemctl 命令。")
 
-def main():
+def current_cloudflare_servers(config_path):
+    """返回配置中 443 端口且为 IPv4 的 cloudflare 出站: tag -> IP"""
+    servers = {}
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error reading config: {e}")
+        return servers
+    for ob in config.get('outbounds', []):
+        tag = ob.get('tag', '')
+        server = ob.get('server')
+        if tag.startswith(TAG_PREFIX) and ob.get('server_port') == 443 and server and is_valid_ip(server):
+            servers[tag] = server
+    return servers
+
+def load_reserve_ips(exclude):
+    """备选 IP：优先取上次 result.csv 的速度排名，没有时使用 ip.bin / ip.txt"""
+    ordered = []
+    if os.path.exists(RESULT_CSV_FILE):
+        for rows in load_vantage_source(RESULT_CSV_FILE).values():
+            ordered = [r["ip"] for r in sorted(rows, key=lambda r: r["speed"], reverse=True)]
+    elif os.path.exists(MERGED_IP_BIN_FILE):
+        ordered = list(IPCandidateSet.load(MERGED_IP_BIN_FILE))
+    elif os.path.exists(MERGED_IP_FILE):
+        ordered = list(load_text_ips(MERGED_IP_FILE))
+    reserves = []
+    for ip in ordered:
+        if ip not in exclude and is_valid_ip(ip) and ip not in reserves:
+            reserves.append(ip)
+            if len(reserves) >= WATCH_RESERVE_POOL:
+                break
+    return reserves
+
+def default_route_interface():
+    """/proc/net/route 中默认路由 (跃点最小) 的网卡，找不到时返回 None"""
+    best = None
+    try:
+        with open("/proc/net/route", 'r') as f:
+            next(f, None)
+            for line in f:
+                fields = line.split()
+                if len(fields) > 6 and fields[1] == "00000000" and fields[7] == "00000000":
+                    metric = int(fields[6])
+                    if best is None or metric < best[0]:
+                        best = (metric, fields[0])
+    except (OSError, ValueError):
+        return None
+    return best[1] if best else None
+
+def probe_interface(config_path):
+    """探测绑定的物理网卡：WATCH_INTERFACE > 出站的 bind_interface > 默认路由网卡"""
+    if WATCH_INTERFACE:
+        return WATCH_INTERFACE
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            outbounds = json.load(f).get('outbounds', [])
+    except (OSError, ValueError):
+        outbounds = []
+    for match in (lambda ob: ob.get('tag', '').startswith(TAG_PREFIX), lambda ob: ob.get('type') == 'direct'):
+        for ob in outbounds:
+            if match(ob) and ob.get('bind_interface'):
+                return ob['bind_interface']
+    return default_route_interface()
+
+def bind_interface_error(interface):
+    """检查能否绑定网卡 (不存在或权限不足时每次探测都会失败)，返回错误信息或 None"""
+    import socket
+    with socket.socket() as sock:
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, interface.encode())
+        except OSError as e:
+            return str(e) or e.__class__.__name__
+    return None
+
+def probe_ips(ips, interface=None):
+    """低并发 TCP 握手探测 (绑定 interface 绕过 tun)，返回 IP -> 延迟 ms (失败为 None)"""
+    if not ips:
+        return {}
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(WATCH_CONCURRENCY, len(ips))) as pool:
+        results = pool.map(lambda ip: probe_tcp(ip, 443, WATCH_TIMEOUT, interface)[1], ips)
+        return dict(zip(ips, results))
+
+def shortlist_reserves(reserves, history, limit=WATCH_SHORTLIST):
+    """最近一次探测成功且分数最好的 limit 个备选，每轮都探测，使其尽快攒够替换所需的样本"""
+    ranked = sorted((window_score(history[ip]), ip) for ip in reserves
+                    if history.get(ip) and history[ip][-1] is not None)
+    return [ip for _, ip in ranked[:limit]]
+
+def window_score(samples):
+    """最近几次探测的中位延迟，失败按超时计"""
+    values = sorted(WATCH_TIMEOUT * 1000 if v is None else v for v in samples)
+    return values[len(values) // 2]
+
+def consecutive_failures(samples):
+    count = 0
+    for v in reversed(samples):
+        if v is not None:
+            break
+        count += 1
+    return count
+
+def find_swap(in_use, reserves, history):
+    """找出最差且已变差的在用出站及用于替换的最佳备选，返回 (tag, 旧 IP, 新 IP, 原因) 或 None"""
+    ranked_reserves = sorted(
+        (window_score(history[ip]), ip) for ip in reserves
+        if len(history.get(ip, ())) >= 2 and history[ip][-1] is not None
+    )
+    if not ranked_reserves:
+        return None
+    best_score = ranked_reserves[0][0]
+
+    worst = None
+    for tag, ip in in_use.items():
+        samples = history.get(ip, ())
+        fails = consecutive_failures(samples)
+        score = window_score(samples) if samples else 0
+        if fails >= WATCH_FAIL_LIMIT:
+            reason = f"连续 {fails} 次探测失败"
+        elif len(samples) >= WATCH_MIN_SAMPLES and score > WATCH_DEGRADE_RATIO * best_score:
+            reason = f"中位延迟 {score:.0f} ms，最佳备选 {best_score:.0f} ms"
+        else:
+            continue
+        key = (fails, score)
+        if worst is None or key > worst[0]:
+            worst = (key, tag, ip, reason)
+    if worst is None:
+        return None
+
+    _, tag, old_ip, reason = worst
+    old_samples = history.get(old_ip, ())
+    failing = consecutive_failures(old_samples) >= WATCH_FAIL_LIMIT
+    # 保持子网分散：替换后同一 /24 的在用 IP 数不超过 MAX_PER_SUBNET
+    subnets = {}
+    for ip in in_use.values():
+        if ip != old_ip:
+            subnets[subnet_key(ip)] = subnets.get(subnet_key(ip), 0) + 1
+    for score, ip in ranked_reserves:
+        if not failing and score * WATCH_DEGRADE_RATIO > window_score(old_samples):
+            break  # 剩余备选已不足以明显优于当前 IP
+        if not MAX_PER_SUBNET or subnets.get(subnet_key(ip), 0) < MAX_PER_SUBNET:
+            return tag, old_ip, ip, reason
+    return None
+
+def replace_outbound_server(config_path, tag, new_ip, output_path):
+    """只替换指定出站的 server 字段，通过 config_apply 事务式写入并重启服务，返回新配置是否生效
+
+    校验失败时不写入；重启后服务在 APPLY_HEALTH_TIMEOUT 秒内未恢复健康时自动回滚到替换前的配置。
+    """
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error reading config: {e}")
+        return False
+    for ob in config.get('outbounds', []):
+        if ob.get('tag') == tag:
+            ob['server'] = new_ip
+            break
+    else:
+        print(f"Warning: 配置中找不到出站 {tag}。")
+        return False
+    return config_apply.apply_config(config, output_path)
+
+def watch_loop(max_rounds=None):
+    """持续监测在用的 cloudflare 出站，变差时用最佳备选 IP 替换并重启服务"""
+    history = {}  # IP -> 最近 WATCH_WINDOW 次探测延迟
+    rejected = set()  # 替换后导致服务不健康 (已回滚) 的 IP，不再作为备选
+    offset = 0
+    config_path = CONFIG_JSON_FILE
+    rounds = 0
+    interface = probe_interface(config_path)
+    if interface:
+        error = bind_interface_error(interface)
+        if error:
+            print(f"Error: 无法将探测绑定到网卡 {interface} ({error})，需要 root 权限或设置正确的 WATCH_INTERFACE。")
+            return
+        print(f"探测绑定网卡 {interface}，绕过 sing-box 的 tun 直连测量。")
+    else:
+        print("Warning: 找不到物理网卡，sing-box 开启 tun 时探测结果会经过代理。可设置 WATCH_INTERFACE。")
+    print(f"进入持续监测模式: 每 {WATCH_INTERVAL} 秒探测一次在用 IP、{WATCH_SHORTLIST} 个最佳备选与 {WATCH_RESERVE_SAMPLE} 个轮换备选 IP (Ctrl+C 退出)。")
+    while max_rounds is None or rounds < max_rounds:
+        rounds += 1
+        in_use = current_cloudflare_servers(config_path)
+        reserves = load_reserve_ips(set(in_use.values()) | rejected)
+        if not in_use or not reserves:
+            print("Warning: 没有在用的 cloudflare 出站或备选 IP，等待下一轮。")
+        else:
+            # 最佳备选每轮都测，保证替换候选有足够的样本；其余备选轮换抽样，逐轮覆盖整个备选池
+            shortlist = shortlist_reserves(reserves, history)
+            count = min(WATCH_RESERVE_SAMPLE, len(reserves))
+            sample = [reserves[(offset + i) % len(reserves)] for i in range(count)]
+            offset = (offset + count) % len(reserves)
+
+            results = probe_ips(list(dict.fromkeys(list(in_use.values()) + shortlist + sample)), interface)
+            for ip, latency in results.items():
+                history.setdefault(ip, deque(maxlen=WATCH_WINDOW)).append(latency)
+            # 只保留在用与备选池中的 IP
+            keep = set(in_use.values()) | set(reserves)
+            for ip in [ip for ip in history if ip not in keep]:
+                del history[ip]
+            METRICS.inc("watch_rounds")
+            METRICS.inc("watch_probes", len(results))
+
+            swap = find_swap(in_use, reserves, history)
+            if swap:
+                tag, old_ip, new_ip, reason = swap
+                print(f"{tag} ({old_ip}) 变差: {reason}，替换为 {new_ip}。")
+                if replace_outbound_server(config_path, tag, new_ip, NEW_CONFIG_JSON_FILE):
+                    config_path = NEW_CONFIG_JSON_FILE
+                    METRICS.inc("watch_swaps")
+                    METRICS.event("watch_swap", tag=tag, old=old_ip, new=new_ip, reason=reason)
+                else:
+                    rejected.add(new_ip)
+                    METRICS.inc("watch_rollbacks")
+
+        if max_rounds is None or rounds < max_rounds:
+            time.sleep(WATCH_INTERVAL)
+
+def watch(max_rounds=None):
+    try:
+        watch_loop(max_rounds)
+    except KeyboardInterrupt:
+        print("\n停止持续监测。")
+    finally:
+        METRICS.finish(True)
+        counters = METRICS.counters
+        print(f"监测统计: {counters.get('watch_rounds', 0)} 轮，{counters.get('watch_probes', 0)} 次探测，"
+              f"{counters.get('watch_swaps', 0)} 次替换，{counters.get('watch_rollbacks', 0)} 次回滚。")
+
+def bench():
+    """对配置中在用的 cloudflare 出站 IP 做并发下载负载测试，与上一次结果比较，返回是否没有 IP 在负载下失效"""
+    import load_bench
+    config_path = NEW_CONFIG_JSON_FILE if os.path.exists(NEW_CONFIG_JSON_FILE) else CONFIG_JSON_FILE
+    ips = list(dict.fromkeys(current_cloudflare_servers(config_path).values()))
+    if not ips:
+        print(f"Warning: {config_path} 中没有 cloudflare 出站。")
+        return False
+
+    print(f"正在对 {len(ips)} 个 IP 进行负载测试: {max(BENCH_STREAMS, len(ips))} 个并发下载，持续 {BENCH_DURATION:g} 秒...")
+    # 与 cfst 一样在测试期间关闭服务，测量直连路径
+    with METRICS.phase("service_stop"):
+        manage_singbox_service("stop")
+    try:
+        with METRICS.phase("bench"):
+            requests, wall = load_bench.run_benchmark(ips, load_bench.DEFAULT_URL, BENCH_STREAMS, BENCH_DURATION)
+    finally:
+        with METRICS.phase("service_start"):
+            manage_singbox_service("start")
+
+    record = load_bench.summarize(requests, ips, wall, load_bench.load_solo_speeds(RESULT_CSV_FILE), BENCH_STREAMS)
+    record.update(url=load_bench.DEFAULT_URL, streams=max(BENCH_STREAMS, len(ips)))
+    previous = load_bench.load_last_record(load_bench.DEFAULT_HISTORY)
+    load_bench.append_record(load_bench.DEFAULT_HISTORY, record)
+    print(load_bench.format_report(record, previous))
+
+    collapsed = [ip for ip, e in record["per_ip"].items() if e["collapsed"]]
+    METRICS.set("bench_aggregate_mbps", round(record["aggregate_mbps"], 2))
+    METRICS.set("bench_fairness", round(record["fairness"], 3))
+    METRICS.set("bench_collapsed", len(collapsed))
+    if collapsed:
+        print(f"Warning: {len(collapsed)} 个 IP 在负载下失效: {', '.join(collapsed)}")
+    return not collapsed
+
+def main(aggregate=False, aggregate_only=False):
+    success = False
+    try:
+        success = run_pipeline(aggregate, aggregate_only)
+    finally:
+        METRICS.finish(success)
+        print(f"各阶段耗时: {METRICS.summary()}")
+        if METRICS.profiler:
+            METRICS.profiler.write_report(NEW_CONFIG_JSON_FILE)
+
+def verify_update(previous):
+    """服务以新配置启动后检查健康状态，失败时回滚到 previous 并返回 False"""
+    try:
+        with open(NEW_CONFIG_JSON_FILE, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error reading config: {e}")
+        return False
+    with METRICS.phase("health_check"):
+        healthy = config_apply.verify_or_rollback(config, NEW_CONFIG_JSON_FILE, previous)
+    if not healthy:
+        METRICS.inc("rollbacks")
+    return healthy
+
+def select_and_update(aggregate, include_local=True, vantages=None):
+    """提取最优 IP 并更新配置，返回是否有出站被更新 (vantages 见 get_aggregated_top_ips)"""
+    # 3. 提取最优 IP (增加速度过滤)
+    with METRICS.phase("parse_csv"):
+        if aggregate:
+            top_ips = get_aggregated_top_ips(include_local, MAX_TAGS, MIN_SPEED, vantages)
+        else:
+            top_ips = get_top_ips(RESULT_CSV_FILE, MAX_TAGS, MIN_SPEED)
+    METRICS.set("ips_selected", len(top_ips))
+    if not top_ips:
+        print(f"未提取到下载速度大于 {MIN_SPEED} MB/s 的优选 IP，未更新配置。")
+        return False
+
+    print(f"提取到前 {len(top_ips)} 个速度 > {MIN_SPEED} MB/s 的最优 IP: {', '.join(top_ips[:3])}...")
+    
+    # 4. 更新配置
+    with METRICS.phase("config_rewrite"):
+        replaced = update_singbox_config(CONFIG_JSON_FILE, top_ips, NEW_CONFIG_JSON_FILE)
+    return replaced > 0
+
+def run_pipeline(aggregate=False, aggregate_only=False):
+    """执行完整的优选流程，返回是否成功更新配置"""
+    if aggregate_only:
+        # 仅聚合其它测速点已上传的结果，本机不执行 cfst
+        previous = config_apply.VersionStore().snapshot(NEW_CONFIG_JSON_FILE)
+        updated = select_and_update(True, include_local=False)
+        if updated:
+            with METRICS.phase("service_restart"):
+                manage_singbox_service("restart")
+            updated = verify_update(previous)
+        return updated
+
     # 0. 更新仓库
-    update_bestcf_repo()
+    with METRICS.phase("git_pull"):
+        update_bestcf_repo()
 
     # 1. 加载并合并 IP
     print("正在收集 IP 地址...")
-    ips = load_text_ips(CUCC_IP_FILE)
-    ips.update(extract_ips_from_config(CONFIG_JSON_FILE))
-    
-    # 新增：从额外结果文件合并 IP
-    extra_ips = extract_ips_from_csv(EXTRA_RESULT_CSV)
-    if extra_ips:
-        print(f"从额外结果文件提取了 {len(extra_ips)} 个 IP。")
-        ips.update(extra_ips)
+    with METRICS.phase("collect_ips"):
+        ips = load_text_ips(CUCC_IP_FILE)
+        METRICS.set("ips_from_text", len(ips))
+        config_ips = extract_ips_from_config(CONFIG_JSON_FILE)
+        METRICS.set("ips_from_config", len(config_ips))
+        ips.update(config_ips)
+        
+        # 新增：从额外结果文件合并 IP
+        extra_ips = extract_ips_from_csv(EXTRA_RESULT_CSV)
+        METRICS.set("ips_from_extra_csv", len(extra_ips))
+        if extra_ips:
+            print(f"从额外结果文件提取了 {len(extra_ips)} 个 IP。")
+            ips.update(extra_ips)
+
+        # 聚合模式下其它测速点测到的 IP 也参与本机测速；结果只加载一次，测速后的聚合沿用同一份
+        vantages = None
+        if aggregate:
+            vantages = load_vantages(VANTAGE_SOURCES, COLLECTOR_TOKEN)
+            vantage_ips = IPCandidateSet(r["ip"] for rows in vantages.values() for r in rows if is_valid_ip(r["ip"]))
+            METRICS.set("ips_from_vantages", len(vantage_ips))
+            if vantage_ips:
+                print(f"从其它测速点结果提取了 {len(vantage_ips)} 个 IP。")
+                ips.update(vantage_ips)
+    METRICS.set("ips_loaded", len(ips))
     
     if not ips:
         print("未找到任何 IP 地址，退出。")
         sys.exit(1)
     
-    with open(MERGED_IP_FILE, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(sorted(list(ips))))
-    print(f"合并后的 IP 已保存至: {MERGED_IP_FILE} (共 {len(ips)} 个)")
+    ips.write_text(MERGED_IP_FILE)
+    ips.save(MERGED_IP_BIN_FILE)
+    print(f"合并后的 IP 已保存至: {MERGED_IP_FILE} (共 {len(ips)} 个，二进制副本 {MERGED_IP_BIN_FILE}，{ips.nbytes()} 字节)")
 
     # 2. 运行 cfst
     # 在运行 cfst 之前关闭服务
-    manage_singbox_service("stop")
+    updated = False
+    # 保存改写前的配置，新配置启动后不健康时回滚
+    previous = config_apply.VersionStore().snapshot(NEW_CONFIG_JSON_FILE)
+    with METRICS.phase("service_stop"):
+        manage_singbox_service("stop")
     try:
-        if run_cfst(MERGED_IP_FILE):
-            # 3. 提取最优 IP (增加速度过滤)
-            top_ips = get_top_ips(RESULT_CSV_FILE, MAX_TAGS, MIN_SPEED)
-            if not top_ips:
-                print(f"未提取到下载速度大于 {MIN_SPEED} MB/s 的优选 IP，未更新配置。")
-            else:
-                print(f"提取到前 {len(top_ips)} 个速度 > {MIN_SPEED} MB/s 的最优 IP: {', '.join(top_ips[:3])}...")
-                
-                # 4. 更新配置
-                update_singbox_config(CONFIG_JSON_FILE, top_ips, NEW_CONFIG_JSON_FILE)
+        with METRICS.phase("cfst"):
+            cfst_ok = run_cfst(MERGED_IP_FILE)
+        METRICS.set("ips_probed", len(ips) if cfst_ok else 0)
+        if cfst_ok:
+            updated = select_and_update(aggregate, vantages=vantages)
         else:
             print("优选测试失败，未更新配置。")
     finally:
         # 无论成功与否，最后都重新开启服务
-        manage_singbox_service("start")
+        with METRICS.phase("service_start"):
+            manage_singbox_service("start")
+    if updated:
+        updated = verify_update(previous)
+    return updated
+
+def cli(argv=None):
+    """命令行入口：允许通过命令行参数重写路径（可选），未知参数报错退出"""
+    global CONFIG_JSON_FILE, NEW_CONFIG_JSON_FILE
+    parser = argparse.ArgumentParser(description='Select the fastest Cloudflare IPs with cfst and rewrite the cloudflare* outbounds of a Sing-box config.')
+    parser.add_argument('config', nargs='?', default=CONFIG_JSON_FILE, help=f'Sing-box config to read (default: {CONFIG_JSON_FILE})')
+    parser.add_argument('output', nargs='?', default=NEW_CONFIG_JSON_FILE, help=f'Path for the updated config (default: {NEW_CONFIG_JSON_FILE})')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--aggregate', action='store_true', help='Rank local results together with the vantages in VANTAGE_SOURCES')
+    mode.add_argument('--aggregate-only', action='store_true', help='Skip the local speed test and rank VANTAGE_SOURCES only')
+    mode.add_argument('--collector', action='store_true', help='Run the vantage result collector (COLLECTOR_* settings)')
+    mode.add_argument('--watch', action='store_true', help='Keep probing the selected IPs and swap in reserves when they degrade (WATCH_* settings)')
+    mode.add_argument('--bench', action='store_true', help='Load-test the selected IPs with concurrent downloads (BENCH_* settings)')
+    parser.add_argument('--profile', action='store_true', help='Record cProfile/tracemalloc data and write <output>.profile.txt')
+    args = parser.parse_args(argv)
+
+    if args.collector:
+        started = serve_collector(COLLECTOR_DIR, COLLECTOR_PORT, COLLECTOR_TOKEN, COLLECTOR_BIND)
+        sys.exit(0 if started else 1)
+    if args.profile:
+        from profiling import Profiler
+        METRICS.profiler = Profiler("update_cloudflare_ips")
+        METRICS.profiler.write_report_at_exit(args.output)
+    CONFIG_JSON_FILE = args.config
+    NEW_CONFIG_JSON_FILE = args.output
+    if args.watch:
+        watch()
+        sys.exit(0)
+    if args.bench:
+        ok = bench()
+        METRICS.finish(ok)
+        sys.exit(0 if ok else 1)
+
+    main(args.aggregate, args.aggregate_only)
 
 if __name__ == "__main__":
-    # 允许通过命令行参数重写路径（可选）
-    if len(sys.argv) > 1:
-        CONFIG_JSON_FILE = sys.argv[1]
-    if len(sys.argv) > 2:
-        NEW_CONFIG_JSON_FILE = sys.argv[2]
-        
-    main()
+    cli()
@@ -0,0 +1,218 @@
+import csv
+import hmac
+import io
+import json
+import os
+import re
+
+from config_apply import atomic_write
+
+# cfst result.csv 列: IP 地址, 已发送, 已接收, 丢包率, 平均延迟, 下载速度 (MB/s), 地区码
+COL_IP = 0
+COL_LATENCY = 4
+COL_SPEED = 5
+COL_COLO = 6
+
+FETCH_TIMEOUT = 15
+MAX_UPLOAD_BYTES = 4 * 1024 * 1024  # 单个测速点上传的 CSV 上限
+VANTAGE_NAME_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+
+def parse_result_csv(text):
+    """解析 cfst 结果 CSV 文本，返回 [{ip, speed, latency, colo}]"""
+    rows = []
+    reader = csv.reader(io.StringIO(text))
+    next(reader, None)  # 跳过表头
+    for row in reader:
+        if len(row) <= COL_SPEED:
+            continue
+        try:
+            speed = float(row[COL_SPEED])
+            latency = float(row[COL_LATENCY])
+        except ValueError:
+            continue
+        rows.append({
+            "ip": row[COL_IP].strip(),
+            "speed": speed,
+            "latency": latency,
+            "colo": row[COL_COLO].strip() if len(row) > COL_COLO else "",
+        })
+    return rows
+
+
+def _vantage_name(path):
+    """result.csv 这类通用文件名使用上级目录名作为测速点名称"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if stem == "result":
+        parent = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        return parent or stem
+    return stem
+
+
+def _fetch(url, token=""):
+    import urllib.request
+    request = urllib.request.Request(url)
+    if token:
+        request.add_header("Authorization", f"Bearer {token}")
+    with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as resp:
+        return resp.read().decode('utf-8')
+
+
+def load_vantage_source(source, token=""):
+    """加载一个测速来源，返回 {测速点: rows}
+
+    source 可以是:
+    - 单个 CSV 文件 (测速点名取文件名，result.csv 取上级目录名)
+    - 目录 (目录下每个 *.csv 为一个测速点，即 collector 的存储目录)
+    - http(s) URL：以 .csv 结尾时为单个测速点，否则视为 collector 的 /results 索引 (JSON)，
+      token 非空时以 Bearer 方式发送给 collector
+    """
+    results = {}
+    try:
+        if source.startswith(("http://", "https://")):
+            if source.endswith(".csv"):
+                name = os.path.splitext(os.path.basename(source))[0]
+                results[name] = parse_result_csv(_fetch(source, token))
+            else:
+                for name, text in json.loads(_fetch(source, token)).items():
+                    results[name] = parse_result_csv(text)
+        elif os.path.isdir(source):
+            for fname in sorted(os.listdir(source)):
+                if fname.endswith(".csv"):
+                    with open(os.path.join(source, fname), 'r', encoding='utf-8') as f:
+                        results[os.path.splitext(fname)[0]] = parse_result_csv(f.read())
+        elif os.path.exists(source):
+            with open(source, 'r', encoding='utf-8') as f:
+                results[_vantage_name(source)] = parse_result_csv(f.read())
+        else:
+            print(f"Warning: 测速来源 {source} 不存在。")
+    except (OSError, ValueError) as e:
+        print(f"Warning: 读取测速来源 {source} 出错: {e}")
+    return results
+
+
+def load_vantages(sources, token=""):
+    """加载多个测速来源并合并，同名测速点后加载的覆盖先加载的"""
+    vantages = {}
+    for source in sources:
+        vantages.update(load_vantage_source(source, token))
+    return {k: v for k, v in vantages.items() if v}
+
+
+def normalize_vantage(rows):
+    """单个测速点内归一化：速度除以该点最高速度，延迟取该点最低延迟与自身之比，返回 ip -> (0~1 分数, 速度)"""
+    max_speed = max((r["speed"] for r in rows), default=0) or 1.0
+    min_latency = min((r["latency"] for r in rows if r["latency"] > 0), default=0)
+    scores = {}
+    for r in rows:
+        speed_score = r["speed"] / max_speed
+        latency_score = (min_latency / r["latency"]) if r["latency"] > 0 and min_latency else 0.0
+        score = 0.8 * speed_score + 0.2 * latency_score
+        # 同一测速点内同一 IP 多次出现时取最好的一次
+        if r["ip"] not in scores or score > scores[r["ip"]][0]:
+            scores[r["ip"]] = (score, r["speed"])
+    return scores
+
+
+def aggregate_rankings(vantages):
+    """合并多个测速点的结果，返回按综合分数降序排列的列表
+
+    综合分数 = 各测速点归一化分数的平均值 × sqrt(覆盖率)，
+    覆盖率为测到该 IP 的测速点占比，避免只被一个点测到的 IP 排名过高。
+    """
+    total = len(vantages)
+    per_ip = {}  # ip -> [(score, speed)]
+    colos = {}
+    for rows in vantages.values():
+        for ip, value in normalize_vantage(rows).items():
+            per_ip.setdefault(ip, []).append(value)
+        for r in rows:
+            if r["colo"]:
+                colos.setdefault(r["ip"], r["colo"])
+
+    ranking = []
+    for ip, values in per_ip.items():
+        coverage = len(values) / total
+        mean_score = sum(v[0] for v in values) / len(values)
+        ranking.append({
+            "ip": ip,
+            "score": mean_score * coverage ** 0.5,
+            "speed": sum(v[1] for v in values) / len(values),
+            "vantages": len(values),
+            "colo": colos.get(ip, ""),
+        })
+    ranking.sort(key=lambda r: r["score"], reverse=True)
+    return ranking
+
+
+def serve_collector(store_dir, port, token, bind="127.0.0.1"):
+    """启动本地测速结果收集服务 (阻塞运行)，返回是否成功启动
+
+    - POST /results/<测速点>  上传 cfst result.csv 内容，保存为 <store_dir>/<测速点>.csv
+    - GET  /results           返回 {测速点: CSV 文本} 的 JSON 索引，供 VANTAGE_SOURCES 使用
+
+    两个接口都要求 "Authorization: Bearer <token>"，上传内容超过 MAX_UPLOAD_BYTES 时返回 413。
+    """
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    if not token:
+        print("Error: 收集服务需要共享令牌，请设置 COLLECTOR_TOKEN。")
+        return False
+    expected = f"Bearer {token}".encode('utf-8')
+    os.makedirs(store_dir, exist_ok=True)
+
+    class CollectorHandler(BaseHTTPRequestHandler):
+        def _reply(self, code, body=b"", content_type="text/plain; charset=utf-8"):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _authorized(self):
+            supplied = self.headers.get("Authorization", "").encode('utf-8')
+            if hmac.compare_digest(supplied, expected):
+                return True
+            self._reply(401, b"missing or invalid token\n")
+            return False
+
+        def do_POST(self):
+            if not self._authorized():
+                return
+            name = self.path[len("/results/"):] if self.path.startswith("/results/") else ""
+            if not VANTAGE_NAME_RE.match(name):
+                return self._reply(400, b"invalid vantage name\n")
+            try:
+                length = int(self.headers.get("Content-Length", ""))
+            except ValueError:
+                return self._reply(411, b"Content-Length required\n")
+            if length < 0:
+                return self._reply(400, b"invalid Content-Length\n")
+            if length > MAX_UPLOAD_BYTES:
+                self.close_connection = True  # 不读取请求体，直接断开
+                return self._reply(413, f"upload exceeds {MAX_UPLOAD_BYTES} bytes\n".encode())
+            text = self.rfile.read(length).decode('utf-8', errors='replace')
+            rows = parse_result_csv(text)
+            atomic_write(os.path.join(store_dir, f"{name}.csv"), text)
+            print(f"收到测速点 {name} 的 {len(rows)} 条结果。")
+            self._reply(200, f"stored {len(rows)} rows\n".encode())
+
+        def do_GET(self):
+            if not self._authorized():
+                return
+            if self.path.rstrip('/') != "/results":
+                return self._reply(404)
+            index = {}
+            for fname in sorted(os.listdir(store_dir)):
+                if fname.endswith(".csv"):
+                    with open(os.path.join(store_dir, fname), 'r', encoding='utf-8') as f:
+                        index[os.path.splitext(fname)[0]] = f.read()
+            self._reply(200, json.dumps(index, ensure_ascii=False).encode('utf-8'), "application/json")
+
+    server = HTTPServer((bind, port), CollectorHandler)
+    print(f"测速结果收集服务已启动: http://{bind}:{port}/results (存储目录 {store_dir})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n正在停止收集服务...")
+        server.shutdown()
+    return True